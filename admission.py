@@ -0,0 +1,209 @@
+"""
+LLM呼び出しと検索の受付制御モジュール
+ユーザー・チャンネル・サーバーごと、および全体のトークンバケットで実行頻度を制限し、
+処理待ちの件数に上限を設けます。
+混雑時はランダム応答（監視による自動応答）から先に切り捨てます。
+"""
+
+import time
+import threading
+
+# 受付の種類
+KIND_ASK = 'ask'  # !ask コマンド
+KIND_SEARCH = 'search'  # 検索トリガー
+KIND_URGENT = 'urgent'  # メンション・名前の呼びかけ
+KIND_RANDOM = 'random'  # 監視チャンネルでのランダム応答
+
+# バケットの数がこれを超えたら満タンのバケットを削除する
+MAX_BUCKETS = 4096
+
+
+class AdmissionRejected(Exception):
+    """受付を拒否されたときの例外"""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    トークンバケット
+
+    Args:
+        per_minute (float): 1分あたりに補充されるトークン数（容量も同じ値）
+    """
+
+    def __init__(self, per_minute, now):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated_at = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now):
+        """トークンを1つ取れるようになるまでの秒数を返します（0なら今すぐ取れる）。"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Ticket:
+    """受付済みの処理。終了時に処理待ちの件数を減らす"""
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
+
+
+class AdmissionController:
+    """
+    トークンバケットと処理待ちの件数の上限による受付制御
+
+    Args:
+        user_per_minute (int): ユーザーごとの1分あたりの上限（0なら無制限）
+        channel_per_minute (int): チャンネルごとの1分あたりの上限（0なら無制限）
+        guild_per_minute (int): サーバーごとの1分あたりの上限（0なら無制限）
+        global_per_minute (int): 全体の1分あたりの上限（0なら無制限）
+        max_pending (int): 処理待ち（実行中を含む）の件数の上限
+        random_shed_percent (int): 処理待ちが上限のこの割合（%）に達したらランダム応答を切り捨てる
+    """
+
+    def __init__(self, user_per_minute=6, channel_per_minute=20, guild_per_minute=60,
+                 global_per_minute=120, max_pending=16, random_shed_percent=50):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.pending = 0
+        self.admitted = 0
+        self.rejected = {}
+        self.configure(user_per_minute, channel_per_minute, guild_per_minute,
+                       global_per_minute, max_pending, random_shed_percent)
+
+    def configure(self, user_per_minute, channel_per_minute, guild_per_minute,
+                  global_per_minute, max_pending, random_shed_percent):
+        """制限値を変更します。既存のバケットは作り直されます。"""
+        with self._lock:
+            self.limits = {
+                'user': user_per_minute,
+                'channel': channel_per_minute,
+                'guild': guild_per_minute,
+                'global': global_per_minute,
+            }
+            self.max_pending = max(1, max_pending)
+            self.random_shed_at = max(1, self.max_pending * random_shed_percent // 100)
+            self._buckets.clear()
+
+    def _bucket(self, scope, key, now):
+        per_minute = self.limits[scope]
+        if per_minute <= 0:
+            return None
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            bucket = self._buckets[(scope, key)] = TokenBucket(per_minute, now)
+        return bucket
+
+    def _prune(self, now):
+        """使われていない（満タンの）バケットを削除します。"""
+        for key in [key for key, bucket in self._buckets.items() if bucket.is_full(now)]:
+            del self._buckets[key]
+
+    def _reject(self, kind, reason, retry_after=None):
+        self.rejected[kind] = self.rejected.get(kind, 0) + 1
+        raise AdmissionRejected(reason, retry_after)
+
+    def admit(self, kind, user_id=None, channel_id=None, guild_id=None):
+        """
+        処理を受け付けます。
+
+        Args:
+            kind (str): 受付の種類（KIND_ASK / KIND_SEARCH / KIND_URGENT / KIND_RANDOM）
+            user_id, channel_id, guild_id: 制限の単位となるID（Noneならその単位では制限しない）
+
+        Returns:
+            _Ticket: 処理が終わったら release() する（with文でも使用可能）
+
+        Raises:
+            AdmissionRejected: 混雑または実行頻度の上限により受け付けられない場合
+        """
+        now = time.monotonic()
+        with self._lock:
+            # 処理待ちが多い場合はランダム応答から先に切り捨てる
+            if kind == KIND_RANDOM and self.pending >= self.random_shed_at:
+                self._reject(kind, '混雑しているため自動応答を省略しました')
+            if self.pending >= self.max_pending:
+                self._reject(kind, '処理待ちのリクエストが多すぎます')
+
+            if len(self._buckets) > MAX_BUCKETS:
+                self._prune(now)
+            buckets = [
+                self._bucket(scope, key, now)
+                for scope, key in (('user', user_id), ('channel', channel_id), ('guild', guild_id), ('global', None))
+                if scope == 'global' or key is not None
+            ]
+            buckets = [bucket for bucket in buckets if bucket is not None]
+            # すべてのバケットから取れる場合だけトークンを消費する
+            retry_after = max((bucket.wait_time(now) for bucket in buckets), default=0.0)
+            if retry_after > 0:
+                self._reject(kind, 'リクエストの頻度が上限を超えました', retry_after)
+            for bucket in buckets:
+                bucket.take()
+
+            self.pending += 1
+            self.admitted += 1
+            return _Ticket(self)
+
+    def charge(self, kind, user_id):
+        """
+        ユーザーのバケットからトークンを1つ消費します（処理待ちの件数は増やしません）。
+        受付済みの処理にメッセージを加える場合（まとめ待ちのバーストに加わるなど）に使います。
+
+        Raises:
+            AdmissionRejected: ユーザーの実行頻度の上限を超えている場合
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket('user', user_id, now) if user_id is not None else None
+            if bucket is None:
+                return
+            retry_after = bucket.wait_time(now)
+            if retry_after > 0:
+                self._reject(kind, 'リクエストの頻度が上限を超えました', retry_after)
+            bucket.take()
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+
+    def stats(self):
+        """受付の統計を返します。"""
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'buckets': len(self._buckets),
+            }
@@ -0,0 +1,92 @@
+"""
+メッセージ分類のマイクロベンチマーク
+従来のループ（トリガー語・名前・エイリアスを1つずつ in で検索）と
+MessageClassifier（コンパイル済み正規表現で1回走査）の処理時間を比較します。
+
+使い方:
+    python benchmarks/bench_classifier.py [繰り返し回数]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_classifier import MessageClassifier
+
+SEARCH_TRIGGERS = ['検索して', '検索しろ', '検索', '調べて', '調べろ', 'ググって', 'ぐぐって', 'search ', '検索してください', '調べてください']
+BOT_ID = '123456789012345678'
+BOT_NAME = 'AI_Agent'
+BOT_ALIASES = ['AIエージェント', 'エージェント', 'AI', 'ボット']
+
+MESSAGES = [
+    'おはようございます、今日もよろしくお願いします',
+    '昨日のミーティングの議事録ってどこにありますか？',
+    'Pythonの非同期処理について教えてほしいです。asyncioとスレッドの違いがよくわかりません。',
+    f'<@{BOT_ID}> この関数のバグを見てもらえますか',
+    'エージェント、今日の天気は？',
+    '東京の天気を検索してください',
+    'ググって 最新のDiscord APIの仕様',
+    'this is a long english message without any trigger words ' * 5,
+]
+
+
+def legacy_classify(content, bot_aliases=BOT_ALIASES):
+    """bot.pyの従来の判定処理（ループと毎回のf-string・lower）"""
+    content = content.strip()
+    query = None
+    for trig in SEARCH_TRIGGERS:
+        if trig in content:
+            query = content.replace(trig, '').strip() or content
+            break
+    bot_mentioned = f'<@{BOT_ID}>' in content or f'<@!{BOT_ID}>' in content
+    bot_name_called = False
+    message_lower = content.lower()
+    bot_name = BOT_NAME.lower()
+    bot_aliases = [alias.lower() for alias in bot_aliases]
+    if bot_name in message_lower:
+        bot_name_called = True
+    else:
+        for alias in bot_aliases:
+            if alias in message_lower:
+                bot_name_called = True
+                break
+    return query, bot_mentioned, bot_name_called
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    # 重なるトリガーの扱いの違いを表示
+    classifier = MessageClassifier(SEARCH_TRIGGERS, BOT_ID, BOT_NAME, BOT_ALIASES)
+    for text in ['東京の天気を検索してください']:
+        print(f"入力: {text}")
+        print(f"  従来: query={legacy_classify(text)[0]!r}")
+        print(f"  分類器: query={classifier.classify(text).query!r}")
+
+    # 既定の設定と、エイリアスを増やした設定で比較する
+    scenarios = [
+        ('既定の設定', BOT_ALIASES),
+        ('エイリアス64個', BOT_ALIASES + [f'別名{i}' for i in range(60)]),
+    ]
+    for label, aliases in scenarios:
+        classifier = MessageClassifier(SEARCH_TRIGGERS, BOT_ID, BOT_NAME, aliases)
+
+        def run_legacy():
+            for text in MESSAGES:
+                legacy_classify(text, aliases)
+
+        def run_classifier():
+            for text in MESSAGES:
+                classifier.classify(text)
+
+        print(f"[{label}]")
+        for name, func in [('従来のループ', run_legacy), ('MessageClassifier', run_classifier)]:
+            elapsed = min(timeit.repeat(func, number=number, repeat=5))
+            per_message = elapsed / (number * len(MESSAGES)) * 1e6
+            print(f"  {name}: {per_message:.2f} µs/メッセージ")
+
+
+if __name__ == '__main__':
+    main()
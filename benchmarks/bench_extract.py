@@ -0,0 +1,167 @@
+"""
+本文抽出のベンチマーク
+保存したページ（または合成したページ）のコーパスについて、
+スレッドでの抽出（asyncio.to_thread、従来の方式）と extract_pool のプロセスプールでの抽出を比較します。
+
+スループット（ページ/秒）、1ページあたりの処理時間（p50/p95）、抽出中のイベントループの遅延を表示します。
+スレッドでの抽出はGILを保持するため、巨大なページを含むコーパスではイベントループの遅延が大きくなります。
+
+使い方:
+    python benchmarks/bench_extract.py [--corpus pages/] [--concurrency 4] [--rounds 3]
+    python benchmarks/bench_extract.py --save pages/   # 合成したコーパスを保存する
+
+コーパスのディレクトリには .html ファイルを置きます（ブラウザの「ページを保存」や curl で保存したもの）。
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import percentile, monitor_loop_lag
+
+# 合成するページの文章
+SENTENCES = [
+    '本日の会議では来期の計画について議論しました。',
+    'PythonのasyncioはI/Oバウンドな処理を効率よく並行して実行できます。',
+    '富士山の山開きは例年7月上旬に行われます。',
+    '新しいバージョンでは起動時間が大幅に短縮されました。',
+    'このライブラリはHTMLから本文だけを取り出すために使われます。',
+    'Kubernetesのクラスタを運用する際にはリソースの上限を設定することが重要です。',
+]
+
+
+# --- コーパス ---
+
+def article_page(rng, paragraphs):
+    """一般的な記事のページ（ナビゲーション・本文・フッター・スクリプトを含む）"""
+    body = ''.join(
+        f"<p>{''.join(rng.choice(SENTENCES) for _ in range(rng.randint(3, 8)))}</p>\n" for _ in range(paragraphs)
+    )
+    nav = ''.join(f'<li><a href="/page/{i}">メニュー{i}</a></li>' for i in range(30))
+    script = '<script>var data = ' + '[' + ','.join(str(i) for i in range(2000)) + '];</script>'
+    return (
+        f'<html><head><title>記事 {paragraphs}段落</title><meta name="description" content="ベンチマーク用の記事">'
+        f'{script}</head><body><header><nav><ul>{nav}</ul></nav></header>'
+        f'<main><article><h1>記事のタイトル</h1>{body}</article></main>'
+        f'<aside>関連記事</aside><footer>Copyright</footer></body></html>'
+    )
+
+
+def pathological_page(rng, rows):
+    """要素数の多い巨大なページ（大きな表と細かい要素の羅列）"""
+    table = ''.join(f'<tr><td>{i}</td><td>{rng.choice(SENTENCES)}</td><td><span>{i * 7}</span></td></tr>' for i in range(rows))
+    spans = ''.join(f'<div class="item"><span>{i}</span></div>' for i in range(rows))
+    return f'<html><head><title>巨大なページ</title></head><body><table>{table}</table>{spans}</body></html>'
+
+
+def synthetic_corpus(seed=0):
+    """合成したコーパス（記事のページ24件と巨大なページ2件）"""
+    rng = random.Random(seed)
+    pages = {}
+    for i in range(24):
+        pages[f'article_{i:02d}.html'] = article_page(rng, rng.choice([5, 20, 60, 150])).encode('utf-8')
+    for i, rows in enumerate([4000, 10000]):
+        pages[f'huge_{i}.html'] = pathological_page(rng, rows).encode('utf-8')
+    return pages
+
+
+def load_corpus(path):
+    """ディレクトリの .html ファイルを読み込みます。"""
+    pages = {}
+    for name in sorted(os.listdir(path)):
+        if name.endswith(('.html', '.htm')):
+            with open(os.path.join(path, name), 'rb') as f:
+                pages[name] = f.read()
+    if not pages:
+        raise SystemExit(f"{path} に .html ファイルがありません")
+    return pages
+
+
+# --- 計測 ---
+
+async def run_mode(mode, pages, concurrency, rounds, timeout):
+    """コーパスを concurrency 件ずつ並行して抽出し、処理時間とイベントループの遅延を計測します。"""
+    from web_scraper import _Download, _extract_from_document
+    from extract_pool import ExtractPool, ExtractError
+
+    pool = None
+    if mode == 'pool':
+        pool = ExtractPool(processes=concurrency, task_timeout=timeout)
+        # プロセスの起動時間は計測に含めない
+        await pool.start()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def extract(name, body):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if pool is None:
+                    await asyncio.to_thread(_extract_from_document, _Download(body, None, {}, False), name, 10000)
+                else:
+                    await pool.extract(body, None, name, 10000)
+            except ExtractError:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    lag = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag))
+    started = time.perf_counter()
+    await asyncio.gather(*[extract(name, body) for _ in range(rounds) for name, body in pages.items()])
+    elapsed = time.perf_counter() - started
+    lag_task.cancel()
+    stats = pool.stats() if pool is not None else None
+    if pool is not None:
+        await pool.close()
+    return {'elapsed': elapsed, 'latencies': latencies, 'lag': lag, 'failures': failures, 'pool': stats}
+
+
+def report(mode, result):
+    count = len(result['latencies'])
+    latencies, lag = result['latencies'], result['lag']
+    print(f"[{mode}]")
+    print(f"  スループット: {count / result['elapsed']:.1f} ページ/秒（{count}ページ、{result['elapsed']:.2f}秒）")
+    print(f"  1ページの処理時間: p50 {percentile(latencies, 50) * 1000:.0f} ms / p95 {percentile(latencies, 95) * 1000:.0f} ms")
+    print(f"  イベントループの遅延: p99 {percentile(lag, 99) * 1000:.1f} ms / 最大 {max(lag, default=0) * 1000:.1f} ms")
+    if result['failures']:
+        print(f"  失敗（制限時間の超過など）: {result['failures']}件")
+    if result['pool']:
+        print(f"  プロセスプール: {result['pool']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本文抽出のベンチマーク（スレッドとプロセスプールの比較）')
+    parser.add_argument('--corpus', help='保存したページ（.html）のディレクトリ。省略時は合成したページを使う')
+    parser.add_argument('--save', help='合成したコーパスをこのディレクトリに保存して終了する')
+    parser.add_argument('--concurrency', type=int, default=4, help='同時に抽出するページ数（プロセスプールのプロセス数）')
+    parser.add_argument('--rounds', type=int, default=3, help='コーパスを繰り返す回数')
+    parser.add_argument('--timeout', type=float, default=30, help='プロセスプールの1件の制限時間（秒）')
+    parser.add_argument('--mode', choices=['thread', 'pool', 'both'], default='both')
+    args = parser.parse_args()
+
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+        for name, body in synthetic_corpus().items():
+            with open(os.path.join(args.save, name), 'wb') as f:
+                f.write(body)
+        print(f"{args.save} に保存しました")
+        return
+
+    pages = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    total = sum(len(body) for body in pages.values())
+    print(f"コーパス: {len(pages)}ページ（合計 {total / (1024 * 1024):.1f} MB、最大 {max(len(b) for b in pages.values()) / 1024:.0f} KB）"
+          f"、同時実行数 {args.concurrency}、{args.rounds}回")
+    modes = ['thread', 'pool'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        report(mode, asyncio.run(run_mode(mode, pages, args.concurrency, args.rounds, args.timeout)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+"""
+メッセージ処理全体のリプレイベンチマーク
+Discord・LLM・DuckDuckGoに接続せずに、合成した（または記録した）メッセージを
+偽のチャンネル・メッセージを使って on_message と !ask に順に流し込みます。
+LLMとDuckDuckGoは fake_services のローカルサーバーで代用し、それぞれ応答までの待ち時間を設定できます。
+
+スループット、エンドツーエンドの処理時間（p50/p95/p99）、イベントループの遅延、メモリの増加量を表示します。
+
+使い方:
+    python benchmarks/bench_pipeline.py [--messages 500] [--rate 20] [--corpus messages.jsonl]
+
+コーパスのファイルは1行に1メッセージのJSONです（at は開始からの秒数、省略時は --rate の間隔）:
+    {"channel": 1, "author": "alice", "content": "AI_Agent、おはよう", "at": 0.5}
+"""
+
+import os
+import gc
+import sys
+import json
+import random
+import asyncio
+import argparse
+import datetime
+import itertools
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeServices
+
+# 合成するメッセージの種類と割合
+AMBIENT_MESSAGES = [
+    'おはようございます、今日もよろしくお願いします',
+    '昨日のミーティングの議事録ってどこにありますか？',
+    'Pythonの非同期処理について教えてほしいです。asyncioとスレッドの違いがよくわかりません。',
+    'お昼ご飯なに食べようかな',
+    'デプロイ終わりました、確認お願いします',
+    'このエラーの原因わかる人いますか？ TypeError: NoneType object is not subscriptable',
+]
+DIRECT_MESSAGES = [
+    'AI_Agent、{topic}について教えて',
+    'エージェント、{topic}のおすすめは？',
+    '<@{bot_id}> {topic}ってどう思う？',
+]
+ASK_MESSAGES = ['!ask {topic}とは何ですか？', '!ask {topic}の始め方を教えて']
+SEARCH_MESSAGES = ['{topic}を検索して', '{topic} 調べて']
+TOPICS = ['Rust', 'Kubernetes', '量子コンピュータ', 'カレー', '富士山', 'LangChain', 'SQLite', '機械学習', 'Discord bot', '宇宙']
+MIX = [('ambient', 0.6), ('direct', 0.2), ('ask', 0.1), ('search', 0.1)]
+
+BOT_ID = '123456789012345678'
+
+
+# --- Discordの偽オブジェクト ---
+
+_ids = itertools.count(1)
+
+
+class FakeAuthor:
+    def __init__(self, name, bot=False):
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.id = abs(hash(name)) % (1 << 32)
+
+
+class FakeGuild:
+    id = 1
+
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeChannel:
+    """送信したメッセージを記録するだけのチャンネル"""
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.sent = 0
+        self.edits = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        return FakeMessage(content, self, BOT_AUTHOR)
+
+    def typing(self):
+        return _Typing()
+
+
+class FakeMessage:
+    def __init__(self, content, channel, author):
+        self.id = next(_ids)
+        self.content = content
+        self.channel = channel
+        self.author = author
+        self.guild = FakeGuild()
+        self.mentions = []
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.received_at = None
+        self.done_at = None  # 応答の処理が終わった時刻
+        self.kind = 'ignored'  # 処理の種類（burst / ask / search / ignored）
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+        self.channel.edits += 1
+
+    async def delete(self):
+        pass
+
+
+class FakeContext:
+    def __init__(self, message):
+        self.message = message
+        self.channel = message.channel
+        self.author = message.author
+        self.guild = message.guild
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    def typing(self):
+        return _Typing()
+
+
+BOT_AUTHOR = FakeAuthor('AI_Agent', bot=True)
+
+
+# --- コーパス ---
+
+def synthetic_corpus(count, channels, rate, seed):
+    """種類の割合（MIX）に従ってメッセージを合成します。到着間隔は平均 1/rate 秒の指数分布です。"""
+    rng = random.Random(seed)
+    kinds, weights = zip(*MIX)
+    at = 0.0
+    corpus = []
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        topic = rng.choice(TOPICS)
+        if kind == 'ambient':
+            content = rng.choice(AMBIENT_MESSAGES)
+        elif kind == 'direct':
+            content = rng.choice(DIRECT_MESSAGES).format(topic=topic, bot_id=BOT_ID)
+        elif kind == 'ask':
+            content = rng.choice(ASK_MESSAGES).format(topic=topic)
+        else:
+            content = rng.choice(SEARCH_MESSAGES).format(topic=f'{topic} {i}')
+        corpus.append({
+            'channel': rng.randrange(channels) + 1,
+            'author': f'user{rng.randrange(channels * 5)}',
+            'content': content,
+            'at': at,
+        })
+        at += rng.expovariate(rate)
+    return corpus
+
+
+def load_corpus(path, rate):
+    corpus = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for index, line in enumerate(f):
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault('at', index / rate)
+                corpus.append(item)
+    return corpus
+
+
+# --- 計測 ---
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def rss_bytes():
+    """現在の常駐メモリ量（Linux以外では最大常駐メモリ量）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def monitor_loop_lag(samples, interval=0.01):
+    """一定間隔で眠り、予定より遅れて起きた時間をイベントループの遅延として記録します。"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def wait_until_idle(bot):
+    """受付済みの処理・まとめ待ちのメッセージ・LLM呼び出しがなくなるまで待ちます。"""
+    while (bot.admission.stats()['pending'] or bot.burst_coalescer.stats()['pending']
+           or bot.llm_runner.in_flight or bot.llm_runner.scheduler.stats()['active']):
+        await asyncio.sleep(0.05)
+
+
+async def replay(bot, corpus, speed):
+    """コーパスのメッセージを到着時刻どおりに流し込み、処理時間を集計します。"""
+    loop = asyncio.get_running_loop()
+    channels = {}
+    messages = []
+    tasks = []
+
+    # まとめて応答した場合は、まとめたメッセージすべての処理が終わった時刻を記録する
+    respond_to_burst = bot.burst_coalescer.handler
+    submit = bot.burst_coalescer.submit
+
+    async def recording_submit(key, item, urgent=False):
+        item[0].kind = 'burst'
+        await submit(key, item, urgent)
+
+    async def recording_handler(key, items):
+        try:
+            await respond_to_burst(key, items)
+        finally:
+            now = loop.time()
+            for message, _, _ in items:
+                message.done_at = now
+
+    bot.burst_coalescer.handler = recording_handler
+    bot.burst_coalescer.submit = recording_submit
+
+    async def dispatch_commands(message):
+        if message.content.startswith('!ask '):
+            message.kind = 'ask'
+            await bot.ask(FakeContext(message), question=message.content[len('!ask '):])
+
+    bot.bot.process_commands = dispatch_commands
+
+    async def deliver(message):
+        message.received_at = loop.time()
+        if bot.get_message_classifier().classify(message.content).trigger is not None:
+            message.kind = 'search'
+        await bot.on_message(message)
+        if message.kind != 'burst':
+            message.done_at = loop.time()
+
+    lag = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag))
+    gc.collect()
+    rss_before = rss_bytes()
+    started = loop.time()
+    try:
+        for item in corpus:
+            delay = started + item['at'] / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            channel = channels.setdefault(item['channel'], FakeChannel(item['channel']))
+            message = FakeMessage(item['content'], channel, FakeAuthor(item.get('author', 'user')))
+            messages.append(message)
+            tasks.append(asyncio.create_task(deliver(message)))
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await wait_until_idle(bot)
+        elapsed = loop.time() - started
+    finally:
+        lag_task.cancel()
+        bot.burst_coalescer.handler = respond_to_burst
+        del bot.burst_coalescer.submit
+    gc.collect()
+    rss_after = rss_bytes()
+    # イベントループを閉じる前に本文抽出のプロセスと接続を閉じる
+    await bot.close_resources()
+
+    # 応答しなかったメッセージ（ランダム応答の対象外・受付の拒否）は処理時間の集計から除く
+    latencies = {}
+    for message in messages:
+        if message.done_at is not None and message.kind != 'ignored':
+            latencies.setdefault(message.kind, []).append(message.done_at - message.received_at)
+    return {
+        'messages': len(messages),
+        'ignored': sum(1 for message in messages if message.kind == 'ignored'),
+        'elapsed': elapsed,
+        'latencies': latencies,
+        'lag': lag,
+        'rss_before': rss_before,
+        'rss_after': rss_after,
+        'sent': sum(channel.sent for channel in channels.values()),
+        'edits': sum(channel.edits for channel in channels.values()),
+    }
+
+
+def configure_bot(bot, args):
+    """ベンチマーク用に設定を上書きします（設定ファイルは読み書きしない）。"""
+    bot.bot_settings.update(
+        llm_provider='local',
+        llm_model='bench',
+        llm_backends=[],
+        monitor_all_channels=True,
+        response_rate=args.response_rate,
+        stream_responses=not args.no_stream,
+        stream_edit_interval_ms=args.edit_interval_ms,
+    )
+    if args.no_rate_limit:
+        bot.bot_settings.update(
+            rate_limit_user_per_minute=0,
+            rate_limit_channel_per_minute=0,
+            rate_limit_guild_per_minute=0,
+            rate_limit_global_per_minute=0,
+        )
+    bot.reload_llm()
+    bot.configure_admission()
+    bot.configure_burst_coalescer()
+    bot.configure_response_cache()
+    bot.bump_settings_version()
+
+
+def print_report(result, services):
+    lag = result['lag']
+    print(f"メッセージ数: {result['messages']}（応答の対象外 {result['ignored']}）")
+    print(f"経過時間: {result['elapsed']:.2f} 秒")
+    print(f"スループット: {result['messages'] / result['elapsed']:.1f} メッセージ/秒")
+    print("エンドツーエンドの処理時間（応答の対象になったメッセージ）:")
+    all_latencies = [latency for values in result['latencies'].values() for latency in values]
+    for kind, latencies in [('全体', all_latencies)] + sorted(result['latencies'].items()):
+        print(f"  {kind}: {len(latencies)} 件 / "
+              f"p50 {percentile(latencies, 50) * 1000:.0f} ms / "
+              f"p95 {percentile(latencies, 95) * 1000:.0f} ms / "
+              f"p99 {percentile(latencies, 99) * 1000:.0f} ms")
+    print("イベントループの遅延: "
+          f"p50 {percentile(lag, 50) * 1000:.1f} ms / "
+          f"p99 {percentile(lag, 99) * 1000:.1f} ms / "
+          f"最大 {max(lag, default=0) * 1000:.1f} ms")
+    growth = (result['rss_after'] - result['rss_before']) / (1024 * 1024)
+    print(f"メモリ: {result['rss_before'] / (1024 * 1024):.1f} MB → {result['rss_after'] / (1024 * 1024):.1f} MB（{growth:+.1f} MB）")
+    print(f"送信 {result['sent']} 件 / 編集 {result['edits']} 回")
+    print(f"外部サービスへのリクエスト: {services.requests}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='メッセージ処理全体のリプレイベンチマーク')
+    parser.add_argument('--messages', type=int, default=300, help='合成するメッセージ数')
+    parser.add_argument('--channels', type=int, default=10, help='合成するメッセージのチャンネル数')
+    parser.add_argument('--rate', type=float, default=20.0, help='1秒あたりの平均メッセージ数')
+    parser.add_argument('--speed', type=float, default=1.0, help='コーパスの到着時刻の再生速度（2なら2倍速）')
+    parser.add_argument('--corpus', help='記録したメッセージのJSON Linesファイル')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='LLMの最初の応答までの秒数')
+    parser.add_argument('--llm-chunk-delay', type=float, default=0.02, help='LLMのストリーミングの断片の間隔（秒）')
+    parser.add_argument('--search-latency', type=float, default=0.3, help='検索の応答までの秒数')
+    parser.add_argument('--page-latency', type=float, default=0.2, help='検索結果のページの応答までの秒数')
+    parser.add_argument('--response-rate', type=int, default=30, help='監視チャンネルでのランダム応答の確率（%%）')
+    parser.add_argument('--edit-interval-ms', type=int, default=1000, help='生成中のメッセージを編集する間隔（ミリ秒）')
+    parser.add_argument('--no-stream', action='store_true', help='応答を生成しながら表示しない')
+    parser.add_argument('--no-rate-limit', action='store_true', help='1分あたりの回数制限を無効にする')
+    args = parser.parse_args()
+
+    services = FakeServices(args.llm_latency, args.llm_chunk_delay, args.search_latency, args.page_latency).start()
+    workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+
+    # bot.py の読み込み前に、外部サービスと保存先をベンチマーク用に差し替える
+    os.environ.setdefault('DISCORD_TOKEN', 'bench')
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    os.environ['BOT_ID'] = BOT_ID
+    os.environ['LOCAL_LLM_BASE_URL'] = services.llm_base_url
+    os.environ['LOCAL_LLM_API_KEY'] = 'bench'
+    os.environ['LOCAL_LLM_MODEL'] = 'bench'
+    os.environ['HISTORY_DB_PATH'] = os.path.join(workdir, 'history.sqlite3')
+    os.environ['SCRAPE_CACHE_PATH'] = os.path.join(workdir, 'scrape_cache.sqlite3')
+    os.environ['SEARCH_CACHE_PATH'] = os.path.join(workdir, 'search_cache.sqlite3')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    import disable_voice  # noqa: F401  （bot より先に読み込む）
+    import bot
+    import my_duckduckgo
+    my_duckduckgo.DDG_HTML_URL = services.search_url
+    configure_bot(bot, args)
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus, args.rate)
+    else:
+        corpus = synthetic_corpus(args.messages, args.channels, args.rate, args.seed)
+
+    try:
+        result = asyncio.run(replay(bot, corpus, args.speed))
+    finally:
+        services.stop()
+    print_report(result, services)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+ベンチマーク用の外部サービスの代役
+OpenAI互換のチャットAPIと、DuckDuckGoのHTML検索・検索結果のページを返すローカルサーバーを
+別スレッドのイベントループで起動します。応答までの待ち時間はそれぞれ設定できます。
+
+使い方:
+    services = FakeServices(llm_latency=0.3, search_latency=0.2, page_latency=0.1)
+    services.start()
+    ...  # services.llm_base_url / services.search_url を使用
+    services.stop()
+"""
+
+import json
+import asyncio
+import threading
+
+from aiohttp import web
+
+# チャットAPIが返す応答（入力に応じて選ぶ）
+REPLY_TEXT = 'なるほど、面白い話ですね。もう少し詳しく教えてもらえますか？具体的な例があると、より的確にお答えできます。'
+NO_RESPONSE_TEXT = 'なし'
+# チャット監視のプロンプトを見分けるための文字列（bot.py の DEFAULT_CHAT_PROMPT の一部）
+CHAT_PROMPT_MARKER = '会話を見守って'
+
+PAGE_HTML = (
+    "<html><head><title>ページ{n}</title><meta name='description' content='ページ{n}の説明'></head>"
+    "<body><article><h1>ページ{n}</h1><p>{body}</p></article></body></html>"
+)
+PAGE_BODY = 'これはベンチマーク用の検索結果のページです。本文の抽出にかかる時間を測るため、ある程度の長さの段落を用意しています。' * 20
+
+
+class FakeServices:
+    """
+    OpenAI互換のチャットAPIとDuckDuckGoの代役のサーバー
+
+    Args:
+        llm_latency (float): チャットAPIが最初の応答を返すまでの秒数
+        llm_chunk_delay (float): ストリーミングの断片ごとの間隔（秒）
+        search_latency (float): 検索の応答までの秒数
+        page_latency (float): 検索結果のページの応答までの秒数
+        no_response_ratio (float): チャット監視の応答で「なし」を返す割合（0〜1）
+        port (int): 待ち受けるポート（0なら空いているポート）
+    """
+
+    def __init__(self, llm_latency=0.5, llm_chunk_delay=0.02, search_latency=0.3, page_latency=0.2,
+                 no_response_ratio=0.5, port=0):
+        self.llm_latency = llm_latency
+        self.llm_chunk_delay = llm_chunk_delay
+        self.search_latency = search_latency
+        self.page_latency = page_latency
+        self.no_response_ratio = no_response_ratio
+        self.port = port
+        self.requests = {'chat': 0, 'search': 0, 'page': 0}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._counter = 0
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    @property
+    def llm_base_url(self):
+        return f'{self.base_url}/v1'
+
+    @property
+    def search_url(self):
+        return f'{self.base_url}/html/'
+
+    def start(self):
+        """別スレッドでサーバーを起動し、待ち受けを始めるまで待ちます。"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='fake-services', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self._chat)
+        app.router.add_post('/html/', self._search)
+        app.router.add_get('/page/{n}', self._page)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    def stop(self):
+        """サーバーを停止します。"""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def _reply_for(self, body):
+        # チャット監視のプロンプト（「会話を見守って」を含む）には一定の割合で「なし」を返す
+        prompt = json.dumps(body.get('messages', []), ensure_ascii=False)
+        if CHAT_PROMPT_MARKER in prompt:
+            self._counter += 1
+            if (self._counter % 100) < self.no_response_ratio * 100:
+                return NO_RESPONSE_TEXT
+        return REPLY_TEXT
+
+    async def _chat(self, request):
+        self.requests['chat'] += 1
+        body = await request.json()
+        text = self._reply_for(body)
+        await asyncio.sleep(self.llm_latency)
+        if not body.get('stream'):
+            return web.json_response({
+                'id': 'bench', 'object': 'chat.completion', 'created': 0, 'model': body.get('model', 'bench'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for start in range(0, len(text), 8):
+            chunk = {
+                'id': 'bench', 'object': 'chat.completion.chunk', 'created': 0, 'model': body.get('model', 'bench'),
+                'choices': [{'index': 0, 'delta': {'content': text[start:start + 8]}, 'finish_reason': None}],
+            }
+            await response.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+            if self.llm_chunk_delay:
+                await asyncio.sleep(self.llm_chunk_delay)
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    async def _search(self, request):
+        self.requests['search'] += 1
+        form = await request.post()
+        query = form.get('q', '')
+        await asyncio.sleep(self.search_latency)
+        # クエリごとに異なるページを返す（スクレイピング結果のキャッシュに当たりすぎないように）
+        base = abs(hash(query)) % 10000 * 10
+        items = ''.join(
+            f'<div class="result"><a class="result__a" href="{self.base_url}/page/{base + i}">結果{i}: {query}</a>'
+            f'<a class="result__snippet">{query}についての説明{i}</a></div>'
+            for i in range(1, 6)
+        )
+        return web.Response(text=f'<html><body>{items}</body></html>', content_type='text/html')
+
+    async def _page(self, request):
+        self.requests['page'] += 1
+        await asyncio.sleep(self.page_latency)
+        n = request.match_info['n']
+        return web.Response(text=PAGE_HTML.format(n=n, body=PAGE_BODY), content_type='text/html')
@@ -0,0 +1,129 @@
+"""
+起動時のモジュール読み込み時間のプロファイル
+新しいPythonプロセスで `python -X importtime` を使って bot を読み込み、
+読み込みにかかった時間の合計と、時間のかかったモジュール（直接読み込んだもの・パッケージごと）を表示します。
+Discordには接続せず、設定ファイルと会話履歴のデータベースは一時ディレクトリのものを使います。
+
+リリースごとの起動時間の推移を記録するには --json の出力を保存してください。
+
+使い方:
+    python benchmarks/import_profile.py [--runs 5] [--top 15] [--eager] [--json]
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 読み込まれていると起動が遅くなるモジュール（LAZY_STARTUP では起動時に読み込まれないはずのもの）
+HEAVY_MODULES = ('langchain', 'langchain_community', 'openai', 'langsmith', 'trafilatura', 'bs4', 'lxml', 'httpx', 'requests')
+
+# 計測用のプロセスで実行するコード（run_bot.py と同じ順序で読み込む）
+IMPORT_CODE = 'import disable_voice, bot'
+
+
+def profile_once(eager, workdir):
+    """
+    新しいプロセスで bot を読み込み、-X importtime の出力を解析します。
+
+    Returns:
+        list: (モジュール名, 自身の時間(µs), 累積時間(µs), 階層) のリスト（読み込み順）
+    """
+    env = dict(os.environ)
+    env.setdefault('DISCORD_TOKEN', 'import-profile')
+    env.setdefault('OPENAI_API_KEY', 'import-profile')
+    env['LAZY_STARTUP'] = 'false' if eager else 'true'
+    env['HISTORY_DB_PATH'] = os.path.join(workdir, 'history.sqlite3')
+    env['SCRAPE_CACHE_PATH'] = os.path.join(workdir, 'scrape_cache.sqlite3')
+    env['SEARCH_CACHE_PATH'] = os.path.join(workdir, 'search_cache.sqlite3')
+    env['PYTHONPATH'] = REPO_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env['LOG_LEVEL'] = 'WARNING'
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', IMPORT_CODE],
+        cwd=workdir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"bot の読み込みに失敗しました:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        head, cumulative_us, name = line.split('|', 2)
+        self_us = int(head.replace('import time:', '').strip())
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((name.strip(), self_us, int(cumulative_us.strip()), depth))
+    return entries
+
+
+def summarize(entries, top):
+    """読み込み時間の合計と、時間のかかったモジュールをまとめます。"""
+    bot_entry = next(entry for entry in entries if entry[0] == 'bot')
+    # bot が直接読み込んだモジュール（bot の1つ下の階層）
+    direct = [entry for entry in entries if entry[3] == bot_entry[3] + 1]
+    # 最上位のパッケージごとの自身の時間の合計
+    packages = {}
+    for name, self_us, _, _ in entries:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    loaded = {name for name, _, _, _ in entries}
+    return {
+        'bot_ms': bot_entry[2] / 1000,
+        'total_ms': sum(entry[1] for entry in entries) / 1000,
+        'modules': len(entries),
+        'direct': [(name, cumulative / 1000) for name, _, cumulative, _ in sorted(direct, key=lambda e: -e[2])[:top]],
+        'packages': [(name, self_us / 1000) for name, self_us in sorted(packages.items(), key=lambda p: -p[1])[:top]],
+        'heavy_loaded': [name for name in HEAVY_MODULES if name in loaded],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='起動時のモジュール読み込み時間のプロファイル')
+    parser.add_argument('--runs', type=int, default=5, help='計測する回数（中央値を表示）')
+    parser.add_argument('--top', type=int, default=15, help='表示するモジュールの数')
+    parser.add_argument('--eager', action='store_true', help='LAZY_STARTUP を無効にして計測する')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # 1回目はバイトコードのキャッシュ作成を含むため計測から除く
+        profile_once(args.eager, workdir)
+        summaries = [summarize(profile_once(args.eager, workdir), args.top) for _ in range(max(1, args.runs))]
+
+    # 中央値に最も近い回の内訳を表示する
+    median_ms = statistics.median(summary['bot_ms'] for summary in summaries)
+    summary = min(summaries, key=lambda s: abs(s['bot_ms'] - median_ms))
+    report = {
+        'mode': 'eager' if args.eager else 'lazy',
+        'python': sys.version.split()[0],
+        'runs': len(summaries),
+        'bot_import_ms_median': round(median_ms, 1),
+        'bot_import_ms_min': round(min(s['bot_ms'] for s in summaries), 1),
+        'modules': summary['modules'],
+        'heavy_modules_loaded': summary['heavy_loaded'],
+        'direct_imports_ms': {name: round(ms, 1) for name, ms in summary['direct']},
+        'packages_self_ms': {name: round(ms, 1) for name, ms in summary['packages']},
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"モード: {report['mode']}（Python {report['python']}、{report['runs']}回の中央値）")
+    print(f"bot の読み込み: {report['bot_import_ms_median']:.1f} ms（最小 {report['bot_import_ms_min']:.1f} ms、{report['modules']} モジュール）")
+    heavy = ', '.join(report['heavy_modules_loaded']) or 'なし'
+    print(f"起動時に読み込まれた重いモジュール: {heavy}")
+    print("\n[bot が直接読み込んだモジュール（累積）]")
+    for name, ms in report['direct_imports_ms'].items():
+        print(f"  {ms:8.1f} ms  {name}")
+    print("\n[パッケージごとの読み込み時間（自身の時間の合計）]")
+    for name, ms in report['packages_self_ms'].items():
+        print(f"  {ms:8.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,87 @@
+import time
+
+# 起動時刻（起動にかかった時間の計測用。重いモジュールを読み込む前に記録する）
+STARTUP_STARTED = time.perf_counter()
+
 import os
 import sys
 import json
+import importlib
+import asyncio
+import datetime
 import random
+import logging
 import discord
 import traceback
 from dotenv import load_dotenv
 from discord.ext import commands
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import LLMChain
-from langchain_community.chat_models import ChatOpenAI
-from langchain.prompts import PromptTemplate
 
-# DuckDuckGo検索関数（別ファイル）
-from my_duckduckgo import duckduckgo_search
+# langchain・openai・trafilatura など読み込みに時間のかかるモジュールは使う関数の中で読み込む
+# （LAZY_STARTUP が有効な場合は on_ready の後にバックグラウンドで読み込んでおく）
+
+# LLMの非同期実行（別ファイル）
+from llm_runner import LLMRunner
+# 会話履歴の永続化ストア（別ファイル）
+from history_store import HistoryStore, ChannelMemoryRegistry
+# プロンプトとチェーンのキャッシュ（別ファイル）
+from prompt_cache import ChainCache
+# 受信メッセージの分類（別ファイル）
+from message_classifier import MessageClassifier
+# 連続したメッセージのまとめ処理（別ファイル）
+from burst_coalescer import BurstCoalescer
+# LLM呼び出しと検索の受付制御（別ファイル）
+from admission import AdmissionController, AdmissionRejected, KIND_ASK, KIND_SEARCH, KIND_URGENT, KIND_RANDOM
+# LLM呼び出しの優先度（別ファイル）
+from priority_scheduler import StaleJobDropped, PRIORITY_DIRECT, PRIORITY_SEARCH, PRIORITY_AMBIENT, PRIORITY_BACKGROUND
+# 応答を生成しながら表示する（別ファイル）
+from stream_reply import StreamingReply
+# LLMの応答のキャッシュ（別ファイル）
+from response_cache import ResponseCache
+# 設定ファイルの読み書き（別ファイル）
+from settings_store import SettingsStore, SETTINGS_WATCH_INTERVAL
+# プロンプトのトークン数の配分（別ファイル）
+from prompt_budget import PromptBudget, context_window, PART_INPUT, PART_HISTORY
+# ゲートウェイとワーカーの間のジョブキュー（別ファイル）
+from job_queue import (JobQueue, JOB_POLL_INTERVAL, JOB_SEARCH, JOB_RESPOND, JOB_ASK, EVENT_SEND, EVENT_EDIT,
+                       EVENT_DELETE, EVENT_TYPING, EVENT_RESET, EVENT_DONE, EVENT_FAILED)
+# 処理時間などの計測（別ファイル）
+import metrics
+# 検索結果のキャッシュ（SQLiteのファイルは最初に使うときに開く）
+# 共有のHTTP接続プール（http_pool.py）は httpx と requests を読み込むため、使う関数の中で読み込む
+from search_cache import get_search_cache
+from scrape_cache import get_scrape_cache, SCRAPE_CACHE_ENABLED
+# 本文抽出のプロセスプール（別ファイル）
+from extract_pool import get_extract_pool
+# スクレイピング先のドメインの状態（別ファイル）
+from domain_health import domain_health
 
 # 環境変数の読み込み
 load_dotenv()
 
+# ログの出力レベル（DEBUGにするとメッセージ本文や会話履歴などの詳細を出力する）
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# ハンドラーはここで1回だけ設定する（遅延読み込みするモジュールでは設定しない）
+logging.basicConfig(level=LOG_LEVEL)
+logger = logging.getLogger('bot')
+
+# 起動時にLLMを作成せず、読み込みに時間のかかるモジュールと一緒に最初に使うとき（または on_ready の後のバックグラウンド）に用意するか
+LAZY_STARTUP = os.getenv('LAZY_STARTUP', 'true').lower() in ('true', '1', 'yes', 'on')
+# on_ready の後にバックグラウンドで読み込んでおくモジュール
+WARMUP_MODULES = (
+    'langchain.chains',
+    'langchain.prompts',
+    'langchain_community.chat_models',
+    'llm_router',
+    'bounded_memory',
+    'my_duckduckgo',
+)
+
+# プロセスの役割
+# standalone: 1つのプロセスでメッセージの受信から検索・LLM呼び出し・送信まで行う
+# gateway: メッセージの受信と分類だけを行い、検索・応答はジョブキューに追加して worker.py のプロセスに任せる
+# worker: worker.py がジョブの実行用に読み込む場合（Discordには接続しない）
+BOT_ROLE = os.getenv('BOT_ROLE', 'standalone')
+
 # 多重起動の防止は start_bot.sh スクリプトで行うため、ここでは実装しない
 
 # Discordボットのトークン
@@ -32,15 +97,35 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+# ローカルのOpenAI互換サーバー（テストや予備のバックエンド用）
+LOCAL_LLM_BASE_URL = os.getenv('LOCAL_LLM_BASE_URL')
+LOCAL_LLM_API_KEY = os.getenv('LOCAL_LLM_API_KEY', 'local')
+LOCAL_LLM_MODEL = os.getenv('LOCAL_LLM_MODEL')
 
 # Discordボットの設定
 intents = discord.Intents.default()
 intents.message_content = True  # 特権インテントを有効化
 intents.messages = True
-bot = commands.Bot(command_prefix='!', intents=intents)
 
-# チャンネルごとの会話履歴を保存する辞書
-channel_memories = {}
+# シャーディングの設定（shard_supervisor.py が起動するプロセスごとに設定する）
+# SHARD_COUNT が未設定ならシャーディングしない。auto ならDiscordが推奨するシャード数を使う
+SHARD_COUNT = os.getenv('SHARD_COUNT', '')
+# このプロセスが担当するシャードID（カンマ区切り、未設定なら全シャード）
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id.strip()]
+
+if SHARD_COUNT:
+    # 1つのプロセスで複数のシャード（ゲートウェイ接続）を担当する
+    bot = commands.AutoShardedBot(
+        command_prefix='!',
+        intents=intents,
+        shard_count=None if SHARD_COUNT == 'auto' else int(SHARD_COUNT),
+        shard_ids=SHARD_IDS or None
+    )
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents)
+
+# チャンネルごとの会話履歴（SQLiteに保存し、最初のメッセージで遅延読み込みする）
+channel_memories = ChannelMemoryRegistry(HistoryStore(), lambda channel_id: new_channel_memory(channel_id))
 
 # ボットの設定を保存する辞書
 bot_settings = {
@@ -49,22 +134,112 @@ bot_settings = {
     'monitored_channels': [],  # 監視するチャンネルIDリスト
     'llm_provider': LLM_PROVIDER,  # 使用するLLMプロバイダー
     'llm_model': 'gpt-3.5-turbo',  # 使用するモデル（プロバイダーによって異なる）
+    'llm_max_concurrency': 4,  # LLMの同時実行数の上限
+    'llm_backends': [],  # llm_provider の予備として切り替えるLLMプロバイダーのリスト（例: ["openrouter", "local"]）
+    'llm_hedge': True,  # 応答が遅いときに予備のバックエンドにも同じリクエストを送るか
+    'llm_hedge_min_ms': 2000,  # 予備のバックエンドにリクエストを送るまでの最小の待ち時間（ミリ秒）
+    'llm_circuit_failures': 3,  # この回数続けて失敗したバックエンドを一時的に使わないようにする
+    'llm_circuit_open_seconds': 30,  # 失敗が続いたバックエンドを使わない秒数
+    'search_timeout': 20,  # 検索とスクレイピング全体の制限時間（秒）
+    'memory_max_tokens': 1500,  # チャンネルごとに保持する直近の会話のトークン数の上限
+    'memory_summary_max_tokens': 300,  # 古い会話の要約のトークン数の上限
+    'history_idle_seconds': 1800,  # この時間使われていないチャンネルの履歴をメモリから解放する（秒）
+    'burst_window_ms': 1500,  # 続けて届いたメッセージをまとめて応答するための待ち時間（ミリ秒、0でまとめない）
+    'burst_max_wait_ms': 5000,  # まとめ始めてから応答するまでの最大待ち時間（ミリ秒）
+    'burst_mention_wait_ms': 500,  # メンション・名前の呼びかけに応答するまでの最大待ち時間（ミリ秒）
+    'rate_limit_user_per_minute': 6,  # ユーザーごとの1分あたりのLLM呼び出し・検索の上限（0で無制限）
+    'rate_limit_channel_per_minute': 20,  # チャンネルごとの1分あたりの上限（0で無制限）
+    'rate_limit_guild_per_minute': 60,  # サーバーごとの1分あたりの上限（0で無制限）
+    'rate_limit_global_per_minute': 120,  # ボット全体の1分あたりの上限（0で無制限）
+    'max_pending_jobs': 16,  # 処理待ち（実行中を含む）のLLM呼び出し・検索の上限
+    'random_shed_percent': 50,  # 処理待ちが上限のこの割合（%）に達したらランダム応答を省略する
+    'priority_aging_seconds': 10,  # 待ち時間がこの秒数を超えるごとに処理の優先度を1段階引き上げる
+    'ambient_stale_seconds': 30,  # きっかけのメッセージからこの秒数が過ぎたランダム応答は破棄する
+    'stream_responses': True,  # 応答を生成しながらメッセージを編集して表示するか
+    'stream_edit_interval_ms': 1000,  # 生成中のメッセージを編集する最小間隔（ミリ秒）
+    'response_cache_ttl': 3600,  # !ask と呼びかけへの応答をキャッシュする秒数（0でキャッシュしない）
+    'response_cache_size': 500,  # キャッシュする応答の最大件数
+    'response_cache_similarity': 90,  # 類似質問とみなす類似度（%）
+    'response_cache_similar_channels': [],  # 類似質問にもキャッシュした応答を返すチャンネルIDリスト
+    'prompt_max_tokens': 0,  # プロンプトのトークン数の上限（0ならモデルのコンテキスト長）
+    'prompt_reserve_tokens': 1024,  # 上限のうち応答の生成用に残しておくトークン数
+    'prompt_weight_input': 3,  # プロンプトの上限を配分する重み（メッセージ・質問）
+    'prompt_weight_history': 1,  # プロンプトの上限を配分する重み（会話履歴）
     'channel_prompts': {}  # チャンネルごとのプロンプト設定を保存する辞書
 }
 
 # 設定ファイルのパス
 SETTINGS_FILE = 'bot_settings.json'
+# 設定ファイルの読み書き（チャンネルIDのリストは集合で照合する）
+settings_store = SettingsStore(SETTINGS_FILE, bot_settings, set_keys=('monitored_channels', 'response_cache_similar_channels'))
+
+# 選択できるLLMプロバイダー
+LLM_PROVIDERS = ['openai', 'openrouter', 'anthropic', 'google', 'litellm', 'local']
+# 変更されたらLLMを再初期化する設定
+LLM_SETTINGS = ('llm_provider', 'llm_model', 'llm_backends', 'llm_hedge', 'llm_hedge_min_ms',
+                'llm_circuit_failures', 'llm_circuit_open_seconds')
 
 # LLMの初期化関数
+# llm_backends が設定されている場合は、llm_provider を先頭にした複数のバックエンドを切り替えるルーターを返す
 def initialize_llm():
     provider = bot_settings.get('llm_provider', 'openai')
     model = bot_settings.get('llm_model', 'gpt-3.5-turbo')
     
+    names = [provider] + [name for name in bot_settings.get('llm_backends', []) if name != provider]
+    if len(names) == 1:
+        return create_provider_llm(provider, model)
+    
+    from llm_router import Backend, RoutedChatModel
+    backends = []
+    for name in names:
+        try:
+            backends.append(Backend(name, create_provider_llm(name, model)))
+        except (ValueError, NotImplementedError) as e:
+            # 主プロバイダーが使えない場合は従来通りエラーにする
+            if name == provider:
+                raise
+            logger.warning("予備のLLMバックエンド %s を使用できません: %s", name, e)
+    if len(backends) == 1:
+        return backends[0].llm
+    print(f"LLMバックエンドを切り替えて使用します: {', '.join(backend.name for backend in backends)}")
+    return RoutedChatModel(
+        backends=backends,
+        hedge=bot_settings['llm_hedge'],
+        hedge_min_delay=bot_settings['llm_hedge_min_ms'] / 1000,
+        failure_threshold=bot_settings['llm_circuit_failures'],
+        open_seconds=bot_settings['llm_circuit_open_seconds']
+    )
+
+# プロバイダーごとのLLMを作成
+def pooled_openai_clients(api_key, base_url=None):
+    """
+    共有のHTTP接続プールを使うOpenAIクライアントを作成します。
+    プロバイダーやバックエンドを切り替えても、同じホストへの接続を使い回します。
+    LLMの同時実行数は llm_max_concurrency で制限するため、APIのホストは HTTP_MAX_PER_HOST の対象外にします
+    （ストリーミングや予備のバックエンドへの同時リクエストが接続の空き待ちで詰まらないようにする）。
+
+    Returns:
+        dict: ChatOpenAI に渡す client と async_client
+    """
+    import openai
+    import http_pool
+    async_client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_pool.get_async_client())
+    http_pool.exempt_from_host_limit(async_client.base_url.host)
+    return {
+        'client': openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_pool.get_sync_client()).chat.completions,
+        'async_client': async_client.chat.completions,
+    }
+
+
+def create_provider_llm(provider, model):
+    from langchain_community.chat_models import ChatOpenAI
+    
     # OpenAIの場合
     if provider == 'openai' or not provider:
         return ChatOpenAI(
             api_key=OPENAI_API_KEY,
-            model_name=model
+            model_name=model,
+            **pooled_openai_clients(OPENAI_API_KEY)
         )
     
     # OpenRouterの場合
@@ -88,216 +263,557 @@ def initialize_llm():
         return ChatOpenAI(
             api_key=OPENROUTER_API_KEY,
             base_url="https://openrouter.ai/api/v1",
-            model_name=model
+            model_name=model,
+            **pooled_openai_clients(OPENROUTER_API_KEY, "https://openrouter.ai/api/v1")
+        )
+    
+    # ローカルのOpenAI互換サーバーの場合
+    elif provider == 'local':
+        if not LOCAL_LLM_BASE_URL:
+            raise ValueError("LOCAL_LLM_BASE_URLが設定されていません。.envファイルを確認してください。")
+        return ChatOpenAI(
+            api_key=LOCAL_LLM_API_KEY,
+            base_url=LOCAL_LLM_BASE_URL,
+            model_name=LOCAL_LLM_MODEL or model,
+            **pooled_openai_clients(LOCAL_LLM_API_KEY, LOCAL_LLM_BASE_URL)
         )
     
     # その他のプロバイダー
     raise NotImplementedError(f"{provider}プロバイダーは現在サポートされていません。!config llm_provider openai コマンドでOpenAIに切り替えてください。")
 
 # Set up LangChain with selected LLM provider
-llm = initialize_llm()
+# LAZY_STARTUP の場合は get_llm() で最初に使うときに作成する
+llm = None if LAZY_STARTUP else initialize_llm()
 
-# 質問用のプロンプトテンプレート
-def get_question_prompt(channel_id=None):
+# LLMを返す（まだ作成していなければ作成する）
+def get_llm():
+    global llm
+    if llm is None:
+        llm = initialize_llm()
+    return llm
+
+# プロンプトとLLMをつないだチェーンを作成
+def new_chain(prompt):
+    from langchain.chains import LLMChain
+    return LLMChain(llm=get_llm(), prompt=prompt)
+
+# LLM呼び出しの非同期ランナー（同時実行数の上限とチャンネルごとの直列化）
+llm_runner = LLMRunner(bot_settings['llm_max_concurrency'])
+
+# デフォルトのシステムプロンプト（設定に system_prompt がない場合に使用）
+DEFAULT_QUESTION_PROMPT = "あなたは親切なAIアシスタントです。以下の会話履歴を見て、質問に答えてください。\n\n会話履歴:\n{history}\n質問: {input}\n応答:"
+DEFAULT_CHAT_PROMPT = "あなたはDiscordサーバーで会話を監視し、適切なタイミングでアドバイスや情報提供をする親切なAIアシスタントです。以下の会話履歴を見て、必要に応じてアドバイスや情報を提供してください。もし特に言うことがなければ、応答せずに会話を見守ってください。\n\n会話履歴:\n{history}\n最新のメッセージ: {input}\n応答:"
+
+# 構築済みのプロンプトとチェーンのキャッシュ
+# 設定が変わったら bump_settings_version() でまとめて破棄する
+chain_cache = ChainCache()
+
+# 設定の各項目をJSONにした値（反映済みの設定と比べて、変わった項目を調べる）
+def settings_snapshot():
+    return {key: json.dumps(value, sort_keys=True) for key, value in bot_settings.items()}
+
+# 最後に反映した設定（LLMとチェーンは、この時点の設定で作成されている）
+applied_settings = settings_snapshot()
+
+def bump_settings_version():
+    global applied_settings
+    applied_settings = settings_snapshot()
+    return chain_cache.bump()
+
+# キャッシュのキー（カスタムプロンプトのないチャンネルはデフォルトのプロンプトを共有する）
+def _prompt_key(channel_id):
+    if channel_id and str(channel_id) in bot_settings['channel_prompts']:
+        return channel_id
+    return None
+
+# プロンプトテンプレートを構築
+def _build_prompt(channel_id, default_system_prompt):
     # システムプロンプトを取得
-    system_prompt = bot_settings.get('system_prompt', "あなたは親切なAIアシスタントです。以下の会話履歴を見て、質問に答えてください。\n\n会話履歴:\n{history}\n質問: {input}\n応答:")
+    system_prompt = bot_settings.get('system_prompt', default_system_prompt)
     
-    # チャンネルIDが指定され、そのチャンネルにカスタムプロンプトが設定されている場合は、それを追加する
-    if channel_id and str(channel_id) in bot_settings['channel_prompts']:
-        print(f"チャンネル{channel_id}用のカスタムプロンプトを追加します")
+    # チャンネルにカスタムプロンプトが設定されている場合は、システムプロンプトの前に追加する
+    if channel_id is not None:
         channel_prompt = bot_settings['channel_prompts'][str(channel_id)]
-        # チャンネルプロンプトをシステムプロンプトの前に追加
         template = f"{channel_prompt}\n\n{system_prompt}"
-        return PromptTemplate(
-            input_variables=["history", "input"],
-            template=template
-        )
-    
-    # システムプロンプトのみを使用する
-    print("システムプロンプトを使用します")
+    else:
+        template = system_prompt
+    from langchain.prompts import PromptTemplate
     return PromptTemplate(
         input_variables=["history", "input"],
-        template=system_prompt
+        template=template
     )
 
+# 質問用のプロンプトテンプレート
+def get_question_prompt(channel_id=None):
+    key = _prompt_key(channel_id)
+    return chain_cache.get('question_prompt', key, lambda: _build_prompt(key, DEFAULT_QUESTION_PROMPT))
+
 # チャット監視用のプロンプトテンプレート
 def get_chat_prompt(channel_id=None):
-    # システムプロンプトを取得
-    system_prompt = bot_settings.get('system_prompt', "あなたはDiscordサーバーで会話を監視し、適切なタイミングでアドバイスや情報提供をする親切なAIアシスタントです。以下の会話履歴を見て、必要に応じてアドバイスや情報を提供してください。もし特に言うことがなければ、応答せずに会話を見守ってください。\n\n会話履歴:\n{history}\n最新のメッセージ: {input}\n応答:")
-    
-    # チャンネルIDが指定され、そのチャンネルにカスタムプロンプトが設定されている場合は、それを追加する
-    if channel_id and str(channel_id) in bot_settings['channel_prompts']:
-        print(f"チャンネル{channel_id}用のカスタムプロンプトを追加します")
-        channel_prompt = bot_settings['channel_prompts'][str(channel_id)]
-        # チャンネルプロンプトをシステムプロンプトの前に追加
-        template = f"{channel_prompt}\n\n{system_prompt}"
-        return PromptTemplate(
-            input_variables=["history", "input"],
-            template=template
-        )
-    
-    # システムプロンプトのみを使用する
-    print("システムプロンプトを使用します")
-    return PromptTemplate(
-        input_variables=["history", "input"],
-        template=system_prompt
-    )
+    key = _prompt_key(channel_id)
+    return chain_cache.get('chat_prompt', key, lambda: _build_prompt(key, DEFAULT_CHAT_PROMPT))
+
+# 検索トリガー語
+SEARCH_TRIGGERS = ['検索して', '検索しろ', '検索', '調べて', '調べろ', 'ググって', 'ぐぐって', 'search ', '検索してください', '調べてください']
+
+# メッセージの分類器を取得（設定が変わるまで再利用される）
+def get_message_classifier():
+    def build():
+        # ボットの名前とエイリアスの両方が設定されている場合のみ名前の呼びかけを検出
+        if 'bot_name' in bot_settings and 'bot_name_aliases' in bot_settings:
+            return MessageClassifier(SEARCH_TRIGGERS, BOT_ID, bot_settings['bot_name'], bot_settings['bot_name_aliases'])
+        return MessageClassifier(SEARCH_TRIGGERS, BOT_ID)
+    return chain_cache.get('message_classifier', None, build)
 
 # 設定ファイルの読み込み
 def load_settings():
-    global bot_settings
     try:
-        if os.path.exists(SETTINGS_FILE):
-            with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                bot_settings = json.load(f)
+        # ファイルにない設定項目はデフォルト値を残す
+        if settings_store.load():
+            apply_settings()
             print("設定ファイルを読み込みました")
     except Exception as e:
         print(f"設定ファイルの読み込みに失敗しました: {str(e)}")
 
-# 設定ファイルの保存
-def save_settings():
+# 読み込んだ設定を各コンポーネントに反映（設定ファイルが書き換えられたときにも呼ばれる）
+# 再接続のたびに on_ready で読み込み直すため、反映済みの設定から変わっていなければ何もしない
+def apply_settings():
+    changed = {key for key, value in settings_snapshot().items() if applied_settings.get(key) != value}
+    if not changed:
+        return
+    # LLMの設定が変わった場合だけLLMを作り直す
+    # （まだLLMを作成していない場合は、最初に使うときに新しい設定で作成される）
+    if llm is not None and changed.intersection(LLM_SETTINGS):
+        reload_llm()
+    llm_runner.set_max_concurrency(bot_settings['llm_max_concurrency'])
+    llm_runner.scheduler.aging_seconds = bot_settings['priority_aging_seconds']
+    configure_burst_coalescer()
+    configure_admission()
+    configure_response_cache()
+    bump_settings_version()
+
+# 設定ファイルの内容でLLMを作り直す（失敗した場合は現在のLLMを使い続ける）
+def reload_llm():
+    global llm
     try:
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(bot_settings, f, indent=4, ensure_ascii=False)
-        print("設定ファイルを保存しました")
+        llm = initialize_llm()
     except Exception as e:
-        print(f"設定ファイルの保存に失敗しました: {str(e)}")
+        logger.exception("LLMの初期化に失敗しました: %s", e)
+
+# 設定ファイルの保存（少し待ってから別スレッドでまとめて保存する）
+def save_settings():
+    settings_store.save()
 
 # 質問用のチェーンを取得
+# 会話履歴は呼び出し側で channel_memories から読み込んで {history} に渡す
 def get_question_chain(channel_id=None):
-    # チャンネルIDに基づいたプロンプトを取得
-    prompt = get_question_prompt(channel_id)
-    
-    # チャンネルIDが指定されている場合、会話履歴を使用
-    if channel_id and channel_id in channel_memories:
-        memory = channel_memories[channel_id]
-        print(f"チャンネル{channel_id}の会話履歴を使用します")
-        # LLMChainを使用して履歴と質問を処理（memoryを使用）
-        return LLMChain(llm=llm, prompt=prompt, memory=memory, verbose=True)
-    
-    # チャンネルIDがない場合や履歴がない場合は、新しいメモリを作成
-    print("会話履歴なしで質問に応答します")
-    # 履歴なしの場合は空のメモリを作成
-    empty_memory = ConversationBufferMemory(memory_key="history")
-    return LLMChain(llm=llm, prompt=prompt, memory=empty_memory, verbose=True)
+    key = _prompt_key(channel_id)
+    return chain_cache.get('question_chain', key, lambda: new_chain(get_question_prompt(key)))
+
+# チャット監視用のチェーンを取得
+def get_chat_chain(channel_id=None):
+    key = _prompt_key(channel_id)
+    return chain_cache.get('chat_chain', key, lambda: new_chain(get_chat_prompt(key)))
+
+# 古い会話を要約に畳み込むためのプロンプト
+HISTORY_SUMMARY_TEMPLATE = (
+    "以下はDiscordチャンネルでのこれまでの会話の要約と、新しく要約に含める会話です。"
+    "両方の内容を踏まえて、会話の要点を日本語で簡潔にまとめ直してください。\n\n"
+    "これまでの要約:\n{summary}\n\n新しい会話:\n{new_lines}\n\n新しい要約:"
+)
+
+# 応答しないことを表すLLMの出力
+NO_RESPONSE_TEXTS = ["なし", "特になし", "応答なし", "none", "no response"]
+
+# LLMの応答のキャッシュ
+response_cache = ResponseCache()
+
+# 応答のキャッシュの設定を反映
+def configure_response_cache():
+    response_cache.ttl = bot_settings['response_cache_ttl']
+    response_cache.max_size = bot_settings['response_cache_size']
+    response_cache.similarity = bot_settings['response_cache_similarity'] / 100
+
+configure_response_cache()
+
+# チェーンを実行して応答を送信する
+# stream_responses が有効な場合は生成しながらメッセージを編集し、2000文字を超えた分は新しいメッセージに続ける
+# 応答しないことを表す出力（skip_texts）だった場合は送信したメッセージを削除する
+# cache_query を指定すると、展開済みのプロンプトが同じ（類似質問の段が有効なチャンネルでは質問が似ている）
+# 保存済みの応答があればLLMを呼ばずにそれを返す
+# prompt_tokens は fit_prompt で数えたプロンプトの推定トークン数（メトリクス用）
+async def send_chain_reply(channel, chain, inputs, priority=PRIORITY_DIRECT, stale_at=None, placeholder=None, skip_texts=(),
+                           cache_query=None, prompt_tokens=None):
+    reply = StreamingReply(channel, placeholder, bot_settings['stream_edit_interval_ms'] / 1000)
+
+    cache_key = cache_scope = similar_query = None
+    if cache_query is not None:
+        cache_scope = ResponseCache.make_scope(chain.prompt.template, f"{bot_settings['llm_provider']}/{bot_settings['llm_model']}")
+        cache_key = ResponseCache.make_key(cache_scope, chain.prompt.format(**inputs))
+        if settings_store.contains('response_cache_similar_channels', channel.id):
+            similar_query = cache_query
+        cached_text = response_cache.get(cache_key, cache_scope, similar_query)
+        if cached_text is not None:
+            logger.debug("キャッシュした応答を返します")
+            return await reply.finish(cached_text)
+
+    streamed = bot_settings['stream_responses']
+    if streamed:
+        await reply.start()
+        try:
+            async for chunk in llm_runner.astream(chain, inputs, priority=priority, stale_at=stale_at, prompt_tokens=prompt_tokens):
+                await reply.feed(chunk)
+        except BaseException:
+            # 途中で失敗した場合は仮のメッセージと途中まで表示した応答を削除する（エラーは呼び出し側で通知する）
+            await reply.discard()
+            raise
+        response_text = reply.text.strip()
+    else:
+        response = await llm_runner.ainvoke(chain, inputs, priority=priority, stale_at=stale_at, prompt_tokens=prompt_tokens)
+        logger.debug("LLMからの応答を受信しました: %s", response)
+        response_text = response["text"].strip()
+    logger.debug("整形された応答テキスト: %s", response_text)
+
+    if not response_text or response_text.lower() in skip_texts:
+        await reply.discard()
+        return ''
+    # 表示済みの位置は生成されたままのテキストで記録しているため、生成しながら表示した応答は前後の空白を除かずに表示する
+    await reply.finish(None if streamed else response_text)
+    if cache_key is not None:
+        response_cache.put(cache_key, response_text, cache_scope, similar_query)
+    return response_text
+
+# プロンプトの各部分（PART_*）をモデルのコンテキスト長から応答用の分を除いたトークン数に収める
+# 呼び出しごとにトークン数の内訳をログに出力し、(切り詰めた各部分, プロンプト全体の推定トークン数) を返す
+def fit_prompt(chain, parts):
+    budget = PromptBudget(
+        bot_settings['prompt_max_tokens'] or context_window(bot_settings['llm_model']),
+        bot_settings['prompt_reserve_tokens'],
+        {
+            PART_INPUT: bot_settings['prompt_weight_input'],
+            PART_HISTORY: bot_settings['prompt_weight_history'],
+        }
+    )
+    fitted, report = budget.allocate(chain.prompt.template, parts)
+    breakdown = '、'.join(
+        f"{name} {report[name]}" + (f"（{report[name + '_trimmed']}切り詰め）" if report[name + '_trimmed'] else '')
+        for name in parts
+    )
+    logger.info("プロンプトのトークン数: %d / 上限 %d（テンプレート %d、%s）", report['total'], report['limit'], report['template'], breakdown)
+    return fitted, report['total']
+
+# 会話履歴の要約（TokenBudgetMemoryがバックグラウンドで呼び出す）
+async def summarize_history(summary, new_lines):
+    def build():
+        from langchain.prompts import PromptTemplate
+        return new_chain(PromptTemplate(input_variables=["summary", "new_lines"], template=HISTORY_SUMMARY_TEMPLATE))
+    summary_chain = chain_cache.get('summary_chain', None, build)
+    result = await llm_runner.ainvoke(summary_chain, {"summary": summary, "new_lines": new_lines}, priority=PRIORITY_BACKGROUND)
+    return result["text"]
+
+# チャンネル用の会話メモリを作成（会話と要約は channel_memories のストアに保存される）
+def new_channel_memory(channel_id):
+    from bounded_memory import TokenBudgetMemory
+    return TokenBudgetMemory(
+        max_tokens=bot_settings['memory_max_tokens'],
+        summary_max_tokens=bot_settings['memory_summary_max_tokens'],
+        summarizer=summarize_history,
+        store=channel_memories.store,
+        channel_id=channel_id
+    )
+
+# 使われていないチャンネルの会話履歴を定期的にメモリから解放する
+async def evict_idle_memories():
+    while True:
+        idle_seconds = bot_settings['history_idle_seconds']
+        await asyncio.sleep(max(60, idle_seconds / 4))
+        try:
+            await channel_memories.aevict_idle(idle_seconds)
+        except Exception as e:
+            logger.exception("会話履歴の解放中にエラーが発生しました: %s", e)
+
+# 読み込みに時間のかかるモジュールをバックグラウンドで読み込み、LLMを作成しておく
+# （最初のメッセージへの応答でこれらの待ち時間が発生しないようにする）
+async def warm_up():
+    # ゲートウェイはLLMと検索を使わない
+    if job_queue is not None:
+        return
+    started = time.perf_counter()
+    try:
+        # import はスレッドで実行し、読み込み中もイベントループを止めない
+        await asyncio.to_thread(lambda: [importlib.import_module(name) for name in WARMUP_MODULES])
+        get_llm()
+        # 本文抽出のプロセスも起動しておく（最初の検索で起動を待たないように）
+        extract_pool = get_extract_pool()
+        if extract_pool is not None:
+            await extract_pool.start()
+    except Exception as e:
+        logger.exception("モジュールの事前読み込み中にエラーが発生しました: %s", e)
+        return
+    record_startup('warmup', time.perf_counter() - started)
+
+# 起動の段階ごとの所要時間（秒）を記録してログに出力
+startup_seconds = {}
+
+def record_startup(phase, seconds):
+    startup_seconds[phase] = seconds
+    startup_seconds_gauge.set(seconds, phase=phase)
+    logger.info("起動時間（%s）: %.2f秒", phase, seconds)
+
+eviction_task = None
+settings_watch_task = None
+warmup_task = None
+job_events_task = None
+metrics_server = None
 
 @bot.event
 async def on_ready():
     print(f'{bot.user} has connected to Discord!')
     print(f'Bot is in {len(bot.guilds)} guilds')
+    if SHARD_COUNT:
+        print(f"シャード {', '.join(str(shard_id) for shard_id in sorted(bot.shards))} / {bot.shard_count} を担当しています")
     global BOT_ID
     if not BOT_ID:
         BOT_ID = str(bot.user.id)
     
+    # 起動から最初に接続するまでの時間を記録（再接続で on_ready が呼ばれた場合は記録しない）
+    first_ready = 'ready' not in startup_seconds
+    if first_ready:
+        record_startup('ready', time.perf_counter() - STARTUP_STARTED)
+
     # 設定ファイルの読み込み
     load_settings()
 
+    # 読み込みに時間のかかるモジュールとLLMをバックグラウンドで用意（1回だけ）
+    global warmup_task
+    if first_ready and LAZY_STARTUP:
+        warmup_task = asyncio.create_task(warm_up())
+
+    # ゲートウェイの場合はワーカーからのイベント（送信・編集など）をDiscordに反映するタスクを開始
+    global job_events_task
+    if job_queue is not None and (job_events_task is None or job_events_task.done()):
+        job_events_task = asyncio.create_task(deliver_job_events())
+
+    # 会話履歴の解放タスクを開始（再接続で on_ready が複数回呼ばれても1つだけ）
+    global eviction_task
+    if eviction_task is None or eviction_task.done():
+        eviction_task = asyncio.create_task(evict_idle_memories())
+
+    # 設定ファイルの変更の監視を開始（外部で書き換えられたら再起動せずに反映する）
+    global settings_watch_task
+    if SETTINGS_WATCH_INTERVAL > 0 and (settings_watch_task is None or settings_watch_task.done()):
+        settings_watch_task = asyncio.create_task(settings_store.watch(apply_settings))
+
+    # メトリクスのエンドポイントを起動（METRICS_PORT が設定されている場合のみ、1回だけ）
+    global metrics_server
+    if metrics_server is None and metrics.METRICS_PORT:
+        try:
+            metrics_server = await metrics.start_http_server()
+            print(f"メトリクスを http://{metrics.METRICS_HOST}:{metrics.METRICS_PORT}/metrics で公開しています")
+        except Exception as e:
+            logger.warning("メトリクスのエンドポイントを起動できませんでした: %s", e)
+
+# 終了時に本文抽出のプロセスと共有のHTTPクライアントを閉じる
+# （イベントループを閉じた後に子プロセスや接続が後始末されて例外が出ないようにする）
+async def close_resources():
+    extract_pool = get_extract_pool()
+    if extract_pool is not None:
+        await extract_pool.close()
+    # 接続プールをまだ使っていない（http_pool を読み込んでいない）場合は閉じるものがない
+    http_pool = sys.modules.get('http_pool')
+    if http_pool is not None:
+        await http_pool.aclose()
+
+_close_bot = bot.close
+
+async def close_bot():
+    try:
+        await _close_bot()
+    finally:
+        await close_resources()
+
+# bot.run の終了時（Ctrl+C・SIGTERM）に呼ばれる close に後始末を追加する
+bot.close = close_bot
+
+# LLM呼び出しと検索の受付制御
+admission = AdmissionController()
+
+# 受付制御の上限を設定から反映
+def configure_admission():
+    admission.configure(
+        bot_settings['rate_limit_user_per_minute'],
+        bot_settings['rate_limit_channel_per_minute'],
+        bot_settings['rate_limit_guild_per_minute'],
+        bot_settings['rate_limit_global_per_minute'],
+        bot_settings['max_pending_jobs'],
+        bot_settings['random_shed_percent']
+    )
+
+configure_admission()
+
+# 受付制御の単位となるID（ユーザー、チャンネル、サーバー）
+def admission_keys(message):
+    guild_id = message.guild.id if message.guild else None
+    return message.author.id, message.channel.id, guild_id
+
+# ゲートウェイのID。シャードごとのゲートウェイが同じジョブキューを共有しても、自分のジョブのイベントだけを反映する
+# （担当するシャードから決めるため、再起動したゲートウェイは停止前に追加したジョブのイベントを引き継ぐ）
+GATEWAY_ID = os.getenv('GATEWAY_ID') or (f"shards-{'-'.join(str(shard_id) for shard_id in SHARD_IDS)}" if SHARD_IDS else 'gateway')
+# ゲートウェイのジョブキュー（BOT_ROLE=gateway の場合のみ）
+job_queue = JobQueue(gateway=GATEWAY_ID) if BOT_ROLE == 'gateway' else None
+# ジョブの完了まで保持する受付済みのチケット（ジョブID → チケットのリスト）
+job_tickets = {}
+# ワーカーの送信したメッセージ（ジョブID → {参照名: Discordのメッセージ}）
+job_messages = {}
+# ジョブの追加（チケットの登録まで）とイベントの読み込みを排他する。
+# 登録前に読み込んだ完了イベントでチケットが解放されないままになるのを防ぐ
+job_queue_lock = asyncio.Lock()
+
+# ジョブの入力用にメッセージをJSONにできる形にする
+def message_payload(message):
+    return {
+        'id': message.id,
+        'author': message.author.display_name,
+        'content': message.content,
+        'created_at': message.created_at.timestamp(),
+    }
+
+# ジョブを追加し、完了するまでチケットを保持する
+# （ワーカーがデータベースをロックしている間もイベントループを止めないよう、sqliteの操作は別スレッドで行う）
+async def enqueue_job(kind, channel_id, payload, tickets=(), priority=PRIORITY_DIRECT):
+    async with job_queue_lock:
+        job_id = await asyncio.to_thread(job_queue.enqueue, kind, channel_id, payload, priority)
+        job_tickets[job_id] = [ticket for ticket in tickets if ticket is not None]
+    logger.debug("ジョブ%dを追加しました（%s、チャンネル%s）", job_id, kind, channel_id)
+    return job_id
+
+# ジョブの終了時にチケットを解放する
+def finish_job(job_id):
+    for ticket in job_tickets.pop(job_id, []):
+        ticket.release()
+    job_messages.pop(job_id, None)
+
+# ワーカーからのイベントを順にDiscordに反映する
+async def deliver_job_events():
+    while True:
+        try:
+            async with job_queue_lock:
+                events = await asyncio.to_thread(job_queue.events)
+        except Exception as e:
+            logger.exception("ジョブキューの読み込み中にエラーが発生しました: %s", e)
+            events = []
+        if not events:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+        for event in events:
+            try:
+                await apply_job_event(event)
+            except Exception as e:
+                # 削除済みのメッセージなどで失敗したイベントは読み飛ばす
+                logger.warning("ジョブ%sのイベント（%s）の反映に失敗しました: %s", event.job_id, event.op, e)
+            await asyncio.to_thread(job_queue.ack, event.id)
+
+async def apply_job_event(event):
+    if event.op == EVENT_DONE:
+        finish_job(event.job_id)
+        return
+    channel = bot.get_channel(event.channel_id) or await bot.fetch_channel(event.channel_id)
+    messages = job_messages.setdefault(event.job_id, {})
+    if event.op == EVENT_FAILED:
+        finish_job(event.job_id)
+        await channel.send(f"エラーが発生しました: {event.content}")
+    elif event.op == EVENT_TYPING:
+        await channel.typing()
+    elif event.op == EVENT_RESET:
+        # ワーカーが途中で停止したジョブをやり直す前に、途中まで送信したメッセージを削除する
+        for message in messages.values():
+            await message.delete()
+        messages.clear()
+    elif event.op == EVENT_DELETE:
+        message = messages.pop(event.ref, None)
+        if message is not None:
+            await message.delete()
+    else:
+        with metrics.timed(metrics.STAGE_SEND):
+            message = messages.get(event.ref)
+            if event.op == EVENT_EDIT and message is not None:
+                await message.edit(content=event.content)
+            else:
+                # ゲートウェイの再起動で参照できなくなったメッセージは新しく送信する
+                messages[event.ref] = await channel.send(event.content)
+
+# 受付を拒否したときにユーザーに返すメッセージ
+def rejection_message(error):
+    if error.retry_after:
+        return f"{error.reason}。{error.retry_after:.0f}秒ほど待ってから再度お試しください。"
+    return f"{error.reason}。しばらく待ってから再度お試しください。"
+
+# 検索トリガーへの応答（DuckDuckGo検索と上位結果のスクレイピング）
+async def handle_search(message, query):
+    # DuckDuckGo検索と上位結果のスクレイピングを非同期に実行
+    # （全体の制限時間を超えた場合は取得できたページだけを使用）
+    from my_duckduckgo import async_search_and_scrape
+    max_scrape = 3  # 上位3件まで詳細取得
+    ddg_results = await async_search_and_scrape(
+        query,
+        max_urls=max_scrape,
+        max_length_per_url=3000,
+        timeout=bot_settings['search_timeout']
+    )
+    if not ddg_results:
+        await message.channel.send('検索できません')
+        logger.debug("DuckDuckGo検索結果: %s", ddg_results)
+        return
+    # errorキーが含まれている場合はエラー内容を返す
+    if isinstance(ddg_results, list) and 'error' in ddg_results[0]:
+        err = ddg_results[0]
+        await message.channel.send(f"[ERROR] DuckDuckGo: {err['error']}\n{err['traceback']}")
+        return
+        
+    # 検索結果の上位のタイトル・URLと、スクレイピングしたページの本文の冒頭を送信する
+    details = []
+    for idx, result in enumerate(ddg_results[:max_scrape]):
+        url = result.get('href') or result.get('url')
+        title = result.get('title')
+        if url:
+            text = result.get('content')
+            if text:
+                summary = text[:300] + ('...' if len(text) > 300 else '')
+                details.append(f"【{idx+1}】{title}\nURL: {url}\n要約: {summary}")
+            else:
+                details.append(f"【{idx+1}】{title}\nURL: {url}\n要約: 詳細を取得できませんでした。")
+        else:
+            details.append(f"【{idx+1}】{title}\nURL情報なし")
+    detail_msg = '\n\n'.join(details)
+    with metrics.timed(metrics.STAGE_SEND):
+        await message.channel.send(detail_msg)
+
 @bot.event
 async def on_message(message):
     # 自分自身のメッセージには応答しない
     if message.author == bot.user:
         return
 
-    # --- 検索トリガーの検知 ---
-    search_triggers = ['検索して', '検索しろ', '検索', '調べて', '調べろ', 'ググって', 'ぐぐって', 'search ', '検索してください', '調べてください']
-    content = message.content.strip()
-    print(f"メッセージを受信: {content}")  # デバッグ用
-    for trig in search_triggers:
-        if trig in content:
-            # トリガー語を除去してクエリ抽出（単純な例）
-            query = content.replace(trig, '').strip()
-            if not query:
-                query = content  # トリガー語だけの場合は全文
-            # DuckDuckGo検索結果（リスト）を取得
-            ddg_results = duckduckgo_search(query)
-            if not ddg_results:
-                await message.channel.send('検索できません')
-                # デバッグ用: 検索結果リストを送信
-                await message.channel.send(f"[DEBUG] DuckDuckGo検索結果: {ddg_results}")
-                return
-            # errorキーが含まれている場合はエラー内容を返す
-            if isinstance(ddg_results, list) and 'error' in ddg_results[0]:
-                err = ddg_results[0]
-                await message.channel.send(f"[ERROR] DuckDuckGo: {err['error']}\n{err['traceback']}")
-                return
-                
-            # 検索が発動した場合は常に検索結果URLからスクレイピングを行う
-            should_scrape = True  # 常にTrueにすることで全検索で詳細取得
-
-            # スクレイピングして詳細情報を付加
-            if should_scrape:
-                from web_scraper import scrape_url
-                details = []
-                max_scrape = 3  # 上位3件まで詳細取得
-                for idx, result in enumerate(ddg_results[:max_scrape]):
-                    url = result.get('href') or result.get('url')
-                    title = result.get('title')
-                    if url:
-                        try:
-                            scraped = scrape_url(url)
-                            if scraped and scraped.get('text'):
-                                summary = scraped['text'][:300] + ('...' if len(scraped['text']) > 300 else '')
-                                details.append(f"【{idx+1}】{title}\nURL: {url}\n要約: {summary}")
-                            else:
-                                details.append(f"【{idx+1}】{title}\nURL: {url}\n要約: 詳細を取得できませんでした。")
-                        except Exception as e:
-                            details.append(f"【{idx+1}】{title}\nURL: {url}\n要約: スクレイピングエラー: {str(e)}")
-                    else:
-                        details.append(f"【{idx+1}】{title}\nURL情報なし")
-                detail_msg = '\n\n'.join(details)
-                await message.channel.send(detail_msg)
-                return
-
-            
-            # URLからコンテンツを取得
-            if should_scrape:
-                await message.channel.send(f"検索結果のURLから内容を取得しています...")
-                try:
-                    from my_duckduckgo import extract_content_from_urls
-                    # URLからコンテンツを取得
-                    ddg_results = extract_content_from_urls(ddg_results, max_urls=2, max_length_per_url=3000)
-                except Exception as e:
-                    print(f"Error extracting content from URLs: {e}")
-            
-            # 検索結果をテキスト整形
-            results_text = ''
-            for i, r in enumerate(ddg_results, 1):
-                results_text += f"{i}. タイトル: {r['title']}\n説明: {r['body']}\nURL: {r['href']}\n"
-                # コンテンツがあれば追加
-                if 'content' in r and r['content']:
-                    # コンテンツの先頭1000文字を表示
-                    content_preview = r['content'][:1000] + ("..." if len(r['content']) > 1000 else "")
-                    results_text += f"コンテンツ: {content_preview}\n\n"
-                else:
-                    results_text += "\n"
-            
-            # 要約プロンプトを作成
-            summary_prompt = (
-                "以下はDuckDuckGo検索の上位結果リストです。\n"
-                "各項目のタイトル・説明・URL"
-            )
-            
-            # コンテンツがあれば追加
-            if should_scrape:
-                summary_prompt += "・コンテンツ"
-                
-            summary_prompt += (
-                "を参考に、ユーザーの質問に対して日本語で要点をまとめてください。\n"
-                f"検索クエリ: {query}\n"
-                f"検索結果:\n{results_text}"
-                "まとめ:"
-            )
-            # LLMで要約
-            response = None
-            try:
-                chat_chain = get_question_chain(message.channel.id)
-                # 正しい入力形式で実行（辞書形式で入力）
-                response = chat_chain.run({"input": summary_prompt})
-            except Exception as e:
-                response = '要約に失敗しました: ' + str(e)
-                print(f"要約エラー詳細: {e}")
-            await message.channel.send(response)
+    # --- 検索トリガー・メンション・名前の呼びかけを1回の走査で検知 ---
+    with metrics.timed(metrics.STAGE_CLASSIFY):
+        classification = get_message_classifier().classify(message.content)
+    logger.debug("メッセージを受信: %s", message.content)
+    if classification.trigger is not None:
+        # 検索の実行頻度と処理待ちの件数を制限する
+        try:
+            ticket = admission.admit(KIND_SEARCH, *admission_keys(message))
+        except AdmissionRejected as e:
+            await message.channel.send(rejection_message(e))
+            return
+        # ゲートウェイの場合はワーカーに任せる
+        if job_queue is not None:
+            await enqueue_job(JOB_SEARCH, message.channel.id, {'message': message_payload(message), 'query': classification.query},
+                              [ticket], PRIORITY_SEARCH)
             return
+        with ticket:
+            # トリガー語を除去したクエリ（重なるトリガーは最長一致）
+            await handle_search(message, classification.query)
+        return
 
     # それ以外は従来通りのコマンド・通常応答処理
     await bot.process_commands(message)
@@ -308,36 +824,31 @@ async def on_message(message):
         return
         
     if not message.content.startswith(bot.command_prefix):
-        # ボットへのメンションがある場合、または設定された確率で応答
-        bot_mentioned = f'<@{BOT_ID}>' in message.content or f'<@!{BOT_ID}>' in message.content
-        
-        # ボットの名前で呼びかけられたかチェック
-        bot_name_called = False
-        message_lower = message.content.lower()
-        
-        # ボットの名前とエイリアスをチェック
-        if 'bot_name' in bot_settings and 'bot_name_aliases' in bot_settings:
-            bot_name = bot_settings['bot_name'].lower()
-            bot_aliases = [alias.lower() for alias in bot_settings['bot_name_aliases']]
-            
-            # 名前が含まれているかチェック
-            if bot_name in message_lower:
-                bot_name_called = True
-                print(f"ボットの名前({bot_name})が呼びかけられました")
-            else:
-                # エイリアスをチェック
-                for alias in bot_aliases:
-                    if alias in message_lower:
-                        bot_name_called = True
-                        print(f"ボットのエイリアス({alias})が呼びかけられました")
-                        break
+        # ボットへのメンションと名前（エイリアス）の呼びかけは分類結果を使う
+        if classification.name_hits:
+            logger.debug("ボットの名前(%s)が呼びかけられました", classification.name_hits[0])
         
         # チャンネルが監視対象かチェック
         channel_monitored = (
             bot_settings['monitor_all_channels'] or 
-            message.channel.id in bot_settings['monitored_channels']
+            settings_store.contains('monitored_channels', message.channel.id)
         )
         
+        # まとめ待ちのメッセージがある監視対象のチャンネルでは、応答条件に関係なく同じバーストに加える
+        if channel_monitored and burst_coalescer.pending(message.channel.id):
+            # 同じバーストへの応答は1回だけなので処理待ちの件数は最初のメッセージで数える
+            # 応答を早める呼びかけ（メンション・名前）だけをユーザーの実行頻度の上限に数え、
+            # 上限を超えた呼びかけと通常のメッセージは応答の文脈としてだけ加える
+            urgent = bool(classification.reason)
+            if urgent:
+                try:
+                    admission.charge(KIND_URGENT, message.author.id)
+                except AdmissionRejected as e:
+                    logger.info("呼びかけを文脈としてだけバーストに加えます: %s", e.reason)
+                    urgent = False
+            await burst_coalescer.submit(message.channel.id, (message, None, urgent), urgent=urgent)
+            return
+        
         # 応答条件の決定
         # 1. メンションされた場合は必ず応答
         # 2. 名前で呼ばれた場合は必ず応答
@@ -345,12 +856,9 @@ async def on_message(message):
         should_respond = False
         response_reason = ""
         
-        if bot_mentioned:
+        if classification.reason:
             should_respond = True
-            response_reason = "メンション"
-        elif bot_name_called:
-            should_respond = True
-            response_reason = "名前呼びかけ"
+            response_reason = classification.reason
         elif channel_monitored and (hash(message.id) % 100) < bot_settings['response_rate']:
             should_respond = True
             response_reason = f"ランダム応答（確率: {bot_settings['response_rate']}%）"
@@ -358,81 +866,237 @@ async def on_message(message):
             # 応答条件を満たさない場合は処理を終了
             return
         
-        print(f"応答理由: {response_reason}")
-        
-        # チャンネルの会話履歴を取得または初期化
-        if message.channel.id not in channel_memories:
-            channel_memories[message.channel.id] = ConversationBufferMemory(return_messages=True)
-        
-        memory = channel_memories[message.channel.id]
-        
-        # 会話履歴にユーザーメッセージを追加
-        memory.chat_memory.add_user_message(f"{message.author.display_name}: {message.content}")
-        
-        # チャット監視用のチェーンを作成
-        chat_prompt = get_chat_prompt(message.channel.id)
-        print(f"プロンプトテンプレート: {chat_prompt.template}")
-        
-        # LLMChainを使用して会話履歴を活用
-        chat_chain = LLMChain(
-            llm=llm,
-            prompt=chat_prompt,
-            verbose=True
-        )
-        
+        logger.debug("応答理由: %s", response_reason)
+
+        # LLM呼び出しの受付制御（混雑時はランダム応答から先に省略する）
+        try:
+            ticket = admission.admit(KIND_URGENT if classification.reason else KIND_RANDOM, *admission_keys(message))
+        except AdmissionRejected as e:
+            logger.info("応答を省略しました: %s", e.reason)
+            return
+
+        # 監視対象のチャンネルでは、続けて届くメッセージとまとめて1回で応答する（メンション・名前の呼びかけは待ち時間を短くする）
+        # 監視対象でないチャンネルへの応答はメンション・名前の呼びかけだけなので、まとめずにすぐ応答する
+        item = (message, ticket, bool(classification.reason))
+        if channel_monitored:
+            await burst_coalescer.submit(message.channel.id, item, urgent=bool(classification.reason))
+        else:
+            await respond_to_burst(message.channel.id, [item])
+
+# まとめたメッセージに1回のLLM呼び出しで応答する
+# items は (メッセージ, 受付済みのチケット, 直接の呼びかけか) のリスト
+async def respond_to_burst(channel_id, items):
+    messages = [message for message, _, _ in items]
+    # 直接の呼びかけを含む場合は優先し、ランダム応答だけの場合はメッセージが古くなったら破棄する
+    direct = any(urgent for _, _, urgent in items)
+    # ゲートウェイの場合はワーカーに任せる（チケットはジョブの完了時に解放する）
+    if job_queue is not None:
+        await enqueue_job(JOB_RESPOND, channel_id, {'messages': [message_payload(message) for message in messages], 'direct': direct},
+                          [ticket for _, ticket, _ in items], PRIORITY_DIRECT if direct else PRIORITY_AMBIENT)
+        return
+    try:
+        await respond_to_messages(channel_id, messages, direct)
+    finally:
+        for _, ticket, _ in items:
+            if ticket is not None:
+                ticket.release()
+
+# ランダム応答を破棄する時刻（イベントループの時刻）
+def ambient_stale_at(message):
+    age = (datetime.datetime.now(datetime.timezone.utc) - message.created_at).total_seconds()
+    return asyncio.get_running_loop().time() + bot_settings['ambient_stale_seconds'] - age
+
+# 会話履歴に保存する会話のキー（Discordのメッセージごと）
+# ワーカーが途中で停止したジョブをやり直しても、同じメッセージとその応答を履歴に重複して保存しない
+def turn_key(kind, message):
+    message_id = getattr(message, 'id', None)
+    return f"{kind}-{message_id}" if message_id is not None else None
+
+async def respond_to_messages(channel_id, messages, direct=True):
+    channel = messages[-1].channel
+    if len(messages) > 1:
+        logger.debug("チャンネル%sの%d件のメッセージにまとめて応答します", channel_id, len(messages))
+
+    # 同じチャンネルの応答は直列に処理して、会話履歴の更新順序を保つ
+    async with llm_runner.channel_lock(channel_id):
+        # チャンネルの会話履歴を取得（初回は保存された履歴を読み込む）
+        memory = await channel_memories.aget_or_create(channel_id)
+
+        # 会話履歴にユーザーメッセージをすべて追加
+        for message in messages:
+            await memory.chat_memory.aadd_user_message(f"{message.author.display_name}: {message.content}", turn_key('message', message))
+
+        # チャット監視用のチェーンを取得（設定が変わるまで再利用される）
+        chat_chain = get_chat_chain(channel_id)
+
         # 会話履歴を取得
         history = memory.load_memory_variables({})['history']
-        print(f"会話履歴: {history[:100]}...")
-        
-        async with message.channel.typing():
+        logger.debug("会話履歴: %s...", history[:100])
+
+        # 1件ならそのまま、複数ならまとめたメッセージを最新のメッセージとして渡す
+        if len(messages) == 1:
+            latest = messages[0].content
+        else:
+            latest = '\n'.join(f"{message.author.display_name}: {message.content}" for message in messages)
+
+        # 会話履歴とメッセージをプロンプトの上限に収める
+        fitted, prompt_tokens = fit_prompt(chat_chain, {PART_HISTORY: history, PART_INPUT: latest})
+
+        async with channel.typing():
             try:
-                print(f"LLMにリクエストを送信します: プロバイダー={bot_settings['llm_provider']}, モデル={bot_settings['llm_model']}")
-                # チェーンを実行
-                response = chat_chain.invoke({"history": history, "input": message.content})
-                print(f"LLMからの応答を受信しました: {response}")
-                response_text = response["text"].strip()
-                print(f"整形された応答テキスト: {response_text}")
-                
-                # 応答があれば送信
-                if response_text and not response_text.lower() in ["なし", "特になし", "応答なし", "none", "no response"]:
-                    await message.channel.send(response_text)
+                logger.debug("LLMにリクエストを送信します: プロバイダー=%s, モデル=%s", bot_settings['llm_provider'], bot_settings['llm_model'])
+                # チェーンを非同期に実行し、応答があれば送信（イベントループをブロックしない）
+                if direct:
+                    priority, stale_at = PRIORITY_DIRECT, None
+                else:
+                    priority, stale_at = PRIORITY_AMBIENT, ambient_stale_at(messages[-1])
+                # 直接の呼びかけへの応答だけをキャッシュする
+                response_text = await send_chain_reply(channel, chat_chain, {"history": fitted[PART_HISTORY], "input": fitted[PART_INPUT]},
+                                                       priority=priority, stale_at=stale_at, skip_texts=NO_RESPONSE_TEXTS,
+                                                       cache_query=messages[-1].content if direct else None, prompt_tokens=prompt_tokens)
+                if response_text:
                     # ボットの応答も履歴に追加
-                    memory.chat_memory.add_ai_message(response_text)
+                    await memory.chat_memory.aadd_ai_message(response_text, turn_key('reply', messages[-1]))
+            except StaleJobDropped:
+                # 混雑している間に会話が進んだため、古いメッセージへのランダム応答は行わない
+                logger.info("チャンネル%sのランダム応答を破棄しました（メッセージが古くなりました）", channel_id)
             except Exception as e:
                 import traceback
                 error_details = traceback.format_exc()
                 print(f"エラーが発生しました: {str(e)}")
                 print(error_details)
-                await message.channel.send(f"OpenAI APIエラーが発生しました: {str(e)}\n管理者に連絡するか、!config llm_provider コマンドで別のプロバイダーに切り替えてください。")
+                await channel.send(f"OpenAI APIエラーが発生しました: {str(e)}\n管理者に連絡するか、!config llm_provider コマンドで別のプロバイダーに切り替えてください。")
+
+# チャンネルごとのメッセージのまとめ処理
+burst_coalescer = BurstCoalescer(respond_to_burst)
+
+# まとめ処理の待ち時間を設定から反映
+def configure_burst_coalescer():
+    burst_coalescer.configure(
+        bot_settings['burst_window_ms'] / 1000,
+        bot_settings['burst_max_wait_ms'] / 1000,
+        bot_settings['burst_mention_wait_ms'] / 1000
+    )
+
+configure_burst_coalescer()
+
+# 待ち行列の長さ・実行中の数・キャッシュのヒット率（メトリクスの出力時に各モジュールの統計から設定する）
+llm_in_flight_gauge = metrics.registry.gauge('discord_bot_llm_in_flight', '実行中のLLM呼び出しの数')
+llm_queue_gauge = metrics.registry.gauge('discord_bot_llm_queue_depth', '実行枠を待っているLLM呼び出しの数', labels=('priority',))
+llm_dropped_gauge = metrics.registry.gauge('discord_bot_llm_dropped', '古くなったため破棄したLLM呼び出しの累計')
+admission_pending_gauge = metrics.registry.gauge('discord_bot_admission_pending', '受け付けて処理中・処理待ちの件数')
+admission_rejected_gauge = metrics.registry.gauge('discord_bot_admission_rejected', '受付を拒否した件数の累計', labels=('kind',))
+burst_pending_gauge = metrics.registry.gauge('discord_bot_burst_pending_messages', 'まとめ待ちのメッセージの数')
+cache_hit_ratio_gauge = metrics.registry.gauge('discord_bot_cache_hit_ratio', 'キャッシュのヒット率', labels=('cache',))
+startup_seconds_gauge = metrics.registry.gauge('discord_bot_startup_seconds', '起動の段階ごとの所要時間（import: モジュールの読み込み、ready: 接続まで、warmup: 事前読み込み）', labels=('phase',))
+job_queue_gauge = metrics.registry.gauge('discord_bot_job_queue', 'ジョブキューの待機中・実行中のジョブと未反映のイベントの数', labels=('state',))
+scrape_domains_gauge = metrics.registry.gauge('discord_bot_scrape_domains', 'スクレイピング先の記録しているドメイン・省略中のドメインとURLの数と、省略した回数', labels=('state',))
+extract_pool_gauge = metrics.registry.gauge('discord_bot_extract_pool', '本文抽出のプロセスプールの状態（プロセス数・実行中・累計の抽出・制限時間超過・異常終了・入れ替え）', labels=('state',))
+http_requests_gauge = metrics.registry.gauge('discord_bot_http_requests', '共有の接続プールで送信したHTTPリクエストの累計', labels=('host',))
+
+PRIORITY_NAMES = {
+    PRIORITY_DIRECT: 'direct',
+    PRIORITY_SEARCH: 'search',
+    PRIORITY_AMBIENT: 'ambient',
+    PRIORITY_BACKGROUND: 'background',
+}
+
+def hit_ratio(hits, misses):
+    total = hits + misses
+    return hits / total if total else 0.0
+
+# ジョブキューの統計（最後に読み込んだ値）
+job_queue_stats = {}
+job_stats_task = None
+
+async def refresh_job_queue_stats():
+    global job_queue_stats
+    job_queue_stats = await asyncio.to_thread(job_queue.stats)
+
+def collect_metrics():
+    global job_stats_task
+    scheduler_stats = llm_runner.scheduler.stats()
+    llm_in_flight_gauge.set(llm_runner.in_flight)
+    for priority, name in PRIORITY_NAMES.items():
+        llm_queue_gauge.set(scheduler_stats['waiting'].get(priority, 0), priority=name)
+    llm_dropped_gauge.set(scheduler_stats['dropped'])
+
+    admission_stats = admission.stats()
+    admission_pending_gauge.set(admission_stats['pending'])
+    for kind, count in admission_stats['rejected'].items():
+        admission_rejected_gauge.set(count, kind=kind)
+    burst_pending_gauge.set(burst_coalescer.stats()['pending'])
+
+    response_stats = response_cache.stats()
+    cache_hit_ratio_gauge.set(hit_ratio(response_stats['hits'] + response_stats['similar_hits'], response_stats['misses']), cache='response')
+    cache_hit_ratio_gauge.set(hit_ratio(chain_cache.hits, chain_cache.misses), cache='chain')
+    # 検索・スクレイピングのキャッシュをまだ使っていない場合は、SQLiteのファイルを開かないよう出力しない
+    search_cache = get_search_cache(create=False)
+    if search_cache is not None:
+        cache_hit_ratio_gauge.set(search_cache.stats()['hit_ratio'], cache='search')
+    scrape_cache = get_scrape_cache(create=False) if SCRAPE_CACHE_ENABLED else None
+    if scrape_cache is not None:
+        cache_hit_ratio_gauge.set(scrape_cache.stats()['hit_ratio'], cache='scrape')
+    if job_queue is not None:
+        # ワーカーがデータベースをロックしている間もイベントループを止めないよう、別スレッドで読み込んで前回の値を出力する
+        if job_stats_task is None or job_stats_task.done():
+            job_stats_task = asyncio.get_running_loop().create_task(refresh_job_queue_stats())
+        for state, count in job_queue_stats.items():
+            job_queue_gauge.set(count, state=state)
+    extract_pool = get_extract_pool()
+    if extract_pool is not None:
+        for state, count in extract_pool.stats().items():
+            extract_pool_gauge.set(count, state=state)
+    for state, count in domain_health.stats().items():
+        scrape_domains_gauge.set(count, state=state)
+    # 接続プールをまだ使っていない（http_pool を読み込んでいない）場合は出力しない
+    http_pool = sys.modules.get('http_pool')
+    if http_pool is not None:
+        for host, host_stats in http_pool.stats()['hosts'].items():
+            http_requests_gauge.set(host_stats['requests'], host=host)
+
+metrics.registry.add_collector(collect_metrics)
 
 @bot.command(name='ask')
 async def ask(ctx, *, question):
     """AIに質問する"""
-    # 入力中表示を送信
-    async with ctx.typing():
+    # 実行頻度と処理待ちの件数を超えている場合は理由を返して受け付けない
+    try:
+        ticket = admission.admit(KIND_ASK, *admission_keys(ctx.message))
+    except AdmissionRejected as e:
+        await ctx.send(rejection_message(e))
+        return
+    
+    # ゲートウェイの場合はワーカーに任せる
+    if job_queue is not None:
+        await enqueue_job(JOB_ASK, ctx.channel.id, {'message': message_payload(ctx.message), 'question': question}, [ticket])
+        return
+    with ticket:
+        await answer_question(ctx, question)
+
+# !ask の質問に回答する
+async def answer_question(ctx, question):
+    # 入力中表示を送信（同じチャンネルの応答は直列に処理する）
+    async with llm_runner.channel_lock(ctx.channel.id), ctx.typing():
         try:
-            # チャンネルの会話履歴を取得または作成
-            if ctx.channel.id not in channel_memories:
-                channel_memories[ctx.channel.id] = ConversationBufferMemory(return_messages=True)
-            
+            # チャンネルの会話履歴を取得（初回は保存された履歴を読み込む）
+            memory = await channel_memories.aget_or_create(ctx.channel.id)
+
             # チャンネルIDを渡してチェーンを実行
             question_chain = get_question_chain(ctx.channel.id)
-            
-            # 会話履歴を取得
-            memory = channel_memories[ctx.channel.id]
+
+            # 会話履歴を取得し、質問と合わせてプロンプトの上限に収める
             history = memory.load_memory_variables({})['history']
-            
-            # 質問を実行
-            response = question_chain.invoke({"history": history, "question": question})
-            response_text = response["text"]
-            
-            # 応答を送信
-            await ctx.send(response_text)
+            fitted, prompt_tokens = fit_prompt(question_chain, {PART_HISTORY: history, PART_INPUT: question})
+
+            # 質問を非同期に実行して応答を送信（プロンプトの入力変数は input）
+            response_text = await send_chain_reply(ctx.channel, question_chain, {"history": fitted[PART_HISTORY], "input": fitted[PART_INPUT]},
+                                                   placeholder='考え中...', cache_query=question, prompt_tokens=prompt_tokens)
             
             # 会話履歴に追加
-            memory = channel_memories[ctx.channel.id]
-            memory.chat_memory.add_user_message(f"{ctx.author.display_name}: {ctx.message.content}")
-            memory.chat_memory.add_ai_message(response_text)
+            await memory.chat_memory.aadd_user_message(f"{ctx.author.display_name}: {ctx.message.content}", turn_key('message', ctx.message))
+            if response_text:
+                await memory.chat_memory.aadd_ai_message(response_text, turn_key('reply', ctx.message))
             
         except Exception as e:
             error_message = str(e)
@@ -462,6 +1126,7 @@ async def commands_help(ctx):
 - `!config`: ボットの設定を表示・変更する
 - `!monitor`: チャンネルの監視状態を切り替える
 - `!set_prompt` / `!prompt`: チャンネルごとのプロンプトを設定する
+- `!similar_cache`: チャンネルで類似質問へのキャッシュした応答を有効・無効にする
 
 **ボットとの会話方法:**
 - ボットの名前で呼びかける: 「AI_Agent」「AIエージェント」「エージェント」「AI」「ボット」
@@ -474,8 +1139,8 @@ async def commands_help(ctx):
 @commands.has_permissions(administrator=True)
 async def clear_memory(ctx):
     """チャンネルの会話履歴をクリア（管理者のみ）"""
-    if ctx.channel.id in channel_memories:
-        channel_memories[ctx.channel.id] = ConversationBufferMemory(return_messages=True)
+    if await channel_memories.acontains(ctx.channel.id):
+        await channel_memories.aclear(ctx.channel.id)
         await ctx.send("このチャンネルの会話履歴をクリアしました。")
     else:
         await ctx.send("このチャンネルには保存された会話履歴がありません。")
@@ -493,8 +1158,26 @@ async def config_command(ctx, setting=None, value=None):
         settings_str += "\n設定可能な項目:\n"
         settings_str += "`response_rate`: 自動応答する確率（%）\n"
         settings_str += "`monitor_all_channels`: すべてのチャンネルを監視するか（True/False）\n"
-        settings_str += "`llm_provider`: 使用するLLMプロバイダー（openai, openrouter, anthropic, google, litellm）\n"
+        settings_str += "`llm_provider`: 使用するLLMプロバイダー（openai, openrouter, anthropic, google, litellm, local）\n"
         settings_str += "`llm_model`: 使用するモデル名（プロバイダーによって異なる）\n"
+        settings_str += "`llm_max_concurrency`: LLMの同時実行数の上限\n"
+        settings_str += "`llm_backends`: 予備として切り替えるLLMプロバイダー（カンマ区切り、none で解除）\n"
+        settings_str += "`llm_hedge` / `llm_hedge_min_ms`: 応答が遅いときに予備にも送るか（True/False）と最小の待ち時間（ミリ秒）\n"
+        settings_str += "`llm_circuit_failures` / `llm_circuit_open_seconds`: 連続失敗何回でバックエンドを何秒使わないか\n"
+        settings_str += "`search_timeout`: 検索とスクレイピング全体の制限時間（秒）\n"
+        settings_str += "`burst_window_ms`: 続けて届いたメッセージをまとめて応答するための待ち時間（ミリ秒、0でまとめない）\n"
+        settings_str += "`burst_max_wait_ms` / `burst_mention_wait_ms`: まとめて応答するまでの最大待ち時間（ミリ秒、通常 / メンション・名前の呼びかけ）\n"
+        settings_str += "`rate_limit_user_per_minute` / `rate_limit_channel_per_minute` / `rate_limit_guild_per_minute` / `rate_limit_global_per_minute`: 1分あたりのLLM呼び出し・検索の上限（0で無制限）\n"
+        settings_str += "`max_pending_jobs`: 処理待ちのLLM呼び出し・検索の上限\n"
+        settings_str += "`random_shed_percent`: 処理待ちが上限のこの割合（%）に達したらランダム応答を省略する\n"
+        settings_str += "`priority_aging_seconds`: 待ち時間がこの秒数を超えるごとに処理の優先度を引き上げる\n"
+        settings_str += "`ambient_stale_seconds`: きっかけのメッセージからこの秒数が過ぎたランダム応答は破棄する\n"
+        settings_str += "`stream_responses`: 応答を生成しながら表示するか（True/False）\n"
+        settings_str += "`stream_edit_interval_ms`: 生成中のメッセージを編集する最小間隔（ミリ秒）\n"
+        settings_str += "`response_cache_ttl` / `response_cache_size`: 応答をキャッシュする秒数（0で無効）と最大件数\n"
+        settings_str += "`response_cache_similarity`: 類似質問とみなす類似度（%、チャンネルごとに `!similar_cache` で有効化）\n"
+        settings_str += "`prompt_max_tokens` / `prompt_reserve_tokens`: プロンプトのトークン数の上限（0でモデルのコンテキスト長）と応答用に残す分\n"
+        settings_str += "`prompt_weight_input` / `prompt_weight_history`: 上限をメッセージと会話履歴に配分する重み\n"
         settings_str += "`system_prompt`: システムプロンプトテンプレート\n"
         
         await ctx.send(settings_str)
@@ -513,7 +1196,7 @@ async def config_command(ctx, setting=None, value=None):
     # 設定を変更
     try:
         # 値の型に応じて変換
-        if setting == 'monitor_all_channels':
+        if isinstance(bot_settings[setting], bool):
             if value.lower() in ['true', 'yes', 'on', '1']:
                 bot_settings[setting] = True
             elif value.lower() in ['false', 'no', 'off', '0']:
@@ -527,26 +1210,49 @@ async def config_command(ctx, setting=None, value=None):
             except ValueError:
                 await ctx.send(f"無効な値です。整数を指定してください。")
                 return
+            # LLMの同時実行数が変更された場合はランナーに反映
+            if setting == 'llm_max_concurrency':
+                llm_runner.set_max_concurrency(bot_settings[setting])
+            elif setting == 'priority_aging_seconds':
+                llm_runner.scheduler.aging_seconds = bot_settings[setting]
+            # まとめ処理の待ち時間が変更された場合は反映
+            elif setting.startswith('burst_'):
+                configure_burst_coalescer()
+            # 受付制御の上限が変更された場合は反映
+            elif setting.startswith('rate_limit_') or setting in ('max_pending_jobs', 'random_shed_percent'):
+                configure_admission()
+            # 応答のキャッシュの設定が変更された場合は反映
+            elif setting.startswith('response_cache_'):
+                configure_response_cache()
         elif isinstance(bot_settings[setting], str):
-            if setting == 'llm_provider' and value not in ['openai', 'openrouter', 'anthropic', 'google', 'litellm']:
-                await ctx.send(f"無効なLLMプロバイダーです。`openai`, `openrouter`, `anthropic`, `google`, `litellm` のいずれかを指定してください。")
+            if setting == 'llm_provider' and value not in LLM_PROVIDERS:
+                await ctx.send(f"無効なLLMプロバイダーです。`openai`, `openrouter`, `anthropic`, `google`, `litellm`, `local` のいずれかを指定してください。")
                 return
             bot_settings[setting] = value
-            
-            # LLMプロバイダーが変更された場合、LLMを再初期化
-            if setting == 'llm_provider' or setting == 'llm_model':
-                global llm
-                try:
-                    llm = initialize_llm()
-                    await ctx.send(f"LLMプロバイダーを `{bot_settings['llm_provider']}` に変更し、モデル `{bot_settings['llm_model']}` で初期化しました。")
-                except Exception as e:
-                    await ctx.send(f"LLMの初期化中にエラーが発生しました: {str(e)}\n設定は変更されましたが、APIキーが正しく設定されているか確認してください。")
+        elif setting == 'llm_backends':
+            # 予備のLLMプロバイダーはカンマ区切りで指定する（none で解除）
+            backends = [] if value.lower() == 'none' else [name.strip() for name in value.split(',') if name.strip()]
+            invalid = [name for name in backends if name not in LLM_PROVIDERS]
+            if invalid:
+                await ctx.send(f"無効なLLMプロバイダーです: {', '.join(invalid)}")
+                return
+            bot_settings[setting] = backends
         elif isinstance(bot_settings[setting], list):
             # リスト型の設定は別のコマンドで管理
             await ctx.send(f"リスト型の設定は `!monitor` コマンドで管理してください。")
             return
         
-        # 設定を保存
+        # LLMの設定が変更された場合、LLMを再初期化
+        if setting in LLM_SETTINGS:
+            global llm
+            try:
+                llm = initialize_llm()
+                await ctx.send(f"LLMプロバイダーを `{bot_settings['llm_provider']}` に変更し、モデル `{bot_settings['llm_model']}` で初期化しました。")
+            except Exception as e:
+                await ctx.send(f"LLMの初期化中にエラーが発生しました: {str(e)}\n設定は変更されましたが、APIキーが正しく設定されているか確認してください。")
+        
+        # キャッシュ済みのプロンプトとチェーンを破棄して設定を保存
+        bump_settings_version()
         save_settings()
         
         await ctx.send(f"設定 `{setting}` を `{bot_settings[setting]}` に変更しました。")
@@ -581,6 +1287,7 @@ async def set_prompt_internal(ctx, prompt_text=None):
         # プロンプトをデフォルトにリセット
         if channel_id in bot_settings['channel_prompts']:
             del bot_settings['channel_prompts'][channel_id]
+            bump_settings_version()
             save_settings()
             await ctx.send("このチャンネルのプロンプトをデフォルトにリセットしました。")
         else:
@@ -589,6 +1296,7 @@ async def set_prompt_internal(ctx, prompt_text=None):
     
     # 新しいプロンプトを設定
     bot_settings['channel_prompts'][channel_id] = prompt_text
+    bump_settings_version()
     save_settings()
     await ctx.send("このチャンネルのプロンプトを設定しました。")
 
@@ -602,7 +1310,7 @@ async def monitor_command(ctx, action=None):
         # 現在の監視状態を表示
         if bot_settings['monitor_all_channels']:
             await ctx.send("現在、すべてのチャンネルを監視しています。")
-        elif channel_id in bot_settings['monitored_channels']:
+        elif settings_store.contains('monitored_channels', channel_id):
             await ctx.send("このチャンネルは監視対象です。")
         else:
             await ctx.send("このチャンネルは監視対象ではありません。")
@@ -610,17 +1318,13 @@ async def monitor_command(ctx, action=None):
     
     if action.lower() in ['on', 'add', 'enable', 'true']:
         # チャンネルを監視対象に追加
-        if channel_id not in bot_settings['monitored_channels']:
-            bot_settings['monitored_channels'].append(channel_id)
-            save_settings()
+        if settings_store.add('monitored_channels', channel_id):
             await ctx.send("このチャンネルを監視対象に追加しました。")
         else:
             await ctx.send("このチャンネルはすでに監視対象です。")
     elif action.lower() in ['off', 'remove', 'disable', 'false']:
         # チャンネルを監視対象から削除
-        if channel_id in bot_settings['monitored_channels']:
-            bot_settings['monitored_channels'].remove(channel_id)
-            save_settings()
+        if settings_store.remove('monitored_channels', channel_id):
             await ctx.send("このチャンネルを監視対象から削除しました。")
         else:
             await ctx.send("このチャンネルは監視対象ではありません。")
@@ -637,6 +1341,32 @@ async def monitor_command(ctx, action=None):
     else:
         await ctx.send("無効なアクションです。`on`, `off`, `all`, `none` のいずれかを指定してください。")
 
+@bot.command(name='similar_cache')
+@commands.has_permissions(administrator=True)
+async def similar_cache_command(ctx, action=None):
+    """チャンネルで類似質問にキャッシュした応答を返すかを切り替える（管理者のみ）"""
+    channel_id = ctx.channel.id
+    
+    if action is None:
+        # 現在の状態を表示
+        if settings_store.contains('response_cache_similar_channels', channel_id):
+            await ctx.send("このチャンネルでは類似質問にもキャッシュした応答を返します。")
+        else:
+            await ctx.send("このチャンネルではプロンプトが完全に一致した場合だけキャッシュした応答を返します。")
+        return
+    
+    if action.lower() in ['on', 'add', 'enable', 'true']:
+        settings_store.add('response_cache_similar_channels', channel_id)
+        await ctx.send("このチャンネルで類似質問へのキャッシュした応答を有効にしました。")
+    elif action.lower() in ['off', 'remove', 'disable', 'false']:
+        settings_store.remove('response_cache_similar_channels', channel_id)
+        await ctx.send("このチャンネルで類似質問へのキャッシュした応答を無効にしました。")
+    else:
+        await ctx.send("無効なアクションです。`on`, `off` のいずれかを指定してください。")
+
+# モジュールの読み込みにかかった時間を記録
+record_startup('import', time.perf_counter() - STARTUP_STARTED)
+
 # Run the bot
 if __name__ == "__main__":
     bot.run(DISCORD_TOKEN)
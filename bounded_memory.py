@@ -0,0 +1,261 @@
+"""
+トークン数の上限付き会話メモリモジュール
+最近の会話をトークン数の上限内でリングバッファに保持し、
+上限からあふれた古い会話はバックグラウンドで要約に畳み込みます。
+ConversationBufferMemoryの代わりに使用でき、会話が長く続いてもプロンプトのサイズは一定に保たれます。
+"""
+
+import asyncio
+import logging
+from collections import deque
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from token_estimator import estimate_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# デフォルトのトークン数の上限
+DEFAULT_MAX_TOKENS = 1500
+DEFAULT_SUMMARY_MAX_TOKENS = 300
+
+
+class _ChatMessageLog:
+    """ConversationBufferMemory.chat_memory と同じ追加用インターフェース"""
+
+    def __init__(self, memory):
+        self._memory = memory
+
+    def add_user_message(self, text, turn_key=None):
+        self._memory.append('human', text, turn_key)
+
+    def add_ai_message(self, text, turn_key=None):
+        self._memory.append('ai', text, turn_key)
+
+    async def aadd_user_message(self, text, turn_key=None):
+        await self._memory.aappend('human', text, turn_key)
+
+    async def aadd_ai_message(self, text, turn_key=None):
+        await self._memory.aappend('ai', text, turn_key)
+
+    @property
+    def messages(self):
+        return self._memory.messages
+
+
+class TokenBudgetMemory:
+    """
+    トークン数の上限付き会話メモリ
+
+    Args:
+        max_tokens (int): 直近の会話として保持するトークン数の上限
+        summary_max_tokens (int): 要約のトークン数の上限
+        summarizer: async def summarizer(summary, new_lines) -> str
+            古い会話を要約に畳み込むコルーチン関数。Noneの場合は単純な切り詰めで要約する
+        memory_key (str): load_memory_variablesで返すキー
+        return_messages (bool): Trueならメッセージのリスト、Falseなら文字列で履歴を返す
+        ai_prefix (str): 文字列で返す場合のAIの発言の接頭辞
+        store (HistoryStore): 会話と要約を永続化するストア（省略時はメモリ上のみ）
+        channel_id (int): ストアに保存するときのチャンネルID
+    """
+
+    def __init__(self, max_tokens=DEFAULT_MAX_TOKENS, summary_max_tokens=DEFAULT_SUMMARY_MAX_TOKENS,
+                 summarizer=None, memory_key='history', return_messages=False, ai_prefix='AI',
+                 store=None, channel_id=None):
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer
+        self.memory_key = memory_key
+        self.return_messages = return_messages
+        self.ai_prefix = ai_prefix
+        self.store = store
+        self.channel_id = channel_id
+        self.chat_memory = _ChatMessageLog(self)
+        self.summary = ''
+        # 要約に含めた最後の会話のストアでのID
+        self.summarized_until = None
+        self._turns = deque()  # (role, text, tokens, ストアでのID)
+        self._token_count = 0
+        self._pending = []  # 要約待ちの古い会話
+        self._summary_task = None
+
+    def _format_turn(self, role, text):
+        return text if role == 'human' else f"{self.ai_prefix}: {text}"
+
+    def _push(self, role, text, message_id=None):
+        """リングバッファに会話を追加し、上限からあふれた古い会話を返します。"""
+        tokens = estimate_tokens(self._format_turn(role, text))
+        self._turns.append((role, text, tokens, message_id))
+        self._token_count += tokens
+        overflow = []
+        # 直近の1件は上限を超えていても残す
+        while self._token_count > self.max_tokens and len(self._turns) > 1:
+            old = self._turns.popleft()
+            self._token_count -= old[2]
+            overflow.append(old)
+        return overflow
+
+    def append(self, role, text, turn_key=None):
+        """
+        会話を追加し、上限を超えた古い会話を要約待ちに移します。
+        turn_key を指定した場合、ストアに同じキーで保存済みの会話（やり直したジョブの前回の実行分）は追加せず、内容を置き換えます。
+        """
+        message_id = None
+        if self.store is not None:
+            message_id = self.store.append(self.channel_id, role, text, turn_key)
+        self._add(role, text, turn_key, message_id)
+
+    async def aappend(self, role, text, turn_key=None):
+        """
+        appendの非同期版です。
+        ストアへの書き込みは別スレッドで行い、他のプロセスがファイルをロックしている間もイベントループを止めません。
+        """
+        message_id = None
+        if self.store is not None:
+            message_id = await asyncio.to_thread(self.store.append, self.channel_id, role, text, turn_key)
+        self._add(role, text, turn_key, message_id)
+
+    def _add(self, role, text, turn_key, message_id):
+        """ストアに保存した会話をリングバッファに追加します。"""
+        if turn_key is not None and message_id is not None and self._replace(message_id, text):
+            return
+        self._pending.extend(self._push(role, text, message_id))
+        if self._pending:
+            self._schedule_summary()
+
+    def _replace(self, message_id, text):
+        """
+        保存済みの会話の内容を置き換えます。
+
+        Returns:
+            bool: 会話がメモリ上にある、またはすでに要約に含めた場合はTrue
+        """
+        if message_id <= (self.summarized_until or 0):
+            return True
+        for index, (role, _, tokens, turn_id) in enumerate(self._turns):
+            if turn_id == message_id:
+                new_tokens = estimate_tokens(self._format_turn(role, text))
+                self._turns[index] = (role, text, new_tokens, turn_id)
+                self._token_count += new_tokens - tokens
+                return True
+        return any(turn[3] == message_id for turn in self._pending)
+
+    def restore(self, summary, turns, summarized_until=None):
+        """
+        ストアから読み込んだ要約と会話を復元します。
+        上限に収まらない古い会話のうち、要約に含めた位置（summarized_until）より後のもの
+        （要約を保存する前にプロセスが終了した場合など）は、実行時と同じく要約待ちに移します。
+
+        Args:
+            summary (str): 保存された要約
+            turns (list): [(id, role, text), ...] 古い順
+            summarized_until (int): 要約に含めた最後の会話のID（Noneは記録のない古い形式のデータ）
+        """
+        self.summary = summary
+        self.summarized_until = summarized_until
+        overflow = []
+        for message_id, role, text in turns:
+            overflow.extend(self._push(role, text, message_id))
+        if summarized_until is None and summary:
+            # 要約に含めた位置を記録していないデータは、あふれた会話がすべて要約に含まれているものとして扱う
+            return
+        self._pending.extend(turn for turn in overflow if turn[3] > (summarized_until or 0))
+        if self._pending:
+            self._schedule_summary()
+
+    def _update_summary(self, summary, summarized_until=None):
+        self.summary = summary
+        if summarized_until is not None:
+            self.summarized_until = max(summarized_until, self.summarized_until or 0)
+
+    def _set_summary(self, summary, summarized_until=None):
+        self._update_summary(summary, summarized_until)
+        if self.store is not None:
+            self.store.save_summary(self.channel_id, summary, self.summarized_until)
+
+    @property
+    def busy(self):
+        """要約の作成中かどうか"""
+        return bool(self._pending) or (self._summary_task is not None and not self._summary_task.done())
+
+    def _schedule_summary(self):
+        """要約待ちの会話の畳み込みをバックグラウンドで開始します。"""
+        if self._summary_task is not None and not self._summary_task.done():
+            return  # 実行中のタスクが残りもまとめて処理する
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self.summarizer is None or loop is None:
+            self._fold_pending_locally()
+            return
+        self._summary_task = loop.create_task(self._summarize_pending())
+
+    def _take_pending(self):
+        """要約待ちの会話を取り出し、(会話のテキスト, 最後の会話のストアでのID) を返します。"""
+        pending, self._pending = self._pending, []
+        lines = '\n'.join(self._format_turn(role, text) for role, text, _, _ in pending)
+        last_id = max((message_id for _, _, _, message_id in pending if message_id is not None), default=None)
+        return lines, last_id
+
+    def _fold_locally(self):
+        """LLMを使わずに、古い会話を要約の末尾に追加して切り詰め、(要約, 最後の会話のストアでのID) を返します。"""
+        new_lines, last_id = self._take_pending()
+        combined = f"{self.summary}\n{new_lines}".strip()
+        # 新しい内容を優先して残す
+        return truncate_to_tokens(combined[::-1], self.summary_max_tokens)[::-1], last_id
+
+    def _fold_pending_locally(self):
+        """LLMを使わずに、古い会話を要約に畳み込んで保存します。"""
+        self._set_summary(*self._fold_locally())
+
+    async def _summarize_pending(self):
+        """要約待ちの会話がなくなるまで要約に畳み込みます（ストアへの保存は別スレッドで行う）。"""
+        # clear でタスクをキャンセルしても別スレッドの保存は止まらないため、削除後の保存はストアが取り消す
+        generation = self.store.generation(self.channel_id) if self.store is not None else None
+        while self._pending:
+            summary = self.summary
+            new_lines, last_id = self._take_pending()
+            try:
+                new_summary = await self.summarizer(summary, new_lines)
+                self._update_summary(truncate_to_tokens(new_summary.strip(), self.summary_max_tokens), last_id)
+            except Exception as e:
+                logger.warning("会話の要約に失敗したため切り詰めで代用します: %s", e)
+                self._pending.insert(0, ('human', new_lines, 0, last_id))
+                self._update_summary(*self._fold_locally())
+            if self.store is not None:
+                await asyncio.to_thread(self.store.save_summary, self.channel_id, self.summary, self.summarized_until,
+                                        generation)
+
+    @property
+    def messages(self):
+        """要約と直近の会話をメッセージのリストで返します。"""
+        messages = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"これまでの会話の要約: {self.summary}"))
+        for role, text, _, _ in self._turns:
+            messages.append(HumanMessage(content=text) if role == 'human' else AIMessage(content=text))
+        return messages
+
+    @property
+    def token_count(self):
+        """現在の履歴（要約を含む）の推定トークン数"""
+        return self._token_count + estimate_tokens(self.summary)
+
+    def load_memory_variables(self, inputs):
+        """ConversationBufferMemoryと同じ形式で履歴を返します。"""
+        if self.return_messages:
+            return {self.memory_key: self.messages}
+        lines = [self._format_turn(role, text) for role, text, _, _ in self._turns]
+        if self.summary:
+            lines.insert(0, f"（これまでの会話の要約: {self.summary}）")
+        return {self.memory_key: '\n'.join(lines)}
+
+    def clear(self):
+        """メモリ上の履歴と要約を消去します（ストアの削除はChannelMemoryRegistry.clearで行う）。"""
+        if self._summary_task is not None and not self._summary_task.done():
+            self._summary_task.cancel()
+        self._summary_task = None
+        self._turns.clear()
+        self._token_count = 0
+        self._pending = []
+        self.summary = ''
+        self.summarized_until = None
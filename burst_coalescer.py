@@ -0,0 +1,121 @@
+"""
+チャンネルごとのメッセージのまとめ処理モジュール
+短い時間に続けて届いたメッセージを1つのまとまり（バースト）として集め、
+最後のメッセージから一定時間新しいメッセージが来なくなった時点でまとめて処理します。
+活発なチャンネルでLLMの呼び出し回数と重複した応答を減らします。
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Burst:
+    """1つのチャンネルで集めているメッセージ"""
+
+    def __init__(self, now):
+        self.items = []
+        self.first_at = now
+        self.last_at = now
+        self.urgent_deadline = None
+        self.changed = asyncio.Event()
+
+
+class BurstCoalescer:
+    """
+    キーごとにメッセージを集めてまとめて処理するクラス
+
+    Args:
+        handler: async def handler(key, items)
+            まとめたメッセージを処理するコルーチン関数（items は届いた順のリスト）
+        window (float): 最後のメッセージからこの秒数だけ新しいメッセージを待つ（0以下ならまとめない）
+        max_wait (float): 最初のメッセージから処理を始めるまでの最大待ち時間（秒）
+        urgent_wait (float): 急ぎのメッセージ（メンションや名前の呼びかけ）の最大待ち時間（秒）
+    """
+
+    def __init__(self, handler, window=1.5, max_wait=5.0, urgent_wait=0.5):
+        self.handler = handler
+        self._bursts = {}
+        self._tasks = set()
+        self.messages = 0
+        self.flushes = 0
+        self.configure(window, max_wait, urgent_wait)
+
+    def configure(self, window, max_wait, urgent_wait):
+        """待ち時間の設定を変更します（集めている途中のバーストにも反映されます）。"""
+        self.window = max(0.0, window)
+        self.max_wait = max(self.window, max_wait)
+        self.urgent_wait = max(0.0, min(urgent_wait, self.max_wait))
+        for burst in self._bursts.values():
+            burst.changed.set()
+
+    def pending(self, key):
+        """キーにまとめ待ちのメッセージがあるかどうかを返します。"""
+        return key in self._bursts
+
+    async def submit(self, key, item, urgent=False):
+        """
+        メッセージをまとめ待ちに追加します。
+        まとめ処理が無効（window が0以下）の場合はその場で処理します。
+
+        Args:
+            key: まとめる単位（チャンネルID）
+            item: 処理対象のメッセージ
+            urgent (bool): 急ぎのメッセージかどうか（urgent_wait 以内に処理する）
+        """
+        self.messages += 1
+        if self.window <= 0 and key not in self._bursts:
+            self.flushes += 1
+            await self.handler(key, [item])
+            return
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = self._bursts[key] = _Burst(now)
+            task = loop.create_task(self._run(key, burst))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        burst.items.append(item)
+        burst.last_at = now
+        if urgent:
+            deadline = now + self.urgent_wait
+            if burst.urgent_deadline is None or deadline < burst.urgent_deadline:
+                burst.urgent_deadline = deadline
+        burst.changed.set()
+
+    def _deadline(self, burst):
+        deadline = min(burst.last_at + self.window, burst.first_at + self.max_wait)
+        if burst.urgent_deadline is not None:
+            deadline = min(deadline, burst.urgent_deadline)
+        return deadline
+
+    async def _run(self, key, burst):
+        """締め切りまで待ってから、集めたメッセージをまとめて処理します。"""
+        loop = asyncio.get_running_loop()
+        while True:
+            burst.changed.clear()
+            delay = self._deadline(burst) - loop.time()
+            if delay <= 0:
+                break
+            try:
+                await asyncio.wait_for(burst.changed.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        # 処理中に届いたメッセージは次のバーストとして集める
+        del self._bursts[key]
+        self.flushes += 1
+        try:
+            await self.handler(key, burst.items)
+        except Exception:
+            logger.exception("%sのまとめたメッセージの処理中にエラーが発生しました", key)
+
+    def stats(self):
+        """受け付けたメッセージ数と処理回数を返します。"""
+        return {
+            'messages': self.messages,
+            'flushes': self.flushes,
+            'pending': sum(len(burst.items) for burst in self._bursts.values()),
+        }
@@ -0,0 +1,227 @@
+"""
+スクレイピング先のドメインの状態を記録するモジュール
+ドメインごとの応答時間を指数移動平均（EWMA）で記録して、そのドメインに合わせたタイムアウトを決め、
+最近失敗したドメインとURLは待ち時間を伸ばしながら一定時間スクレイピングを省略します（ネガティブキャッシュ）。
+
+- 接続できない・タイムアウト・429や5xxを返すドメインは、続けて失敗するとドメインごと省略する
+- 本文を抽出できない・HTMLではない・404などを返すURL（ペイウォールやログインページなど）はURLだけを省略する
+- 成功するとドメインの失敗の記録は消え、省略していたURLも再び取得する
+
+状態はプロセスごとにメモリ上に保持します。
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# ドメインの状態の設定（環境変数で変更可能）
+# タイムアウトの下限（秒）。上限は web_scraper の SCRAPE_TIMEOUT
+SCRAPE_MIN_TIMEOUT = float(os.getenv('SCRAPE_MIN_TIMEOUT', '3'))
+# この回数続けて失敗したドメインを省略する
+SCRAPE_DOMAIN_FAILURES = int(os.getenv('SCRAPE_DOMAIN_FAILURES', '2'))
+# ドメインを省略する最初の時間（秒）。続けて失敗するたびに2倍にする
+SCRAPE_DOMAIN_BACKOFF = float(os.getenv('SCRAPE_DOMAIN_BACKOFF', '60'))
+# URLを省略する最初の時間（秒）。同じURLで失敗するたびに2倍にする
+SCRAPE_URL_BACKOFF = float(os.getenv('SCRAPE_URL_BACKOFF', '600'))
+# 省略する時間の上限（秒）
+SCRAPE_MAX_BACKOFF = float(os.getenv('SCRAPE_MAX_BACKOFF', '3600'))
+
+# 応答時間の指数移動平均の重み（TCPの再送タイムアウトの計算と同じ値）
+EWMA_ALPHA = 0.125
+EWMA_BETA = 0.25
+# タイムアウト = 平均 + DEVIATION_FACTOR × 平均偏差
+DEVIATION_FACTOR = 4
+# 省略する時間を2倍にする回数の上限（指数が大きくなりすぎないようにする）
+MAX_BACKOFF_DOUBLINGS = 16
+# 記録するドメイン・URLの数の上限（古いものから削除する）
+MAX_TRACKED = 4096
+
+# 失敗の種類
+FAILURE_TIMEOUT = 'timeout'  # タイムアウト（ドメインの失敗）
+FAILURE_CONNECT = 'connect'  # 接続できない・429・5xx（ドメインの失敗）
+FAILURE_HTTP = 'http'  # 404などのURLのエラー（URLの失敗）
+FAILURE_EMPTY = 'empty'  # 本文を抽出できない・HTMLではない（URLの失敗）
+
+DOMAIN_FAILURES = (FAILURE_TIMEOUT, FAILURE_CONNECT)
+
+
+def domain_of(url):
+    """URLのドメイン（小文字のホスト名）を返します。"""
+    return (urlparse(url).hostname or '').lower()
+
+
+def failure_for_status(status_code):
+    """HTTPのステータスコードに対応する失敗の種類を返します。"""
+    if status_code == 429 or status_code >= 500:
+        return FAILURE_CONNECT
+    return FAILURE_HTTP
+
+
+class _DomainState:
+    __slots__ = ('srtt', 'rttvar', 'samples', 'failures', 'blocked_until', 'last_error')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = 0.0
+        self.samples = 0
+        self.failures = 0
+        self.blocked_until = 0.0
+        self.last_error = None
+
+
+class DomainHealth:
+    """
+    ドメインごとの応答時間と、最近失敗したドメイン・URLを記録します。
+
+    Args:
+        min_timeout (float): タイムアウトの下限（秒）
+        failure_threshold (int): この回数続けて失敗したドメインを省略する
+        domain_backoff (float): ドメインを省略する最初の時間（秒）
+        url_backoff (float): URLを省略する最初の時間（秒）
+        max_backoff (float): 省略する時間の上限（秒）
+
+    使用例:
+        timeout = domain_health.timeout_for(url, SCRAPE_TIMEOUT)
+        reason = domain_health.skip_reason(url)  # 省略する場合は理由の文字列
+        domain_health.record_success(url, elapsed, extracted=True)
+        domain_health.record_failure(url, FAILURE_TIMEOUT, 'タイムアウト')
+    """
+
+    def __init__(self, min_timeout=SCRAPE_MIN_TIMEOUT, failure_threshold=SCRAPE_DOMAIN_FAILURES,
+                 domain_backoff=SCRAPE_DOMAIN_BACKOFF, url_backoff=SCRAPE_URL_BACKOFF, max_backoff=SCRAPE_MAX_BACKOFF):
+        self.min_timeout = min_timeout
+        self.failure_threshold = max(1, failure_threshold)
+        self.domain_backoff = domain_backoff
+        self.url_backoff = url_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._domains = OrderedDict()
+        # URL → (失敗の回数, 省略する期限, エラー内容)
+        self._urls = OrderedDict()
+        self.skipped = 0
+
+    def _domain(self, domain):
+        state = self._domains.get(domain)
+        if state is None:
+            state = self._domains[domain] = _DomainState()
+            if len(self._domains) > MAX_TRACKED:
+                self._domains.popitem(last=False)
+        else:
+            self._domains.move_to_end(domain)
+        return state
+
+    def timeout_for(self, url, max_timeout):
+        """
+        ドメインの応答時間から決めたタイムアウト（秒）を返します。
+        応答時間の記録がないドメインは max_timeout を返します。
+        """
+        with self._lock:
+            state = self._domains.get(domain_of(url))
+            if state is None or state.srtt is None:
+                return max_timeout
+            timeout = state.srtt + DEVIATION_FACTOR * state.rttvar
+        return min(max_timeout, max(self.min_timeout, timeout))
+
+    def skip_reason(self, url):
+        """
+        最近失敗したドメイン・URLであれば、省略する理由を返します。
+
+        Returns:
+            str: 省略する理由（省略しない場合は None）
+        """
+        now = time.time()
+        with self._lock:
+            state = self._domains.get(domain_of(url))
+            if state is not None and state.blocked_until > now:
+                self.skipped += 1
+                return f"最近失敗したサイトのため取得を省略しました（{state.last_error}、あと{state.blocked_until - now:.0f}秒）"
+            entry = self._urls.get(url)
+            if entry is not None and entry[1] > now:
+                self.skipped += 1
+                return f"最近失敗したページのため取得を省略しました（{entry[2]}、あと{entry[1] - now:.0f}秒）"
+        return None
+
+    def is_healthy(self, url):
+        """省略の対象でなければ True を返します（省略の回数は数えません）。"""
+        now = time.time()
+        with self._lock:
+            state = self._domains.get(domain_of(url))
+            if state is not None and state.blocked_until > now:
+                return False
+            entry = self._urls.get(url)
+            return entry is None or entry[1] <= now
+
+    def record_success(self, url, elapsed, extracted=True):
+        """
+        ダウンロードに成功したことを記録します。
+        本文を抽出できなかった場合（extracted=False）は、ドメインは正常としてURLだけを省略します。
+
+        Args:
+            url (str): 取得したURL
+            elapsed (float): ダウンロードにかかった時間（秒）
+            extracted (bool): 本文を抽出できたか
+        """
+        with self._lock:
+            state = self._domain(domain_of(url))
+            if state.srtt is None:
+                state.srtt = elapsed
+                state.rttvar = elapsed / 2
+            else:
+                state.rttvar = (1 - EWMA_BETA) * state.rttvar + EWMA_BETA * abs(state.srtt - elapsed)
+                state.srtt = (1 - EWMA_ALPHA) * state.srtt + EWMA_ALPHA * elapsed
+            state.samples += 1
+            state.failures = 0
+            state.blocked_until = 0.0
+            if extracted:
+                self._urls.pop(url, None)
+        if not extracted:
+            self.record_failure(url, FAILURE_EMPTY, '本文を抽出できませんでした')
+
+    def record_failure(self, url, kind, error=''):
+        """
+        取得に失敗したことを記録します。
+        ドメインの失敗（FAILURE_TIMEOUT・FAILURE_CONNECT）は続けて failure_threshold 回でドメインを省略し、
+        それ以外はURLを省略します。省略する時間は失敗するたびに2倍にします。
+
+        Args:
+            url (str): 取得に失敗したURL
+            kind (str): 失敗の種類（FAILURE_*）
+            error (str): エラー内容（省略の理由として表示する）
+        """
+        now = time.time()
+        # 省略の理由として表示するため、エラー内容は1行目だけを残す
+        error = (error or kind).splitlines()[0]
+        with self._lock:
+            if kind in DOMAIN_FAILURES:
+                state = self._domain(domain_of(url))
+                state.failures += 1
+                state.last_error = error
+                if kind == FAILURE_TIMEOUT:
+                    # 応答時間から決めたタイムアウトが短すぎた可能性があるため、次は上限まで待つ
+                    state.srtt = None
+                if state.failures >= self.failure_threshold:
+                    backoff = self.domain_backoff * 2 ** min(state.failures - self.failure_threshold, MAX_BACKOFF_DOUBLINGS)
+                    state.blocked_until = now + min(backoff, self.max_backoff)
+                return
+            failures = self._urls.pop(url, (0, 0.0, ''))[0] + 1
+            backoff = min(self.url_backoff * 2 ** min(failures - 1, MAX_BACKOFF_DOUBLINGS), self.max_backoff)
+            self._urls[url] = (failures, now + backoff, error)
+            if len(self._urls) > MAX_TRACKED:
+                self._urls.popitem(last=False)
+
+    def stats(self):
+        """記録しているドメインの数・省略中のドメインとURLの数・省略した回数を返します。"""
+        now = time.time()
+        with self._lock:
+            return {
+                'domains': len(self._domains),
+                'blocked_domains': sum(1 for state in self._domains.values() if state.blocked_until > now),
+                'blocked_urls': sum(1 for entry in self._urls.values() if entry[1] > now),
+                'skipped': self.skipped,
+            }
+
+
+# プロセス全体で共有するドメインの状態
+domain_health = DomainHealth()
@@ -0,0 +1,367 @@
+"""
+HTMLの本文抽出を別プロセスで実行するプロセスプール
+trafilatura と BeautifulSoup・lxml によるフォールバック抽出はCPUバウンドでGILを保持するため、
+スレッドで実行しても巨大なページ1つでボット全体が数秒止まることがあります。
+このモジュールはダウンロード済みのHTML（バイト列）を子プロセスに渡し、タイトルと本文だけを受け取ります。
+
+- 同時に実行する抽出はプロセスの数までで、空きを待つ間もイベントループは止まりません
+- 1件ごとの制限時間を超えた子プロセスは強制終了し、次の抽出では新しいプロセスを起動します
+  （子プロセスはライブラリを読み込み終えてから抽出を受け付けるため、起動時間は制限時間に含めません）
+- 呼び出し側がキャンセルした抽出（検索の制限時間など）は最後まで実行し、子プロセスを終了させずに再利用します
+- 子プロセスは一定数の抽出を終えるか、常駐メモリが上限を超えると入れ替えます
+- 子プロセスのアドレス空間には上限を設定し、異常なページで際限なくメモリを使わないようにします
+
+子プロセスは shard_supervisor.py と同じく、このファイルを --worker 付きで実行して起動します。
+"""
+
+import os
+import sys
+import time
+import pickle
+import struct
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# プロセスプールの設定（環境変数で変更可能）
+# 抽出用のプロセスの数（0ならプロセスを使わずスレッドで抽出する）
+EXTRACT_PROCESSES = int(os.getenv('EXTRACT_PROCESSES', str(min(4, os.cpu_count() or 1))))
+# 1件の抽出の制限時間（秒）
+EXTRACT_TIMEOUT = float(os.getenv('EXTRACT_TIMEOUT', '5'))
+# この件数の抽出を終えたプロセスは入れ替える
+EXTRACT_MAX_TASKS_PER_WORKER = int(os.getenv('EXTRACT_MAX_TASKS_PER_WORKER', '200'))
+# 抽出後の常駐メモリがこの値（MB）を超えたプロセスは入れ替える
+EXTRACT_MAX_RSS_MB = int(os.getenv('EXTRACT_MAX_RSS_MB', '512'))
+# 子プロセスのアドレス空間の上限（MB、0で無制限）。超えた抽出は MemoryError で失敗する
+EXTRACT_MEMORY_LIMIT_MB = int(os.getenv('EXTRACT_MEMORY_LIMIT_MB', '2048'))
+
+# 子プロセスがライブラリを読み込み終えるまでの制限時間（秒）
+WORKER_START_TIMEOUT = 60
+
+# メッセージの長さ（4バイト）の形式
+_LENGTH = struct.Struct('!I')
+# 子プロセスが抽出を受け付けられるようになったことを知らせるメッセージ
+_READY = 'ready'
+
+
+class ExtractError(Exception):
+    """子プロセスでの抽出の失敗（制限時間の超過・プロセスの起動の失敗・異常終了を含む）"""
+
+
+class PageExtractError(ExtractError):
+    """子プロセスがページを処理した結果の失敗（プロセスプールの問題ではなく、ページが原因の失敗）"""
+
+
+def _rss_mb():
+    """現在の常駐メモリ量（MB、Linux以外では最大常駐メモリ量）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _write_message(stream, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(_LENGTH.pack(len(data)) + data)
+    stream.flush()
+
+
+def _read_message(stream):
+    header = stream.read(_LENGTH.size)
+    if len(header) < _LENGTH.size:
+        return None
+    (length,) = _LENGTH.unpack(header)
+    return pickle.loads(stream.read(length))
+
+
+class _ExtractWorker:
+    """抽出用の子プロセス1つ"""
+
+    def __init__(self, process):
+        self.process = process
+        self.tasks = 0
+
+    @classmethod
+    async def start(cls, max_rss_mb, memory_limit_mb):
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--worker', str(max_rss_mb), str(memory_limit_mb),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+        )
+        return cls(process)
+
+    async def _read(self):
+        (length,) = _LENGTH.unpack(await self.process.stdout.readexactly(_LENGTH.size))
+        return pickle.loads(await self.process.stdout.readexactly(length))
+
+    async def ready(self):
+        """子プロセスがライブラリを読み込み終えて、抽出を受け付けられるようになるまで待ちます。"""
+        if await self._read() != _READY:
+            raise ConnectionError("本文の抽出プロセスから想定外の応答がありました")
+
+    async def request(self, args):
+        """
+        抽出を依頼し、結果を待ちます。
+
+        Returns:
+            tuple: (状態, 結果またはエラー内容, プロセスを入れ替えるか)
+        """
+        data = pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL)
+        self.process.stdin.write(_LENGTH.pack(len(data)) + data)
+        await self.process.stdin.drain()
+        reply = await self._read()
+        self.tasks += 1
+        return reply
+
+    def close(self):
+        """入力を閉じて終了させます（子プロセスは処理中の抽出を終えてから終了する）。"""
+        if self.process.returncode is None:
+            self.process.stdin.close()
+
+    def kill(self):
+        if self.process.returncode is None:
+            self.process.kill()
+
+
+class ExtractPool:
+    """
+    本文抽出用のプロセスプール
+
+    子プロセスは最初に使うとき（または start）に起動します。
+
+    Args:
+        processes (int): プロセスの数（同時に実行する抽出の数）
+        task_timeout (float): 1件の抽出の制限時間（秒）
+        max_tasks_per_worker (int): この件数の抽出を終えたプロセスは入れ替える
+        max_rss_mb (int): 抽出後の常駐メモリがこの値（MB）を超えたプロセスは入れ替える
+        memory_limit_mb (int): 子プロセスのアドレス空間の上限（MB、0で無制限）
+
+    使用例:
+        pool = ExtractPool(processes=2)
+        result = await pool.extract(html_bytes, 'utf-8', url, max_length=3000)
+    """
+
+    def __init__(self, processes=EXTRACT_PROCESSES, task_timeout=EXTRACT_TIMEOUT,
+                 max_tasks_per_worker=EXTRACT_MAX_TASKS_PER_WORKER, max_rss_mb=EXTRACT_MAX_RSS_MB,
+                 memory_limit_mb=EXTRACT_MEMORY_LIMIT_MB):
+        self.processes = max(1, processes)
+        self.task_timeout = task_timeout
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.memory_limit_mb = memory_limit_mb
+        self._slots = asyncio.Semaphore(self.processes)
+        self._idle = []
+        # 終了を待っている子プロセスの回収タスク（ゾンビプロセスを残さない）
+        self._reaping = set()
+        # 実行中の抽出のタスク
+        self._running = set()
+        self.busy = 0
+        self.tasks = 0
+        self.timeouts = 0
+        self.crashed = 0
+        self.recycled = 0
+
+    async def start(self):
+        """すべての子プロセスを前もって起動します（起動済みのプロセスはそのまま）。"""
+        missing = self.processes - len(self._idle) - self.busy
+        if missing > 0:
+            workers = await asyncio.gather(*[self._spawn() for _ in range(missing)], return_exceptions=True)
+            for worker in workers:
+                if isinstance(worker, BaseException):
+                    logger.warning("本文の抽出プロセスを起動できませんでした: %s", worker)
+                else:
+                    self._idle.append(worker)
+
+    async def _spawn(self):
+        """子プロセスを起動し、抽出を受け付けられるようになるまで待ちます（この時間は抽出の制限時間に含めない）。"""
+        worker = await _ExtractWorker.start(self.max_rss_mb, self.memory_limit_mb)
+        try:
+            await asyncio.wait_for(worker.ready(), WORKER_START_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError) as e:
+            self._retire(worker, kill=True)
+            raise ExtractError("本文の抽出プロセスを起動できませんでした") from e
+        except BaseException:
+            self._retire(worker, kill=True)
+            raise
+        return worker
+
+    def _retire(self, worker, kill=False):
+        """子プロセスを終了させ、終了をバックグラウンドで待って回収します。"""
+        if kill:
+            worker.kill()
+        else:
+            worker.close()
+        task = asyncio.create_task(worker.process.wait())
+        self._reaping.add(task)
+        task.add_done_callback(self._reaping.discard)
+
+    async def extract(self, body, encoding, url, max_length):
+        """
+        ダウンロードしたページからタイトルと本文を抽出します。
+
+        Args:
+            body (bytes): ページの内容
+            encoding (str): Content-Typeで指定された文字コード（なければNone）
+            url (str): ページのURL
+            max_length (int): 本文の最大文字数
+
+        Returns:
+            dict: web_scraper.scrape_url と同じ形式の結果
+
+        Raises:
+            PageExtractError: 子プロセスがページから本文を抽出できなかった場合
+            ExtractError: 制限時間の超過・子プロセスの起動の失敗・異常終了
+        """
+        await self._slots.acquire()
+        try:
+            worker = self._idle.pop() if self._idle else await self._spawn()
+        except BaseException:
+            self._slots.release()
+            raise
+        # 抽出は別のタスクで実行する。呼び出し側がキャンセルしても（検索の制限時間など）子プロセスは終了させず、
+        # 抽出を終えてから待機中に戻す（実行枠はそれまで解放しない）
+        task = asyncio.ensure_future(self._run(worker, (body, encoding, url, max_length), url))
+        self._running.add(task)
+        task.add_done_callback(self._finish_run)
+        status, value = await asyncio.shield(task)
+        if status != 'ok':
+            raise PageExtractError(value)
+        return value
+
+    async def _run(self, worker, args, url):
+        """
+        子プロセスで1件の抽出を実行し、終わったら子プロセスを待機中に戻すか入れ替えて、実行枠を解放します。
+
+        Returns:
+            tuple: (状態, 結果またはエラー内容)
+        """
+        self.busy += 1
+        try:
+            try:
+                status, value, recycle = await asyncio.wait_for(worker.request(args), self.task_timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self._retire(worker, kill=True)
+                logger.warning("本文の抽出が制限時間（%g秒）を超えたため中止しました: %s", self.task_timeout, url)
+                raise ExtractError(f"本文の抽出が制限時間（{self.task_timeout:g}秒）を超えました")
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                self.crashed += 1
+                self._retire(worker, kill=True)
+                logger.warning("本文の抽出プロセスが異常終了しました: %s", url)
+                raise ExtractError("本文の抽出プロセスが異常終了しました") from e
+            except BaseException:
+                # プールを閉じるときにキャンセルした場合は、子プロセスの状態がわからないため終了させる
+                self._retire(worker, kill=True)
+                raise
+            self.tasks += 1
+            if recycle or worker.tasks >= self.max_tasks_per_worker:
+                self.recycled += 1
+                self._retire(worker)
+            else:
+                self._idle.append(worker)
+            return status, value
+        finally:
+            self.busy -= 1
+            self._slots.release()
+
+    def _finish_run(self, task):
+        """抽出のタスクを一覧から外します（呼び出し側がキャンセルしたタスクの例外もここで受け取る）。"""
+        self._running.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    async def close(self):
+        """実行中の抽出を中止し、待機中の子プロセスを終了させて、入れ替えた子プロセスとあわせて終了を待ちます。"""
+        running = list(self._running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        workers, self._idle = self._idle, []
+        for worker in workers:
+            self._retire(worker)
+        await asyncio.gather(*list(self._reaping))
+
+    def stats(self):
+        """プロセスプールの状態を返します。"""
+        return {
+            'workers': len(self._idle) + self.busy,
+            'busy': self.busy,
+            'tasks': self.tasks,
+            'timeouts': self.timeouts,
+            'crashed': self.crashed,
+            'recycled': self.recycled,
+        }
+
+
+_extract_pool = None
+
+
+def get_extract_pool():
+    """共有のプロセスプールを返します。EXTRACT_PROCESSES が0の場合は None（スレッドで抽出する）"""
+    global _extract_pool
+    if EXTRACT_PROCESSES <= 0:
+        return None
+    if _extract_pool is None:
+        _extract_pool = ExtractPool()
+    return _extract_pool
+
+
+def _limit_memory(memory_limit_mb):
+    """子プロセスのアドレス空間の上限を設定します（resource がないWindowsでは何もしない）。"""
+    if memory_limit_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def run_worker(max_rss_mb, memory_limit_mb):
+    """
+    子プロセスの処理（--worker）
+    標準入力から抽出の依頼を読み、結果を標準出力に書き込みます。入力が閉じられたら終了します。
+    """
+    # 結果の受け渡しに使う標準出力を複製し、ライブラリの print などは標準エラー出力に回す
+    output = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    stdin = sys.stdin.buffer
+
+    from web_scraper import _Download, _extract_from_document
+    _limit_memory(memory_limit_mb)
+    # ライブラリを読み込み終えたことを知らせる（ここからの処理時間が抽出の制限時間の対象になる）
+    _write_message(output, _READY)
+
+    while True:
+        request = _read_message(stdin)
+        if request is None:
+            return
+        body, encoding, url, max_length = request
+        started = time.perf_counter()
+        recycle = False
+        try:
+            reply = ('ok', _extract_from_document(_Download(body, encoding, {}, False), url, max_length))
+        except MemoryError:
+            # MemoryError の後はメモリの状態が不確かなので入れ替える
+            reply = ('error', 'ページが大きすぎるため本文を抽出できませんでした')
+            recycle = True
+        except Exception as e:
+            reply = ('error', str(e))
+        del body, request
+        rss = _rss_mb()
+        recycle = recycle or rss > max_rss_mb
+        logger.debug("抽出 %.0f ms、常駐メモリ %.0f MB: %s", (time.perf_counter() - started) * 1000, rss, url)
+        _write_message(output, reply + (recycle,))
+        if recycle:
+            return
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == '--worker':
+        run_worker(int(sys.argv[2]), int(sys.argv[3]))
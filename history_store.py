@@ -0,0 +1,294 @@
+"""
+チャンネルごとの会話履歴を永続化するモジュール
+会話はSQLite（WALモード）の追記専用ログに保存し、
+チャンネルの履歴は最初のメッセージで遅延読み込みして、一定時間使われなければメモリから解放します。
+メモリ使用量はアクティブなチャンネル数に比例し、再起動後も会話の文脈が引き継がれます。
+"""
+
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 履歴ファイルのパス（環境変数で変更可能）
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', 'channel_history.sqlite3')
+# 遅延読み込み時に読み込む直近のメッセージ数
+HISTORY_LOAD_LIMIT = 200
+# 圧縮時にチャンネルごとに残すメッセージ数
+HISTORY_KEEP_MESSAGES = 500
+
+
+class HistoryStore:
+    """SQLiteに会話ログと要約を保存するストア"""
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self._lock = threading.Lock()
+        # チャンネルごとの削除回数（削除前に始めた要約の保存を取り消すために使う）
+        self._generations = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, channel_id INTEGER NOT NULL, '
+            'role TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_channel ON messages (channel_id, id)')
+        # turn_key: やり直す可能性のある処理（ワーカーのジョブ）が付ける会話のキー。同じキーの会話は1件だけ保存する
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(messages)')}
+        if 'turn_key' not in columns:
+            self._conn.execute('ALTER TABLE messages ADD COLUMN turn_key TEXT')
+        self._conn.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_turn_key ON messages (channel_id, turn_key) '
+            'WHERE turn_key IS NOT NULL'
+        )
+        # summarized_until: 要約に含めた最後のメッセージのID（NULLは記録していない古い形式のデータ）
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS summaries ('
+            'channel_id INTEGER PRIMARY KEY, summary TEXT NOT NULL, updated_at REAL NOT NULL, summarized_until INTEGER)'
+        )
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(summaries)')}
+        if 'summarized_until' not in columns:
+            self._conn.execute('ALTER TABLE summaries ADD COLUMN summarized_until INTEGER')
+        self._conn.commit()
+
+    def append(self, channel_id, role, content, turn_key=None):
+        """
+        会話を1件追記します。
+
+        Args:
+            turn_key (str): 会話のキー。同じチャンネルに同じキーの会話がすでにあれば追記せず、内容を置き換える
+                （ジョブをやり直したときに同じ会話が重複しないようにする）
+
+        Returns:
+            int: 追記した（キーが同じ会話があればその）メッセージのID
+        """
+        with self._lock:
+            if turn_key is None:
+                cursor = self._conn.execute(
+                    'INSERT INTO messages (channel_id, role, content, created_at) VALUES (?, ?, ?, ?)',
+                    (channel_id, role, content, time.time())
+                )
+                self._conn.commit()
+                return cursor.lastrowid
+            self._conn.execute(
+                'INSERT INTO messages (channel_id, role, content, created_at, turn_key) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (channel_id, turn_key) WHERE turn_key IS NOT NULL DO UPDATE SET content = excluded.content',
+                (channel_id, role, content, time.time(), turn_key)
+            )
+            row = self._conn.execute(
+                'SELECT id FROM messages WHERE channel_id = ? AND turn_key = ?', (channel_id, turn_key)
+            ).fetchone()
+            self._conn.commit()
+            return row[0]
+
+    def generation(self, channel_id):
+        """チャンネルの履歴を削除した回数を返します（save_summary の generation に渡す）。"""
+        with self._lock:
+            return self._generations.get(channel_id, 0)
+
+    def save_summary(self, channel_id, summary, summarized_until=None, generation=None):
+        """
+        チャンネルの要約を保存します。
+
+        Args:
+            summarized_until (int): 要約に含めた最後のメッセージのID
+            generation (int): 要約を始めた時点の generation(channel_id)。その後に履歴を削除していれば保存しない
+                （別スレッドで保存を待つ間に !clear した要約を復活させない）
+        """
+        with self._lock:
+            if generation is not None and generation != self._generations.get(channel_id, 0):
+                return
+            self._conn.execute(
+                'INSERT OR REPLACE INTO summaries (channel_id, summary, updated_at, summarized_until) VALUES (?, ?, ?, ?)',
+                (channel_id, summary, time.time(), summarized_until)
+            )
+            self._conn.commit()
+
+    def load(self, channel_id, limit=HISTORY_LOAD_LIMIT):
+        """
+        チャンネルの要約と直近の会話を読み込みます。
+
+        Returns:
+            tuple: (要約, 要約に含めた最後のメッセージのID（記録がなければNone）, [(id, role, content), ...] 古い順)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT summary, summarized_until FROM summaries WHERE channel_id = ?', (channel_id,)
+            ).fetchone()
+            rows = self._conn.execute(
+                'SELECT id, role, content FROM messages WHERE channel_id = ? ORDER BY id DESC LIMIT ?',
+                (channel_id, limit)
+            ).fetchall()
+        rows.reverse()
+        if row is None:
+            # まだ要約を保存していない（要約に含めた会話はない）
+            return '', 0, rows
+        return row[0], row[1], rows
+
+    def has_history(self, channel_id):
+        """チャンネルに保存された履歴があるかどうかを返します。"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT 1 FROM messages WHERE channel_id = ? '
+                'UNION ALL SELECT 1 FROM summaries WHERE channel_id = ? LIMIT 1',
+                (channel_id, channel_id)
+            ).fetchone()
+        return row is not None
+
+    def compact(self, channel_id, keep=HISTORY_KEEP_MESSAGES):
+        """チャンネルの古いメッセージを削除し、直近keep件だけを残します。"""
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM messages WHERE channel_id = ? AND id NOT IN ('
+                'SELECT id FROM messages WHERE channel_id = ? ORDER BY id DESC LIMIT ?)',
+                (channel_id, channel_id, keep)
+            )
+            self._conn.commit()
+
+    def clear(self, channel_id):
+        """チャンネルの履歴と要約を削除します。"""
+        with self._lock:
+            self._generations[channel_id] = self._generations.get(channel_id, 0) + 1
+            self._conn.execute('DELETE FROM messages WHERE channel_id = ?', (channel_id,))
+            self._conn.execute('DELETE FROM summaries WHERE channel_id = ?', (channel_id,))
+            self._conn.commit()
+
+
+class ChannelMemoryRegistry:
+    """
+    チャンネルIDごとの会話メモリを管理するレジストリ
+
+    メモリはget_or_createで初めて必要になったときにストアから読み込み、
+    evict_idleで一定時間使われていないものをメモリから解放します。
+    イベントループ上では、ストアへの読み書きを別スレッドで行う aget_or_create / acontains / aclear / aevict_idle を使います
+    （他のプロセスがファイルをロックしている間もイベントループを止めない）。
+
+    Args:
+        store (HistoryStore): 会話ログのストア
+        memory_factory: memory_factory(channel_id) -> 空の会話メモリ
+            作成されたメモリは restore(summary, turns, summarized_until) を持つこと
+    """
+
+    def __init__(self, store, memory_factory):
+        self.store = store
+        self.memory_factory = memory_factory
+        self._memories = {}
+        self._last_used = {}
+
+    def __contains__(self, channel_id):
+        return channel_id in self._memories or self.store.has_history(channel_id)
+
+    async def acontains(self, channel_id):
+        """__contains__ の非同期版です。"""
+        return channel_id in self._memories or await asyncio.to_thread(self.store.has_history, channel_id)
+
+    def __len__(self):
+        return len(self._memories)
+
+    def get(self, channel_id, default=None):
+        """チャンネルのメモリを返します。保存された履歴もなければdefaultを返します。"""
+        if channel_id in self:
+            return self.get_or_create(channel_id)
+        return default
+
+    def get_or_create(self, channel_id):
+        """チャンネルのメモリを返します。メモリ上になければストアから読み込みます。"""
+        memory = self._memories.get(channel_id)
+        if memory is None:
+            memory = self._restore(channel_id, self.store.load(channel_id))
+        self._last_used[channel_id] = time.monotonic()
+        return memory
+
+    async def aget_or_create(self, channel_id):
+        """get_or_create の非同期版です（ストアからの読み込みを別スレッドで行う）。"""
+        memory = self._memories.get(channel_id)
+        if memory is None:
+            loaded = await asyncio.to_thread(self.store.load, channel_id)
+            # 読み込みを待つ間に同じチャンネルのメモリが作られていれば、そちらを使う
+            memory = self._memories.get(channel_id) or self._restore(channel_id, loaded)
+        self._last_used[channel_id] = time.monotonic()
+        return memory
+
+    def _restore(self, channel_id, loaded):
+        """ストアから読み込んだ (要約, 要約に含めた最後のID, 会話) でメモリを作成して登録します。"""
+        memory = self.memory_factory(channel_id)
+        summary, summarized_until, turns = loaded
+        if summary or turns:
+            memory.restore(summary, turns, summarized_until)
+            logger.info("チャンネル%sの会話履歴を読み込みました（%d件）", channel_id, len(turns))
+        self._memories[channel_id] = memory
+        return memory
+
+    def clear(self, channel_id):
+        """チャンネルの会話履歴をメモリとストアの両方から削除します。"""
+        self._drop(channel_id)
+        self.store.clear(channel_id)
+
+    async def aclear(self, channel_id):
+        """clear の非同期版です（ストアの削除を別スレッドで行う）。"""
+        self._drop(channel_id)
+        await asyncio.to_thread(self.store.clear, channel_id)
+
+    def _drop(self, channel_id):
+        memory = self._memories.pop(channel_id, None)
+        self._last_used.pop(channel_id, None)
+        if memory is not None:
+            memory.clear()
+        return memory
+
+    def forget(self, channel_id):
+        """
+        チャンネルのメモリを解放します（ストアの履歴は残すので、次の get_or_create で読み込み直す）。
+        他のプロセスが同じチャンネルの履歴を更新した場合に使います。要約の作成中のメモリは解放しません。
+
+        Returns:
+            bool: 解放した場合はTrue
+        """
+        memory = self._memories.get(channel_id)
+        if memory is not None and getattr(memory, 'busy', False):
+            return False
+        self._memories.pop(channel_id, None)
+        self._last_used.pop(channel_id, None)
+        return True
+
+    def evict_idle(self, idle_seconds):
+        """
+        idle_seconds以上使われていないチャンネルのメモリを解放します。
+        要約の作成中のメモリは次回に回します。
+
+        Returns:
+            int: 解放したチャンネル数
+        """
+        evicted = self._take_idle(idle_seconds)
+        for channel_id in evicted:
+            self.store.compact(channel_id)
+        return len(evicted)
+
+    async def aevict_idle(self, idle_seconds):
+        """evict_idle の非同期版です（ストアの圧縮を別スレッドで行う）。"""
+        evicted = self._take_idle(idle_seconds)
+        for channel_id in evicted:
+            await asyncio.to_thread(self.store.compact, channel_id)
+        return len(evicted)
+
+    def _take_idle(self, idle_seconds):
+        """使われていないチャンネルのメモリを解放し、そのチャンネルIDのリストを返します。"""
+        now = time.monotonic()
+        evicted = []
+        for channel_id, last_used in list(self._last_used.items()):
+            if now - last_used < idle_seconds:
+                continue
+            memory = self._memories.get(channel_id)
+            if memory is not None and getattr(memory, 'busy', False):
+                continue
+            self._memories.pop(channel_id, None)
+            self._last_used.pop(channel_id, None)
+            evicted.append(channel_id)
+        if evicted:
+            logger.info("使われていない%dチャンネルの会話履歴をメモリから解放しました", len(evicted))
+        return evicted
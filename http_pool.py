@@ -0,0 +1,440 @@
+"""
+プロセス全体で共有するHTTP接続プールモジュール
+DuckDuckGo検索・スクレイピング・LLMのAPI呼び出しで同じクライアントを使い、
+keep-aliveの接続を再利用してTCP/TLSのハンドシェイクを減らします。
+ホストごとの同時接続数の上限、HTTP/2（h2 がインストールされている場合）、DNSの結果のキャッシュに対応し、
+接続プールの統計を stats() で取得できます。
+"""
+
+import os
+import re
+import time
+import socket
+import asyncio
+import logging
+import threading
+import importlib.util
+import ipaddress
+import weakref
+from collections import OrderedDict
+
+import httpx
+import httpcore
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# 接続プールの設定（環境変数で変更可能）
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))  # 全体の同時接続数の上限
+HTTP_MAX_PER_HOST = int(os.getenv('HTTP_MAX_PER_HOST', '6'))  # ホストごとの同時接続数の上限
+HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_KEEPALIVE_CONNECTIONS', '20'))  # 待機させておく接続数
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30'))  # 待機中の接続を閉じるまでの秒数
+DNS_CACHE_TTL = float(os.getenv('DNS_CACHE_TTL', '300'))  # DNSの結果をキャッシュする秒数（0で無効）
+DNS_CACHE_SIZE = int(os.getenv('DNS_CACHE_SIZE', '1024'))  # DNSの結果をキャッシュするホストの数の上限
+
+# h2 がインストールされていればHTTP/2を使う
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+def _version(module):
+    """モジュールのバージョンの (メジャー, マイナー) を返します。"""
+    return tuple(int(part) for part in re.findall(r'\d+', module.__version__)[:2])
+
+
+# DNSの結果のキャッシュは httpcore の接続プールのネットワークバックエンド（_network_backend）と
+# urllib3 の接続の名前解決に使うホスト名（_dns_host）を差し替えて使う。どちらも公開されていない属性のため、
+# 動作を確認したバージョン（requirements.txt で固定）の範囲でだけ有効にする
+DNS_CACHE_HTTPCORE = (0, 17) <= _version(httpcore) < (1, 1)
+DNS_CACHE_URLLIB3 = (1, 26) <= _version(urllib3) < (3, 0)
+if DNS_CACHE_TTL > 0 and not (DNS_CACHE_HTTPCORE and DNS_CACHE_URLLIB3):
+    logger.warning(
+        "DNSの結果のキャッシュに対応していないバージョンのため、一部の接続でキャッシュを使いません（httpcore %s, urllib3 %s）",
+        httpcore.__version__, urllib3.__version__
+    )
+
+_lock = threading.Lock()
+_stats = {'requests': 0, 'dns_hits': 0, 'dns_misses': 0}  # requests は httpx の非同期クライアントの件数
+_host_stats = {}  # host -> {'requests': 件数, 'active': 接続中, 'peak': 最大同時接続}
+
+
+# --- DNSのキャッシュ ---
+
+class _DNSCache:
+    """
+    ホスト名を解決したIPアドレスをTTLの間キャッシュします（失敗はキャッシュしない）。
+    保持する件数には上限があり、古いものから削除します。
+    socket.getaddrinfo は置き換えず、共有クライアントの接続を開くときだけ使います
+    （discord.py など他のライブラリの名前解決には影響しません）。
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries = OrderedDict()  # (host, port) -> (期限, IPアドレスのリスト)
+        self._lock = threading.Lock()
+
+    def get(self, host, port):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end((host, port))
+                _stats['dns_hits'] += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[(host, port)]
+            _stats['dns_misses'] += 1
+        return None
+
+    def put(self, host, port, addresses):
+        with self._lock:
+            self._entries[(host, port)] = (time.monotonic() + self.ttl, addresses)
+            self._entries.move_to_end((host, port))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+_dns_cache = _DNSCache(DNS_CACHE_TTL, DNS_CACHE_SIZE)
+
+
+def _addresses(infos):
+    """getaddrinfo の結果から重複を除いたIPアドレスを順に返します。"""
+    return list(dict.fromkeys(info[4][0] for info in infos))
+
+
+def _is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def _resolve(host, port):
+    """ホスト名を解決したIPアドレスのリストを返します（キャッシュが無効・IPアドレスの場合はそのまま）。"""
+    if DNS_CACHE_TTL <= 0 or _is_ip_address(host):
+        return [host]
+    addresses = _dns_cache.get(host, port)
+    if addresses is None:
+        addresses = _addresses(socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+        _dns_cache.put(host, port, addresses)
+    return addresses
+
+
+async def _aresolve(host, port):
+    """_resolve の非同期版（名前解決中もイベントループを止めない）"""
+    if DNS_CACHE_TTL <= 0 or _is_ip_address(host):
+        return [host]
+    addresses = _dns_cache.get(host, port)
+    if addresses is None:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = _addresses(infos)
+        _dns_cache.put(host, port, addresses)
+    return addresses
+
+
+class _ResolvingAsyncBackend(httpcore.AsyncNetworkBackend):
+    """httpx の非同期クライアントの接続を、キャッシュしたIPアドレスに対して開くネットワークバックエンド"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = await _aresolve(host, port)
+        except OSError as e:
+            # httpx の接続エラー（httpx.ConnectError）として扱われるようにする
+            raise httpcore.ConnectError(str(e)) from e
+        for i, address in enumerate(addresses):
+            try:
+                return await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, OSError):
+                # すべてのアドレスに接続できない場合は、キャッシュした結果が古い可能性があるため破棄する
+                if i == len(addresses) - 1:
+                    _dns_cache.discard(host, port)
+                    raise
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds):
+        await self._backend.sleep(seconds)
+
+
+class _ResolvingSyncBackend(httpcore.NetworkBackend):
+    """_ResolvingAsyncBackend の同期版（httpx の同期クライアント用）"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = _resolve(host, port)
+        except OSError as e:
+            raise httpcore.ConnectError(str(e)) from e
+        for i, address in enumerate(addresses):
+            try:
+                return self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, OSError):
+                if i == len(addresses) - 1:
+                    _dns_cache.discard(host, port)
+                    raise
+
+    def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    def sleep(self, seconds):
+        self._backend.sleep(seconds)
+
+
+def _use_dns_cache(transport, backend_class):
+    """httpx のトランスポートの接続プールで、名前解決にキャッシュを使うようにします。"""
+    if DNS_CACHE_TTL <= 0 or not DNS_CACHE_HTTPCORE:
+        return transport
+    pool = getattr(transport, '_pool', None)
+    if pool is None or not hasattr(pool, '_network_backend'):
+        logger.warning("httpx の接続プールの構成が想定と異なるため、DNSの結果のキャッシュを使いません")
+        return transport
+    pool._network_backend = backend_class(pool._network_backend)
+    return transport
+
+
+class _ResolvingConnectionMixin:
+    """requests（urllib3）の接続を、キャッシュしたIPアドレスに対して開く（TLSのSNIと Host ヘッダーは元のホスト名のまま）"""
+
+    def _new_conn(self):
+        dns_host = self._dns_host
+        addresses = _resolve(dns_host, self.port)
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError):
+                    if i == len(addresses) - 1:
+                        _dns_cache.discard(dns_host, self.port)
+                        raise
+        finally:
+            self._dns_host = dns_host
+
+
+class _ResolvingHTTPConnection(_ResolvingConnectionMixin, urllib3.connection.HTTPConnection):
+    pass
+
+
+class _ResolvingHTTPSConnection(_ResolvingConnectionMixin, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _ResolvingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _ResolvingHTTPConnection
+
+
+class _ResolvingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _ResolvingHTTPSConnection
+
+
+class _ResolvingHTTPAdapter(HTTPAdapter):
+    """名前解決にキャッシュを使う requests のアダプター"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        if DNS_CACHE_TTL > 0 and DNS_CACHE_URLLIB3:
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': _ResolvingHTTPConnectionPool,
+                'https': _ResolvingHTTPSConnectionPool,
+            }
+
+
+# --- ホストごとの統計と同時接続数の制限 ---
+
+# ホストごとの同時接続数の上限の対象外にするホスト
+_unlimited_hosts = set()
+
+
+def exempt_from_host_limit(host):
+    """
+    ホストをホストごとの同時接続数の上限（HTTP_MAX_PER_HOST）の対象外にします。
+    LLMのAPIのように、同時に実行する数を呼び出し側（llm_runner の上限）で制御するホストに使います。
+    """
+    if host:
+        _unlimited_hosts.add(host)
+
+def _record_start(host):
+    with _lock:
+        _stats['requests'] += 1
+        stats = _host_stats.setdefault(host, {'requests': 0, 'active': 0, 'peak': 0})
+        stats['requests'] += 1
+        stats['active'] += 1
+        stats['peak'] = max(stats['peak'], stats['active'])
+
+
+def _record_end(host):
+    with _lock:
+        _host_stats[host]['active'] -= 1
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """レスポンスの本文を読み終えた（閉じた）ときにホストの接続枠を返すストリーム"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class _HostLimitedTransport(httpx.AsyncBaseTransport):
+    """ホストごとの同時接続数を制限し、統計を記録するトランスポート"""
+
+    def __init__(self, transport, max_per_host):
+        self._transport = transport
+        self._max_per_host = max_per_host
+        # イベントループごとのホスト別セマフォ
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self, host):
+        semaphores = self._semaphores.setdefault(asyncio.get_running_loop(), {})
+        semaphore = semaphores.get(host)
+        if semaphore is None:
+            semaphore = semaphores[host] = asyncio.Semaphore(self._max_per_host)
+        return semaphore
+
+    async def handle_async_request(self, request):
+        host = request.url.host
+        # 上限の対象外のホスト（LLMのAPIなど）は統計だけを記録する
+        semaphore = None if host in _unlimited_hosts else self._semaphore(host)
+        if semaphore is not None:
+            await semaphore.acquire()
+        _record_start(host)
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                _record_end(host)
+                if semaphore is not None:
+                    semaphore.release()
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+    def pool_size(self):
+        """接続プールに保持している接続数（取得できない場合はNone）"""
+        pool = getattr(self._transport, '_pool', None)
+        connections = getattr(pool, 'connections', None)
+        return len(connections) if connections is not None else None
+
+
+# --- 共有クライアント ---
+
+_async_client = None
+_async_transport = None
+_sync_client = None
+_session = None
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_async_client():
+    """
+    共有の httpx.AsyncClient を返します。
+    ヘッダーとタイムアウトはリクエストごとに指定してください。
+    """
+    global _async_client, _async_transport
+    with _lock:
+        if _async_client is None or _async_client.is_closed:
+            _async_transport = _HostLimitedTransport(
+                _use_dns_cache(httpx.AsyncHTTPTransport(limits=_limits(), http2=HTTP2_AVAILABLE), _ResolvingAsyncBackend),
+                HTTP_MAX_PER_HOST,
+            )
+            _async_client = httpx.AsyncClient(transport=_async_transport, follow_redirects=True)
+        return _async_client
+
+
+def get_sync_client():
+    """共有の httpx.Client を返します（OpenAIクライアントの同期呼び出し用）。"""
+    global _sync_client
+    with _lock:
+        if _sync_client is None or _sync_client.is_closed:
+            transport = _use_dns_cache(httpx.HTTPTransport(limits=_limits(), http2=HTTP2_AVAILABLE), _ResolvingSyncBackend)
+            _sync_client = httpx.Client(transport=transport, follow_redirects=True)
+        return _sync_client
+
+
+def get_session():
+    """
+    共有の requests.Session を返します。
+    ホストごとの接続プールの大きさを HTTP_MAX_PER_HOST に制限します。
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = _ResolvingHTTPAdapter(pool_connections=HTTP_KEEPALIVE_CONNECTIONS, pool_maxsize=HTTP_MAX_PER_HOST, pool_block=True)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+async def aclose():
+    """共有クライアントを閉じます（終了時やテスト用）。"""
+    global _async_client, _sync_client, _session
+    with _lock:
+        async_client, sync_client, session = _async_client, _sync_client, _session
+        _async_client = _sync_client = _session = None
+    if async_client is not None:
+        await async_client.aclose()
+    if sync_client is not None:
+        sync_client.close()
+    if session is not None:
+        session.close()
+
+
+def stats():
+    """接続プールとDNSキャッシュの統計を返します。"""
+    with _lock:
+        result = dict(_stats)
+        result['http2'] = HTTP2_AVAILABLE
+        result['dns_cached'] = len(_dns_cache)
+        result['hosts'] = {host: dict(values) for host, values in _host_stats.items()}
+        result['pooled_connections'] = _async_transport.pool_size() if _async_transport is not None else None
+    return result
@@ -0,0 +1,230 @@
+"""
+ゲートウェイとワーカーの間のジョブキューモジュール
+ゲートウェイ（Discordに接続するプロセス）が検索・応答のジョブをSQLiteに追加し、
+ワーカーのプロセスが取り出して実行します。ワーカーがDiscordに送る操作（送信・編集・削除など）は
+イベントとしてSQLiteに書き込まれ、ゲートウェイが順に実行します。
+
+ジョブとイベントには追加したゲートウェイのIDを記録し、ゲートウェイは自分のジョブのイベントだけを読み込みます
+（シャードごとのゲートウェイが同じキューを共有するため）。
+
+ジョブはリース（一定時間の実行権）付きで取り出し、ワーカーが停止してリースが切れたジョブは
+他のワーカーが最初からやり直します。同じチャンネルのジョブは同時に1つだけ実行します。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import namedtuple
+
+# キューの設定（環境変数で変更可能）
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', 'job_queue.sqlite3')
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '30'))  # ワーカーが更新しなければ他のワーカーに渡す秒数
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))  # リースが切れて再実行する回数の上限
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.1'))  # ジョブ・イベントがないときに確認する間隔（秒）
+DEFAULT_GATEWAY = 'gateway'  # ゲートウェイのIDを指定しない場合のID
+
+# ジョブの種類
+JOB_SEARCH = 'search'  # 検索トリガーへの応答
+JOB_RESPOND = 'respond'  # メンション・名前の呼びかけ・ランダム応答（まとめたメッセージ）
+JOB_ASK = 'ask'  # !ask の質問
+
+# ワーカーからゲートウェイへのイベント
+EVENT_SEND = 'send'  # メッセージを送信（ref で後から参照する）
+EVENT_EDIT = 'edit'  # ref のメッセージを編集
+EVENT_DELETE = 'delete'  # ref のメッセージを削除
+EVENT_TYPING = 'typing'  # 入力中の表示
+EVENT_RESET = 'reset'  # 再実行の前に、前回の実行で送信したメッセージを削除
+EVENT_DONE = 'done'  # ジョブの完了
+EVENT_FAILED = 'failed'  # 再実行の上限を超えたジョブ（content にエラー内容）
+
+Job = namedtuple('Job', ['id', 'kind', 'channel_id', 'payload', 'attempts'])
+JobEvent = namedtuple('JobEvent', ['id', 'job_id', 'channel_id', 'op', 'ref', 'content'])
+
+
+class JobQueue:
+    """
+    SQLite（WALモード）のジョブキュー
+
+    複数のプロセスから同じファイルを開いて使います。
+
+    Args:
+        path (str): キューのファイルのパス
+        lease_seconds (float): 取り出したジョブのリースの秒数
+        max_attempts (int): 1つのジョブを実行する回数の上限
+        gateway (str): このキューを使うゲートウェイのID（追加したジョブと読み込むイベントをこのIDで区別する）
+    """
+
+    def __init__(self, path=JOB_QUEUE_PATH, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS,
+                 gateway=DEFAULT_GATEWAY):
+        self.gateway = gateway
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # トランザクションは自分で開始する（取り出しは BEGIN IMMEDIATE で他のプロセスと排他にする）
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, channel_id INTEGER NOT NULL, '
+            'priority INTEGER NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, lease_until REAL, created_at REAL NOT NULL, '
+            f"gateway TEXT NOT NULL DEFAULT '{DEFAULT_GATEWAY}')"
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority, id)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS events ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, job_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, '
+            f"op TEXT NOT NULL, ref TEXT, content TEXT, gateway TEXT NOT NULL DEFAULT '{DEFAULT_GATEWAY}')"
+        )
+        # ゲートウェイのIDを記録していない古い形式のファイルには列を追加する
+        for table in ('jobs', 'events'):
+            columns = {row[1] for row in self._conn.execute(f'PRAGMA table_info({table})')}
+            if 'gateway' not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN gateway TEXT NOT NULL DEFAULT '{DEFAULT_GATEWAY}'")
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_events_gateway ON events (gateway, id)')
+
+    def enqueue(self, kind, channel_id, payload, priority=0):
+        """
+        ジョブを追加します。
+
+        Args:
+            kind (str): ジョブの種類（JOB_*）
+            channel_id (int): 応答するチャンネルのID
+            payload (dict): ジョブの入力（JSONにできる値）
+            priority (int): 優先度（小さいほど先に実行する。priority_scheduler の PRIORITY_*）
+
+        Returns:
+            int: ジョブのID
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO jobs (kind, channel_id, priority, payload, status, created_at, gateway) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (kind, channel_id, priority, json.dumps(payload, ensure_ascii=False), 'queued', time.time(), self.gateway)
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker):
+        """
+        実行するジョブを1つ取り出します。
+        リースが切れたジョブも対象にし、実行中のジョブがあるチャンネルのジョブは取り出しません。
+        再実行の上限を超えたジョブは失敗として EVENT_FAILED を書き込みます。
+
+        Args:
+            worker (str): ワーカーの名前
+
+        Returns:
+            Job: 取り出したジョブ（attempts は今回を含む実行回数）。なければ None
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                expired = self._conn.execute(
+                    "SELECT id, channel_id, gateway FROM jobs WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, self.max_attempts)
+                ).fetchall()
+                for job_id, channel_id, gateway in expired:
+                    self._conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+                    self._conn.execute(
+                        'INSERT INTO events (job_id, channel_id, op, content, gateway) VALUES (?, ?, ?, ?, ?)',
+                        (job_id, channel_id, EVENT_FAILED, f'ワーカーが{self.max_attempts}回停止したため処理を中止しました', gateway)
+                    )
+                row = self._conn.execute(
+                    "SELECT id, kind, channel_id, payload, attempts FROM jobs "
+                    "WHERE (status = 'queued' OR (status = 'running' AND lease_until < ?)) "
+                    "AND channel_id NOT IN (SELECT channel_id FROM jobs WHERE status = 'running' AND lease_until >= ?) "
+                    "ORDER BY priority, id LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, lease_until = ? WHERE id = ?",
+                        (worker, now + self.lease_seconds, row[0])
+                    )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return Job(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1)
+
+    def renew(self, job_id, worker):
+        """
+        ジョブのリースを延長します。
+
+        Returns:
+            bool: まだこのワーカーがジョブを実行している場合はTrue
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id, worker)
+            )
+            return cursor.rowcount > 0
+
+    def emit(self, job, worker, op, ref=None, content=None):
+        """
+        ゲートウェイへのイベントを書き込みます。
+        リースが切れて他のワーカーに渡ったジョブのイベントは書き込みません。
+
+        Returns:
+            bool: 書き込んだ場合はTrue
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO events (job_id, channel_id, op, ref, content, gateway) '
+                "SELECT ?, ?, ?, ?, ?, gateway FROM jobs WHERE id = ? AND worker = ? AND status = 'running'",
+                (job.id, job.channel_id, op, ref, content, job.id, worker)
+            )
+            return cursor.rowcount > 0
+
+    def complete(self, job, worker):
+        """ジョブを完了し、EVENT_DONE を書き込みます。"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    "SELECT gateway FROM jobs WHERE id = ? AND worker = ? AND status = 'running'", (job.id, worker)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute('DELETE FROM jobs WHERE id = ?', (job.id,))
+                    self._conn.execute(
+                        'INSERT INTO events (job_id, channel_id, op, gateway) VALUES (?, ?, ?, ?)',
+                        (job.id, job.channel_id, EVENT_DONE, row[0])
+                    )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def events(self, limit=100):
+        """
+        このゲートウェイが追加したジョブの、まだ処理していないイベントを古い順に返します。
+        処理したイベントは ack で削除してください。
+
+        Returns:
+            list: JobEvent のリスト
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, job_id, channel_id, op, ref, content FROM events WHERE gateway = ? ORDER BY id LIMIT ?',
+                (self.gateway, limit)
+            ).fetchall()
+        return [JobEvent(*row) for row in rows]
+
+    def ack(self, event_id):
+        """このゲートウェイの event_id までのイベントを処理済みとして削除します。"""
+        with self._lock:
+            self._conn.execute('DELETE FROM events WHERE gateway = ? AND id <= ?', (self.gateway, event_id))
+
+    def stats(self):
+        """待機中・実行中のジョブと、このゲートウェイの未処理のイベントの数を返します。"""
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            events = self._conn.execute('SELECT COUNT(*) FROM events WHERE gateway = ?', (self.gateway,)).fetchone()[0]
+        return {'queued': counts.get('queued', 0), 'running': counts.get('running', 0), 'events': events}
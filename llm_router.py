@@ -0,0 +1,304 @@
+"""
+複数のLLMバックエンドを切り替えるルーターモジュール
+OpenAI互換のバックエンド（openai、openrouter、ローカルのサーバーなど）ごとに
+応答時間とエラーを記録し、正常なバックエンドの中で最も速いものを選びます。
+応答が遅い場合は p95 の応答時間を過ぎた時点で次のバックエンドにも同じリクエストを送り（ヘッジ）、
+連続して失敗したバックエンドはサーキットブレーカーで一定時間使わないようにします。
+LangChainのチャットモデルとして動作するため、LLMChainなどからそのまま使用できます。
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from pydantic import ConfigDict, Field
+
+logger = logging.getLogger(__name__)
+
+# 応答時間の指数移動平均の重み
+LATENCY_EWMA_ALPHA = 0.3
+# p95 の計算に使う直近の応答時間の件数
+LATENCY_WINDOW = 50
+# p95 を使い始めるのに必要な件数（それまでは hedge_min_delay の数倍待つ）
+LATENCY_MIN_SAMPLES = 5
+# エラー率の計算に使う直近の結果の件数
+ERROR_WINDOW = 20
+
+
+class Backend:
+    """
+    1つのLLMバックエンドと、その応答時間・エラーの記録
+
+    Args:
+        name (str): バックエンドの名前（ログ表示用）
+        llm: LangChainのチャットモデル
+    """
+
+    def __init__(self, name, llm):
+        self.name = name
+        self.llm = llm
+        self.latency = None  # 応答時間の指数移動平均（秒）
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._results = deque(maxlen=ERROR_WINDOW)  # True: 成功, False: 失敗
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # サーキットが開いている（使わない）期限
+        self.half_open = False  # 期限切れ後の試行中
+
+    @property
+    def error_rate(self):
+        if not self._results:
+            return 0.0
+        return self._results.count(False) / len(self._results)
+
+    def p95(self):
+        """直近の応答時間の95パーセンタイル（件数が足りなければNone）"""
+        if len(self._latencies) < LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def record_success(self, latency):
+        self._latencies.append(latency)
+        self._results.append(True)
+        self.latency = latency if self.latency is None else (
+            LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * self.latency
+        )
+        if self.consecutive_failures or self.half_open:
+            logger.info("LLMバックエンド %s が復旧しました", self.name)
+        self.consecutive_failures = 0
+        self.half_open = False
+        self.open_until = 0.0
+
+    def record_failure(self, failure_threshold, open_seconds):
+        self._results.append(False)
+        self.consecutive_failures += 1
+        if self.half_open or self.consecutive_failures >= failure_threshold:
+            self.open_until = time.monotonic() + open_seconds
+            self.half_open = False
+            logger.warning("LLMバックエンド %s で失敗が続いたため %s 秒間使用を停止します", self.name, open_seconds)
+
+    def is_available(self, now):
+        """サーキットが閉じているか、期限が切れて試行できる状態かを返します。"""
+        return now >= self.open_until
+
+    def stats(self):
+        return {
+            'latency': self.latency,
+            'p95': self.p95(),
+            'error_rate': self.error_rate,
+            'open': time.monotonic() < self.open_until,
+        }
+
+
+class RoutedChatModel(BaseChatModel):
+    """
+    複数のバックエンドに振り分けるチャットモデル
+
+    Args:
+        backends (list): Backend のリスト（先頭ほど優先。応答時間の記録がないときの順序）
+        hedge (bool): 応答が遅いときに次のバックエンドにも同じリクエストを送るか
+        hedge_min_delay (float): ヘッジを送るまでの最小の待ち時間（秒）
+        failure_threshold (int): サーキットを開く連続失敗回数
+        open_seconds (float): サーキットを開いておく秒数
+    """
+
+    backends: List[Any] = Field(default_factory=list)
+    hedge: bool = True
+    hedge_min_delay: float = 2.0
+    failure_threshold: int = 3
+    open_seconds: float = 30.0
+    hedges_sent: int = 0
+    hedges_won: int = 0
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def _llm_type(self):
+        return 'routed-chat'
+
+    def ordered_backends(self):
+        """
+        リクエストを送る順にバックエンドを返します（速い順、記録のないものは設定順で後ろ）。
+        サーキットが開いているバックエンドは期限（open_until）まで使いません。
+        """
+        now = time.monotonic()
+
+        def key(indexed):
+            index, backend = indexed
+            if backend.latency is None:
+                return (1, backend.error_rate, index)
+            # エラー率の高いバックエンドは遅いものとして扱う
+            return (0, backend.latency * (1 + 4 * backend.error_rate), index)
+
+        available = [(index, backend) for index, backend in enumerate(self.backends) if backend.is_available(now)]
+        return [backend for _, backend in sorted(available, key=key)]
+
+    def _hedge_delay(self, backend):
+        p95 = backend.p95()
+        if p95 is None:
+            return self.hedge_min_delay * 5
+        return max(self.hedge_min_delay, p95)
+
+    def _start(self, backend):
+        """サーキットの期限切れ後の最初のリクエストは試行として扱います。"""
+        if backend.open_until and backend.is_available(time.monotonic()):
+            backend.half_open = True
+
+    def _failed(self, backend, error):
+        logger.warning("LLMバックエンド %s でエラーが発生しました: %s", backend.name, error)
+        backend.record_failure(self.failure_threshold, self.open_seconds)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        """同期呼び出し（ヘッジなしで順に試します）"""
+        last_error = None
+        for backend in self.ordered_backends():
+            self._start(backend)
+            started = time.monotonic()
+            try:
+                result = backend.llm._generate(messages, stop=stop, **kwargs)
+            except Exception as e:
+                self._failed(backend, e)
+                last_error = e
+                continue
+            backend.record_success(time.monotonic() - started)
+            return result
+        raise last_error or RuntimeError('利用できるLLMバックエンドがありません')
+
+    async def _call(self, backend, messages, stop, kwargs):
+        self._start(backend)
+        started = time.monotonic()
+        try:
+            result = await backend.llm._agenerate(messages, stop=stop, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._failed(backend, e)
+            raise
+        backend.record_success(time.monotonic() - started)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        """
+        最も速い正常なバックエンドに送り、p95 を過ぎても応答がなければ次のバックエンドにも送ります。
+        先に成功した応答を使い、残りはキャンセルします。失敗した場合は次のバックエンドに切り替えます。
+        """
+        candidates = self.ordered_backends()
+        primary = candidates[0] if candidates else None
+        running = {}  # task -> backend
+        last_error = None
+        hedged = False
+        try:
+            while candidates or running:
+                if not running:
+                    backend = candidates.pop(0)
+                    running[asyncio.ensure_future(self._call(backend, messages, stop, kwargs))] = backend
+                # ヘッジ先がある場合だけ待ち時間を設ける
+                timeout = None
+                if self.hedge and candidates and len(running) == 1:
+                    timeout = self._hedge_delay(next(iter(running.values())))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 応答が遅いため次のバックエンドにも送る
+                    backend = candidates.pop(0)
+                    logger.info("LLMバックエンドの応答が遅いため %s にもリクエストを送ります", backend.name)
+                    self.hedges_sent += 1
+                    hedged = True
+                    running[asyncio.ensure_future(self._call(backend, messages, stop, kwargs))] = backend
+                    continue
+                for task in done:
+                    backend = running.pop(task)
+                    if task.exception() is None:
+                        if hedged and backend is not primary:
+                            self.hedges_won += 1
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error or RuntimeError('利用できるLLMバックエンドがありません')
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        """
+        ストリーミング呼び出し
+        最初の断片が p95 を過ぎても届かなければ次のバックエンドにも送り、先に届いた方を使います。
+        最初の断片が届く前に失敗した場合は次のバックエンドに切り替えます。
+        """
+        candidates = self.ordered_backends()
+        primary = candidates[0] if candidates else None
+        running = {}  # 最初の断片を待つtask -> (backend, iterator, 開始時刻)
+        last_error = None
+        winner = None
+        hedged = False
+        waited = False  # ヘッジの待ち時間が過ぎたか
+        try:
+            while winner is None and (candidates or running):
+                if not running or (candidates and self.hedge and len(running) == 1 and waited):
+                    backend = candidates.pop(0)
+                    if running:
+                        logger.info("LLMバックエンドの応答が遅いため %s にもリクエストを送ります", backend.name)
+                        self.hedges_sent += 1
+                        hedged = True
+                    self._start(backend)
+                    iterator = backend.llm._astream(messages, stop=stop, **kwargs).__aiter__()
+                    running[asyncio.ensure_future(iterator.__anext__())] = (backend, iterator, time.monotonic())
+                timeout = None
+                if self.hedge and candidates and len(running) == 1:
+                    timeout = self._hedge_delay(next(iter(running.values()))[0])
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                waited = not done
+                for task in done:
+                    backend, iterator, started = running.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if hedged and backend is not primary:
+                            self.hedges_won += 1
+                        winner = (backend, iterator, started, task.result())
+                        break
+                    if isinstance(error, StopAsyncIteration):
+                        # 空の応答も成功として扱う
+                        backend.record_success(time.monotonic() - started)
+                        return
+                    self._failed(backend, error)
+                    last_error = error
+            if winner is None:
+                raise last_error or RuntimeError('利用できるLLMバックエンドがありません')
+        finally:
+            # 使わなかったストリームは、実行中の __anext__ をキャンセルして終わるのを待ってから閉じる
+            # （実行中に閉じると RuntimeError になり、接続が閉じられないまま残る）
+            for task, (backend, iterator, _) in running.items():
+                task.cancel()
+                closing = asyncio.ensure_future(_cancel_and_close(task, iterator))
+                _closing.add(closing)
+                closing.add_done_callback(_closing.discard)
+
+        backend, iterator, started, first = winner
+        yield first
+        try:
+            async for chunk in iterator:
+                yield chunk
+        except Exception as e:
+            self._failed(backend, e)
+            raise
+        backend.record_success(time.monotonic() - started)
+
+    def stats(self):
+        """バックエンドごとの応答時間・エラー率・サーキットの状態を返します。"""
+        return {backend.name: backend.stats() for backend in self.backends}
+
+
+# 閉じている途中のストリームのタスク（完了まで参照を保持する）
+_closing = set()
+
+
+async def _cancel_and_close(task, iterator):
+    """キャンセルした __anext__ のタスクが終わるのを待ってから、ストリームを閉じます。"""
+    await asyncio.gather(task, return_exceptions=True)
+    aclose = getattr(iterator, 'aclose', None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception as e:
+            logger.warning("使わなかったLLMのストリームを閉じられませんでした: %s", e)
@@ -0,0 +1,155 @@
+"""
+LLM呼び出しを非同期で実行するモジュール
+イベントループをブロックしないようにチェーンの非同期APIを使用し、
+非同期APIがない場合は上限付きのスレッドプールで実行します。
+グローバルな同時実行数の上限（優先度付きの実行枠）と、チャンネルごとの直列実行キューを提供します。
+"""
+
+import time
+import asyncio
+import functools
+import contextlib
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from priority_scheduler import PriorityScheduler, PRIORITY_DIRECT
+from token_estimator import estimate_tokens
+import metrics
+
+# デフォルトのグローバル同時実行数
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+class LLMRunner:
+    """
+    LLMチェーンを非同期に実行するランナー
+
+    - グローバルな同時実行数は優先度付きのスケジューラで制限し、
+      直接の呼びかけをランダム応答より先に実行します
+    - 同じチャンネルの処理はチャンネルごとのロックで直列化し、
+      channel_memories の更新順序を保ちます
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.scheduler = PriorityScheduler(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='llm')
+        # 使用中のロックだけを保持する（誰も参照していないロックは自動的に破棄される）
+        self._channel_locks = weakref.WeakValueDictionary()
+        self.in_flight = 0
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, chain, inputs, priority, stale_at, prompt_tokens):
+        """実行枠を確保し、待ち時間・実行時間・送信した推定トークン数を記録します。"""
+        queued = time.perf_counter()
+        async with self.scheduler.slot(priority, stale_at):
+            started = time.perf_counter()
+            metrics.observe(metrics.STAGE_LLM_QUEUE, started - queued)
+            if prompt_tokens is None:
+                prompt_tokens = _estimate_prompt_tokens(chain, inputs)
+            metrics.llm_tokens.inc(prompt_tokens, direction='prompt')
+            self.in_flight += 1
+            try:
+                with metrics.timed(metrics.STAGE_LLM):
+                    yield
+            finally:
+                self.in_flight -= 1
+
+    def set_max_concurrency(self, max_concurrency):
+        """
+        グローバルな同時実行数を変更します。
+        実行中の呼び出しはそのまま完了し、新しい呼び出しから新しい上限が適用されます。
+        """
+        max_concurrency = max(1, int(max_concurrency))
+        if max_concurrency == self.max_concurrency:
+            return
+        old_executor = self._executor
+        self.max_concurrency = max_concurrency
+        self.scheduler.set_workers(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='llm')
+        old_executor.shutdown(wait=False)
+
+    def channel_lock(self, channel_id):
+        """
+        チャンネルごとの直列実行用ロックを返します。
+
+        使用例:
+            async with llm_runner.channel_lock(channel_id):
+                ...  # 履歴の読み込み → LLM呼び出し → 履歴への追加
+        """
+        lock = self._channel_locks.get(channel_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._channel_locks[channel_id] = lock
+        return lock
+
+    async def ainvoke(self, chain, inputs, priority=PRIORITY_DIRECT, stale_at=None, prompt_tokens=None):
+        """
+        チェーンを非同期に実行します。
+
+        Args:
+            chain: invoke / ainvoke を持つLangChainのチェーン
+            inputs (dict): チェーンへの入力
+            priority (int): 実行の優先度（priority_scheduler の PRIORITY_*）
+            stale_at (float): この時刻（イベントループの時刻）までに実行枠を確保できなければ実行しない
+            prompt_tokens (int): プロンプトの推定トークン数（メトリクス用。省略時はテンプレートと入力から概算する）
+
+        Returns:
+            dict: チェーンの出力
+
+        Raises:
+            StaleJobDropped: stale_at までに実行枠を確保できなかった場合
+        """
+        async with self._slot(chain, inputs, priority, stale_at, prompt_tokens):
+            if hasattr(chain, 'ainvoke'):
+                result = await chain.ainvoke(inputs)
+            else:
+                # 非同期APIがない場合はスレッドプールで実行
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._executor, functools.partial(chain.invoke, inputs))
+            if isinstance(result, dict) and isinstance(result.get('text'), str):
+                metrics.llm_tokens.inc(estimate_tokens(result['text']), direction='completion')
+            return result
+
+    async def astream(self, chain, inputs, priority=PRIORITY_DIRECT, stale_at=None, prompt_tokens=None):
+        """
+        チェーンの出力テキストを生成された順に少しずつ返します。
+        LLMChainはトークンごとの出力に対応していないため、プロンプトとLLMを直接つないで実行します。
+
+        Args:
+            chain: LLMChain、または astream を持つチェーン
+            inputs (dict): チェーンへの入力
+            priority (int): 実行の優先度（priority_scheduler の PRIORITY_*）
+            stale_at (float): この時刻（イベントループの時刻）までに実行枠を確保できなければ実行しない
+            prompt_tokens (int): プロンプトの推定トークン数（メトリクス用。省略時はテンプレートと入力から概算する）
+
+        Yields:
+            str: 生成されたテキストの断片
+
+        Raises:
+            StaleJobDropped: stale_at までに実行枠を確保できなかった場合
+        """
+        if hasattr(chain, 'prompt') and hasattr(chain, 'llm'):
+            runnable = chain.prompt | chain.llm
+        else:
+            runnable = chain
+        async with self._slot(chain, inputs, priority, stale_at, prompt_tokens):
+            started = time.perf_counter()
+            completion_tokens = 0
+            try:
+                async for chunk in runnable.astream(inputs):
+                    text = getattr(chunk, 'content', chunk)
+                    if isinstance(text, str) and text:
+                        if started is not None:
+                            metrics.observe(metrics.STAGE_LLM_FIRST_TOKEN, time.perf_counter() - started)
+                            started = None
+                        completion_tokens += estimate_tokens(text)
+                        yield text
+            finally:
+                metrics.llm_tokens.inc(completion_tokens, direction='completion')
+
+
+def _estimate_prompt_tokens(chain, inputs):
+    """プロンプトを展開せずに、テンプレートと入力の推定トークン数の合計を返します。"""
+    prompt = getattr(chain, 'prompt', None)
+    template = getattr(prompt, 'template', '')
+    return estimate_tokens(template) + sum(estimate_tokens(value) for value in inputs.values() if isinstance(value, str))
@@ -0,0 +1,96 @@
+"""
+受信メッセージの分類モジュール
+検索トリガー・メンション・ボットの名前（エイリアス）を1つのコンパイル済み正規表現で検出し、
+メッセージを1回走査するだけで検索クエリと応答理由を求めます。
+正規表現は設定が変わったときだけ作り直します。
+"""
+
+import re
+from collections import namedtuple
+
+# 分類結果
+# trigger: 最初に見つかった検索トリガー（なければNone）
+# query: トリガー語を除いた検索クエリ（トリガーがなければNone）
+# mentioned: ボットへのメンションが含まれているか
+# name_hits: 見つかったボットの名前・エイリアス（小文字、出現順）
+# reason: 必ず応答する理由（'メンション' / '名前呼びかけ' / None）
+Classification = namedtuple('Classification', ['trigger', 'query', 'mentioned', 'name_hits', 'reason'])
+
+
+class MessageClassifier:
+    """
+    メッセージを1回の走査で分類するクラス
+    トリガー語・名前・エイリアスはすべて大文字小文字を区別せずに検出します。
+
+    Args:
+        search_triggers (list): 検索トリガー語のリスト
+        bot_id (str): ボットのユーザーID（空ならメンションを検出しない）
+        bot_name (str): ボットの名前
+        bot_aliases (list): ボットの別名のリスト
+    """
+
+    def __init__(self, search_triggers, bot_id='', bot_name=None, bot_aliases=()):
+        # 語 -> 種類（同じ語が複数の種類に含まれる場合はトリガーを優先）
+        self._kinds = {}
+        for alias in [bot_name or ''] + list(bot_aliases):
+            self._kinds[alias.lower()] = 'name'
+        for trigger in search_triggers:
+            self._kinds[trigger.lower()] = 'trigger'
+        if bot_id:
+            self._kinds[f"<@{bot_id}>"] = 'mention'
+            self._kinds[f"<@!{bot_id}>"] = 'mention'
+        self._kinds.pop('', None)
+        # 長い語から順に並べて重なる語は最長一致にする
+        # （グループや大文字小文字を無視するフラグを使うと先頭文字による高速化が効かなくなるため、
+        #   小文字にした本文を単純な選択パターンで走査する）
+        words = sorted(self._kinds, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(re.escape(w) for w in words)) if words else None
+
+    def classify(self, content):
+        """
+        メッセージを分類します。
+
+        Args:
+            content (str): メッセージ本文
+
+        Returns:
+            Classification: 分類結果
+        """
+        content = content.strip()
+        lowered = content.lower()
+        # 小文字化で長さが変わる文字を含む場合は小文字の本文からクエリを切り出す
+        source = content if len(lowered) == len(content) else lowered
+        trigger = None
+        mentioned = False
+        name_hits = []
+        # トリガー語を取り除いた断片
+        pieces = []
+        last = 0
+        if self._pattern is not None:
+            for match in self._pattern.finditer(lowered):
+                word = match.group()
+                kind = self._kinds[word]
+                if kind == 'trigger':
+                    if trigger is None:
+                        trigger = word
+                    pieces.append(source[last:match.start()])
+                    last = match.end()
+                elif kind == 'mention':
+                    mentioned = True
+                else:
+                    name_hits.append(word)
+
+        query = None
+        if trigger is not None:
+            pieces.append(source[last:])
+            query = ''.join(pieces).strip()
+            if not query:
+                query = content  # トリガー語だけの場合は全文
+
+        if mentioned:
+            reason = 'メンション'
+        elif name_hits:
+            reason = '名前呼びかけ'
+        else:
+            reason = None
+        return Classification(trigger, query, mentioned, name_hits, reason)
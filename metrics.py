@@ -0,0 +1,256 @@
+"""
+処理時間などの計測値を集計するモジュール
+処理の段階（メッセージの分類・検索・スクレイピング・LLM呼び出し・Discordへの送信）ごとの処理時間のヒストグラムと、
+カウンター・ゲージを集計し、Prometheusのテキスト形式で出力します。
+METRICS_PORT を設定した場合は、ローカルのHTTPエンドポイント（/metrics）で公開します。
+"""
+
+import os
+import time
+import bisect
+import logging
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# メトリクスのHTTPエンドポイント（ポートが未設定なら公開しない）
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# 処理時間のヒストグラムのデフォルトの区切り（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# 処理の段階
+STAGE_CLASSIFY = 'classify'  # 受信メッセージの分類
+STAGE_SEARCH = 'search'  # DuckDuckGo検索
+STAGE_SCRAPE = 'scrape'  # 1ページのスクレイピング
+STAGE_LLM_QUEUE = 'llm_queue'  # LLM呼び出しの実行枠の待ち時間
+STAGE_LLM = 'llm'  # LLM呼び出し（実行枠を確保してから応答が終わるまで）
+STAGE_LLM_FIRST_TOKEN = 'llm_first_token'  # LLMの最初の断片が届くまで
+STAGE_SEND = 'discord_send'  # Discordへのメッセージの送信・編集
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class _Metric:
+    """ラベルの値ごとに値を持つメトリクスの基底クラス"""
+
+    type_name = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """増える一方の値（回数・トークン数など）"""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """その時点の値（待ち行列の長さ・実行中の数など）"""
+
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """
+    値の分布（処理時間など）
+
+    Args:
+        buckets (tuple): 区切りの値（昇順）
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [区切りごとの件数..., 合計, 件数]
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type_name}']
+        names = self.label_names + ('le',)
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_format_labels(names, key + (_format_value(float(bound)),))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(names, key + ("+Inf",))} {entry[-1]}')
+                labels = _format_labels(self.label_names, key)
+                lines.append(f'{self.name}_sum{labels} {entry[-2]}')
+                lines.append(f'{self.name}_count{labels} {entry[-1]}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    メトリクスの登録と出力
+
+    collector には出力の直前に呼び出す関数を登録し、
+    待ち行列の長さやキャッシュのヒット率など、その時点の値をゲージに設定します。
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collector):
+        """出力の直前に呼び出す関数を登録します。"""
+        self._collectors.append(collector)
+
+    def render(self):
+        """すべてのメトリクスをPrometheusのテキスト形式で返します。"""
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception as e:
+                logger.warning("メトリクスの収集に失敗しました: %s", e)
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# プロセス全体で共有するメトリクス
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    'discord_bot_stage_duration_seconds', '処理の段階ごとの処理時間（秒）', labels=('stage',)
+)
+stage_errors = registry.counter(
+    'discord_bot_stage_errors_total', '処理の段階ごとのエラーの回数', labels=('stage',)
+)
+llm_tokens = registry.counter(
+    'discord_bot_llm_tokens_total', 'LLMに送信・LLMから受信した推定トークン数', labels=('direction',)
+)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """
+    処理時間を計測してヒストグラムに記録するコンテキストマネージャ
+    例外が発生した場合はエラーの回数も記録します。
+
+    使用例:
+        with metrics.timed(metrics.STAGE_SEARCH):
+            results = await async_duckduckgo_search(query)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage=stage)
+
+
+def observe(stage, seconds):
+    """計測済みの処理時間を記録します。"""
+    stage_seconds.observe(seconds, stage=stage)
+
+
+async def start_http_server(port=None, host=None):
+    """
+    /metrics でメトリクスを返すHTTPサーバーを起動します（discord.pyが使うaiohttpで動作します）。
+
+    Args:
+        port (int): 待ち受けるポート（省略時は METRICS_PORT。未設定なら起動しない）
+        host (str): 待ち受けるアドレス（省略時は METRICS_HOST。デフォルトはローカルのみ）
+
+    Returns:
+        aiohttp.web.AppRunner: 起動したサーバー（起動しなかった場合はNone）
+    """
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host or METRICS_HOST, int(port)).start()
+    return runner
@@ -4,43 +4,68 @@ DuckDuckGo検索機能のモジュール
 検索結果のURLからコンテンツを取得する機能も提供
 """
 
+import logging
+
+# 検索結果のキャッシュ（別ファイル）
+from search_cache import get_search_cache
+# 処理時間の計測（別ファイル）
+import metrics
+# 検索・スクレイピング・LLMで共有するHTTP接続プール
+from http_pool import get_async_client, get_session
+
 # Webスクレイピングモジュールをインポート
 
 try:
-    from web_scraper import scrape_url, scrape_multiple_urls
+    from web_scraper import scrape_url, scrape_multiple_urls, async_scrape_multiple_urls
     SCRAPING_AVAILABLE = True
 except ImportError:
     print("[WARNING] web_scraper module not available. URL content extraction will be disabled.")
     SCRAPING_AVAILABLE = False
 
+logger = logging.getLogger(__name__)
+
+DDG_HTML_URL = "https://html.duckduckgo.com/html/"
+DDG_HEADERS = {"User-Agent": "Mozilla/5.0"}
+# 検索リクエストのタイムアウト（秒）
+DDG_TIMEOUT = 10
+
+def _parse_search_results(html, max_results=5):
+    """
+    DuckDuckGoのHTMLから検索結果（タイトル・スニペット・URL）を取り出します。
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    results = []
+    for r in soup.select(".result"):
+        title_tag = r.select_one("a.result__a")
+        snippet_tag = r.select_one(".result__snippet")
+        href = title_tag["href"] if title_tag and title_tag.has_attr("href") else None
+        title = title_tag.get_text(strip=True) if title_tag else None
+        snippet = snippet_tag.get_text(strip=True) if snippet_tag else ""
+        if title and href:
+            results.append({"title": title, "body": snippet, "href": href})
+        if len(results) >= max_results:
+            break
+    return results
+
 def duckduckgo_search(query: str):
     """
     DuckDuckGo公式HTMLを直接パースして検索結果（タイトル・スニペット・URL）最大5件を返す超シンプルな関数。
     例: [{'title': ..., 'body': ..., 'href': ...}, ...]
     エラー時は空リスト。
+    同じクエリの結果は一定時間キャッシュし、同時に来た同じクエリは1回の検索にまとめる。
     """
-    print('duckduckgo_search called')
-    import requests
-    from bs4 import BeautifulSoup
+    return get_search_cache().get_or_fetch(query, _duckduckgo_search_uncached)
+
+def _duckduckgo_search_uncached(query: str):
+    """キャッシュを使わずにDuckDuckGoを検索する。"""
+    logger.debug("duckduckgo_search called")
     try:
-        url = "https://html.duckduckgo.com/html/"
-        headers = {"User-Agent": "Mozilla/5.0"}
         data = {"q": query}
-        resp = requests.post(url, headers=headers, data=data, timeout=10)
+        resp = get_session().post(DDG_HTML_URL, headers=DDG_HEADERS, data=data, timeout=DDG_TIMEOUT)
         resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, "html.parser")
-        results = []
-        for r in soup.select(".result"):
-            title_tag = r.select_one("a.result__a")
-            snippet_tag = r.select_one(".result__snippet")
-            href = title_tag["href"] if title_tag and title_tag.has_attr("href") else None
-            title = title_tag.get_text(strip=True) if title_tag else None
-            snippet = snippet_tag.get_text(strip=True) if snippet_tag else ""
-            if title and href:
-                results.append({"title": title, "body": snippet, "href": href})
-            if len(results) >= 5:
-                break
-        print(f"[DEBUG] DuckDuckGo parsed results for query '{query}': {results}")
+        results = _parse_search_results(resp.text)
+        logger.debug("DuckDuckGo parsed results for query '%s': %s", query, results)
         return results
     except Exception as e:
         import traceback
@@ -48,6 +73,48 @@ def duckduckgo_search(query: str):
         print(f"[ERROR] duckduckgo_search exception: {e}\n{tb}")
         return []
 
+async def async_duckduckgo_search(query: str, timeout=DDG_TIMEOUT):
+    """
+    duckduckgo_searchの非同期版。httpxで検索し、戻り値の形式は同じ。
+    エラー時やタイムアウト時は空リスト。
+    キャッシュと同時リクエストのまとめはduckduckgo_searchと同様。
+    """
+    async def fetch(q):
+        return await _async_duckduckgo_search_uncached(q, timeout)
+    return await get_search_cache().aget_or_fetch(query, fetch)
+
+async def _async_duckduckgo_search_uncached(query: str, timeout=DDG_TIMEOUT):
+    """キャッシュを使わずにDuckDuckGoを非同期に検索する。"""
+    import asyncio
+    try:
+        # 共有の接続プールを使い、DuckDuckGoへの接続を再利用する
+        resp = await get_async_client().post(DDG_HTML_URL, data={"q": query}, headers=DDG_HEADERS, timeout=timeout)
+        resp.raise_for_status()
+        # HTMLのパースはスレッドで実行してイベントループをブロックしない
+        results = await asyncio.to_thread(_parse_search_results, resp.text)
+        logger.debug("DuckDuckGo parsed results for query '%s': %s", query, results)
+        return results
+    except Exception as e:
+        logger.exception("async_duckduckgo_search exception: %s", e)
+        return []
+
+def _merge_scraped_contents(search_results, scraped_results):
+    """
+    スクレイピング結果のテキストを、URLが一致する検索結果の 'content' に追加します。
+    スクレイピングした検索結果（取得に失敗したURLの代わりに取得したものを含む）をスクレイピングの順で先頭に並べ、
+    残りの検索結果を元の順で後ろに並べます。
+    """
+    merged, used = [], set()
+    for scraped in scraped_results:
+        for result in search_results:
+            if id(result) not in used and result.get('href') == scraped['url']:
+                result['content'] = scraped['text'] if scraped['success'] else ''
+                merged.append(result)
+                used.add(id(result))
+                break
+    merged.extend(result for result in search_results if id(result) not in used)
+    return merged
+
 def extract_content_from_urls(search_results, max_urls=2, max_length_per_url=2000):
     """
     検索結果のURLからコンテンツを取得します。
@@ -69,7 +136,8 @@ def extract_content_from_urls(search_results, max_urls=2, max_length_per_url=200
         return search_results
     
     # URLを取得
-    urls = [result['href'] for result in search_results if 'href' in result][:max_urls]
+    # max_urls件を超えるURLは、取得に失敗したURLの代わりに使われる
+    urls = [result['href'] for result in search_results if 'href' in result]
     
     if not urls:
         return search_results
@@ -79,19 +147,69 @@ def extract_content_from_urls(search_results, max_urls=2, max_length_per_url=200
         scraped_results = scrape_multiple_urls(urls, max_urls=max_urls, max_length_per_url=max_length_per_url)
         
         # 検索結果にコンテンツを追加
-        for i, scraped in enumerate(scraped_results):
-            if i < len(search_results):
-                url = scraped['url']
-                # 対応するURLを探す
-                for j, result in enumerate(search_results):
-                    if result.get('href') == url:
-                        # コンテンツを追加
-                        search_results[j]['content'] = scraped['text'] if scraped['success'] else ''
-                        break
-        
-        return search_results
+        return _merge_scraped_contents(search_results, scraped_results)
     except Exception as e:
         import traceback
         tb = traceback.format_exc()
         print(f"[ERROR] extract_content_from_urls exception: {e}\n{tb}")
         return search_results  # エラー時は元の検索結果をそのまま返す
+
+async def async_extract_content_from_urls(search_results, max_urls=2, max_length_per_url=2000, timeout=None):
+    """
+    extract_content_from_urlsの非同期版です。
+    URLを並行して取得し、timeout秒以内に取得できたページのコンテンツだけを追加します。
+    
+    Args:
+        search_results (list): duckduckgo_searchの結果リスト
+        max_urls (int): 処理するURLの最大数
+        max_length_per_url (int): URLごとの最大文字数
+        timeout (float): 全体の制限時間（秒）。Noneの場合は無制限
+        
+    Returns:
+        list: 抽出されたコンテンツを含む検索結果のリスト
+    """
+    if not SCRAPING_AVAILABLE:
+        logger.error("Web scraping is not available")
+        return search_results
+    
+    # エラーチェック
+    if not search_results or isinstance(search_results, list) and 'error' in search_results[0]:
+        return search_results
+    
+    # max_urls件を超えるURLは、取得に失敗したURLの代わりに使われる
+    urls = [result['href'] for result in search_results if 'href' in result]
+    if not urls:
+        return search_results
+    
+    try:
+        scraped_results = await async_scrape_multiple_urls(
+            urls, max_urls=max_urls, max_length_per_url=max_length_per_url, timeout=timeout
+        )
+        return _merge_scraped_contents(search_results, scraped_results)
+    except Exception as e:
+        logger.exception("async_extract_content_from_urls exception: %s", e)
+        return search_results
+
+async def async_search_and_scrape(query: str, max_urls=3, max_length_per_url=3000, timeout=20):
+    """
+    検索とスクレイピングをまとめて実行する非同期パイプラインです。
+    検索から本文取得までを timeout 秒の単一の制限時間で行い、
+    制限時間に達した場合はそれまでに取得できたページだけを返します。
+    
+    Returns:
+        list: 検索結果のリスト。上位max_urls件には 'content' キーが付きます
+              （取得できなかった場合は空文字列）
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    
+    with metrics.timed(metrics.STAGE_SEARCH):
+        search_results = await async_duckduckgo_search(query, timeout=min(DDG_TIMEOUT, timeout))
+    if not search_results:
+        return search_results
+    
+    remaining = max(0.0, deadline - loop.time())
+    return await async_extract_content_from_urls(
+        search_results, max_urls=max_urls, max_length_per_url=max_length_per_url, timeout=remaining
+    )
@@ -0,0 +1,139 @@
+"""
+優先度付きのLLM呼び出しスケジューラモジュール
+固定数の実行枠（ワーカー）を優先度の高い処理から順に割り当てます。
+待ち時間に応じて優先度を引き上げ（エイジング）、低い優先度の処理がいつまでも待たされないようにし、
+きっかけのメッセージが古くなった処理は実行せずに破棄します。
+"""
+
+import asyncio
+import itertools
+import contextlib
+
+# 優先度（小さいほど先に実行される）
+PRIORITY_DIRECT = 0  # メンション・名前の呼びかけ・!ask
+PRIORITY_SEARCH = 1  # 検索トリガーへの応答（ゲートウェイのジョブキューで検索ジョブを取り出す順序に使う）
+PRIORITY_AMBIENT = 2  # 監視チャンネルでのランダム応答
+PRIORITY_BACKGROUND = 3  # 会話履歴の要約などの裏方の処理
+
+# デフォルトのエイジング間隔（この秒数待つごとに優先度を1段階引き上げる）
+DEFAULT_AGING_SECONDS = 10.0
+
+
+class StaleJobDropped(Exception):
+    """きっかけのメッセージが古くなったため、実行せずに破棄された処理"""
+
+
+class _Waiter:
+    """実行枠を待っている処理"""
+
+    def __init__(self, priority, stale_at, enqueued_at, seq, future):
+        self.priority = priority
+        self.stale_at = stale_at
+        self.enqueued_at = enqueued_at
+        self.seq = seq
+        self.future = future
+
+
+class PriorityScheduler:
+    """
+    優先度付きの実行枠の割り当て
+
+    Args:
+        workers (int): 同時に実行できる処理の数
+        aging_seconds (float): この秒数待つごとに優先度を1段階引き上げる（0以下なら引き上げない）
+
+    使用例:
+        async with scheduler.slot(PRIORITY_AMBIENT, stale_at=loop.time() + 30):
+            ...  # LLMの呼び出し
+    """
+
+    def __init__(self, workers, aging_seconds=DEFAULT_AGING_SECONDS):
+        self.workers = max(1, int(workers))
+        self.aging_seconds = aging_seconds
+        self.active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self.dropped = 0
+
+    def set_workers(self, workers):
+        """同時に実行できる処理の数を変更します。"""
+        self.workers = max(1, int(workers))
+        self._dispatch()
+
+    def _score(self, waiter, now):
+        if self.aging_seconds <= 0:
+            return waiter.priority
+        return waiter.priority - (now - waiter.enqueued_at) / self.aging_seconds
+
+    def _dispatch(self):
+        """古くなった処理を破棄し、空いている実行枠を優先度の高い処理に割り当てます。"""
+        if not self._waiters:
+            return
+        now = asyncio.get_running_loop().time()
+        for waiter in list(self._waiters):
+            if waiter.stale_at is not None and now >= waiter.stale_at:
+                self._waiters.remove(waiter)
+                self.dropped += 1
+                if not waiter.future.done():
+                    waiter.future.set_exception(StaleJobDropped())
+        while self.active < self.workers and self._waiters:
+            waiter = min(self._waiters, key=lambda w: (self._score(w, now), w.seq))
+            self._waiters.remove(waiter)
+            self.active += 1
+            waiter.future.set_result(None)
+
+    def _release(self):
+        self.active -= 1
+        self._dispatch()
+
+    async def _acquire(self, priority, stale_at):
+        loop = asyncio.get_running_loop()
+        if stale_at is not None and loop.time() >= stale_at:
+            self.dropped += 1
+            raise StaleJobDropped()
+        if self.active < self.workers and not self._waiters:
+            self.active += 1
+            return
+
+        future = loop.create_future()
+        waiter = _Waiter(priority, stale_at, loop.time(), next(self._seq), future)
+        self._waiters.append(waiter)
+        # 古くなった時点で待ち行列から取り除く
+        timer = loop.call_at(stale_at, self._dispatch) if stale_at is not None else None
+        try:
+            await future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif future.done() and not future.cancelled() and future.exception() is None:
+                # 実行枠を割り当てられた直後にキャンセルされた場合は枠を返す
+                self._release()
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=PRIORITY_DIRECT, stale_at=None):
+        """
+        実行枠を確保するコンテキストマネージャ
+
+        Args:
+            priority (int): 優先度（PRIORITY_* のいずれか）
+            stale_at (float): この時刻（イベントループの時刻）までに実行できなければ破棄する
+
+        Raises:
+            StaleJobDropped: 実行枠を確保する前に stale_at を過ぎた場合
+        """
+        await self._acquire(priority, stale_at)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        """実行中・待機中の処理数と破棄した処理数を返します。"""
+        waiting = {}
+        for waiter in self._waiters:
+            waiting[waiter.priority] = waiting.get(waiter.priority, 0) + 1
+        return {'active': self.active, 'waiting': waiting, 'dropped': self.dropped}
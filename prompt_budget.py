@@ -0,0 +1,169 @@
+"""
+プロンプトのトークン数の配分モジュール
+モデルのコンテキスト長から応答用の分を除いたトークン数を、
+プロンプトテンプレート（チャンネルのプロンプトとシステムプロンプト）の残りとして
+入力（最新のメッセージ・質問）と会話履歴に重みに応じて配分し、はみ出した分を文の区切りで切り詰めます。
+トークン数は token_estimator でローカルに概算します。
+"""
+
+import re
+
+from token_estimator import estimate_tokens, truncate_to_tokens
+
+# 配分する部分
+PART_INPUT = 'input'  # 最新のメッセージ・質問
+PART_HISTORY = 'history'  # 会話履歴（古い方から切り詰める）
+
+# 古い方（先頭）から切り詰める部分
+TAIL_PARTS = (PART_HISTORY,)
+
+# モデル名の先頭部分ごとのコンテキスト長（長い名前から順に照合する）
+MODEL_CONTEXT_TOKENS = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+    'gpt-4.1': 1047576,
+    'o1': 200000,
+    'o3': 200000,
+    'claude': 200000,
+    'gemini': 1000000,
+    'llama3': 8192,
+}
+# 不明なモデルのコンテキスト長
+DEFAULT_CONTEXT_TOKENS = 8192
+
+# 文の区切り（句点・感嘆符・疑問符・改行の直後）
+_SENTENCE_END_RE = re.compile(r'(?<=[。！？!?\n])|(?<=\.)(?=\s)')
+
+
+def context_window(model):
+    """
+    モデルのコンテキスト長を返します。
+    "openai/gpt-4" のようなプロバイダー付きの名前にも対応します。
+    """
+    name = (model or '').split('/')[-1].lower()
+    for prefix in sorted(MODEL_CONTEXT_TOKENS, key=len, reverse=True):
+        if name.startswith(prefix):
+            return MODEL_CONTEXT_TOKENS[prefix]
+    return DEFAULT_CONTEXT_TOKENS
+
+
+def split_sentences(text):
+    """テキストを文の区切りで分割します（区切りの文字は前の文に含めます）。"""
+    return [sentence for sentence in _SENTENCE_END_RE.split(text) if sentence]
+
+
+def trim_to_tokens(text, max_tokens, keep_tail=False):
+    """
+    推定トークン数が max_tokens 以下になるよう、文の区切りでテキストを切り詰めます。
+    1文も収まらない場合は文の途中で切ります。
+
+    Args:
+        text (str): 対象のテキスト
+        max_tokens (int): トークン数の上限
+        keep_tail (bool): Trueなら末尾（新しい方）を残し、Falseなら先頭を残す
+
+    Returns:
+        str: 切り詰めたテキスト
+    """
+    if max_tokens <= 0:
+        return ''
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sentences = split_sentences(text)
+    if keep_tail:
+        sentences.reverse()
+    kept, used = [], 0
+    for sentence in sentences:
+        tokens = estimate_tokens(sentence)
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    if not kept:
+        if keep_tail:
+            # 末尾を残す場合は反転して先頭を残す処理を流用する
+            return truncate_to_tokens(text[::-1], max_tokens)[::-1]
+        return truncate_to_tokens(text, max_tokens)
+    if keep_tail:
+        kept.reverse()
+    return ''.join(kept)
+
+
+def _fill(demands, weights, capacity):
+    """
+    需要（トークン数）を重みに比例して配分します。
+    需要が配分より少ない部分の余りは、残りの部分に重みに応じて配り直します。
+
+    Returns:
+        dict: キーごとの配分
+    """
+    allocation = {key: 0 for key in demands}
+    open_keys = [key for key, demand in demands.items() if demand > 0 and weights.get(key, 0) > 0]
+    while open_keys and capacity > 0:
+        total_weight = sum(weights[key] for key in open_keys)
+        satisfied = [
+            key for key in open_keys
+            if demands[key] - allocation[key] <= capacity * weights[key] / total_weight
+        ]
+        if not satisfied:
+            # 全員の需要が配分を上回る場合は重みで按分して終わる
+            for key in open_keys:
+                allocation[key] += int(capacity * weights[key] / total_weight)
+            break
+        for key in satisfied:
+            capacity -= demands[key] - allocation[key]
+            allocation[key] = demands[key]
+            open_keys.remove(key)
+    return allocation
+
+
+class PromptBudget:
+    """
+    プロンプトのトークン数の配分
+
+    Args:
+        context_tokens (int): モデルのコンテキスト長（または設定したプロンプトの上限）
+        reserve_tokens (int): 応答の生成用に残しておくトークン数
+        weights (dict): 部分（PART_*）ごとの重み。0の部分には配分しない
+
+    使用例:
+        budget = PromptBudget(context_window('gpt-4'), 1024, {PART_INPUT: 3, PART_HISTORY: 1})
+        fitted, report = budget.allocate(template, {PART_HISTORY: history, PART_INPUT: question})
+    """
+
+    def __init__(self, context_tokens, reserve_tokens, weights):
+        self.context_tokens = context_tokens
+        self.reserve_tokens = reserve_tokens
+        self.weights = weights
+
+    def allocate(self, template, parts):
+        """
+        テンプレートの残りのトークン数を部分ごとに配分し、はみ出した分を切り詰めます。
+
+        Args:
+            template (str): プロンプトテンプレート（切り詰めない）
+            parts (dict): 部分（PART_*）ごとのテキスト
+
+        Returns:
+            tuple: (切り詰めたテキストの辞書, トークン数の内訳の辞書)
+        """
+        template_tokens = estimate_tokens(template)
+        available = max(0, self.context_tokens - self.reserve_tokens - template_tokens)
+
+        demands = {name: estimate_tokens(text) for name, text in parts.items()}
+        allocation = _fill(demands, self.weights, available)
+
+        fitted = {
+            name: trim_to_tokens(text, allocation[name], keep_tail=name in TAIL_PARTS)
+            for name, text in parts.items()
+        }
+
+        report = {'template': template_tokens, 'limit': self.context_tokens - self.reserve_tokens}
+        for name, text in fitted.items():
+            report[name] = estimate_tokens(text)
+            report[f'{name}_trimmed'] = demands[name] - report[name]
+        report['total'] = template_tokens + sum(report[name] for name in fitted)
+        return fitted, report
@@ -0,0 +1,46 @@
+"""
+プロンプトテンプレートとチェーンのキャッシュモジュール
+チャンネルIDと設定のバージョン番号をキーに、構築済みのオブジェクトを再利用します。
+設定が変更されたら bump() でバージョンを上げ、古いオブジェクトを破棄します。
+"""
+
+import threading
+
+
+class ChainCache:
+    """
+    (種類, チャンネルID, 設定バージョン) をキーにしたキャッシュ
+
+    使用例:
+        chain = chain_cache.get('chat', channel_id, lambda: LLMChain(...))
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, channel_id, build):
+        """キャッシュされたオブジェクトを返し、なければbuild()で作成して保存します。"""
+        key = (kind, channel_id, self.version)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+        value = build()
+        with self._lock:
+            # 作成中に設定が変わっていた場合は保存しない
+            if key[2] == self.version:
+                self._entries.setdefault(key, value)
+            self.misses += 1
+        return value
+
+    def bump(self):
+        """設定のバージョンを上げ、キャッシュを破棄します。"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+        return self.version
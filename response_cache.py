@@ -0,0 +1,212 @@
+"""
+LLMの応答のキャッシュモジュール
+展開済みのプロンプト（チャンネルのプロンプト・システムプロンプト・会話履歴・入力）のハッシュをキーに、
+LLMの応答をTTL付きで保存します。
+チャンネルごとに有効にできる類似質問の段では、同じプロンプトテンプレートの中で
+入力の文字n-gramのMinHashが近い質問にも保存済みの応答を返します。
+"""
+
+import re
+import time
+import zlib
+import random
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+# デフォルトの設定
+DEFAULT_TTL = 3600  # 秒
+DEFAULT_MAX_SIZE = 500  # 件
+DEFAULT_SIMILARITY = 0.9  # 類似とみなす推定Jaccard係数
+
+# MinHashの設定（署名の長さ = バンド数 × バンドあたりの行数）
+NGRAM_SIZE = 3
+MINHASH_BANDS = 16
+MINHASH_ROWS = 4
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_rng = random.Random(0x5eed)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _normalize(text):
+    """全角・半角の統一（NFKC）、小文字化、空白の圧縮を行います。"""
+    text = unicodedata.normalize('NFKC', text)
+    return _WHITESPACE_RE.sub(' ', text).strip().lower()
+
+
+def minhash_signature(text, ngram=NGRAM_SIZE):
+    """
+    テキストの文字n-gramからMinHash署名を計算します。
+
+    Returns:
+        tuple: 長さ MINHASH_BANDS * MINHASH_ROWS の署名
+    """
+    text = _normalize(text)
+    if len(text) < ngram:
+        text = text.ljust(ngram)
+    shingles = {zlib.crc32(text[i:i + ngram].encode('utf-8')) for i in range(len(text) - ngram + 1)}
+    return tuple(
+        min(((a * shingle + b) % _MERSENNE_PRIME) & _MAX_HASH for shingle in shingles)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def estimate_similarity(sig1, sig2):
+    """2つのMinHash署名から推定Jaccard係数を返します。"""
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / len(sig1)
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class _Entry:
+    """保存した応答"""
+
+    def __init__(self, text, scope, signature):
+        self.text = text
+        self.scope = scope
+        self.signature = signature
+        self.stored_at = time.monotonic()
+
+
+class ResponseCache:
+    """
+    LLMの応答のTTL付きLRUキャッシュ
+
+    完全一致の段は展開済みのプロンプト全体のハッシュをキーにするため、
+    チャンネルのプロンプトが異なるチャンネル同士で応答が共有されることはありません。
+    類似質問の段はプロンプトテンプレートとモデルが同じもの（scope）の中だけを検索します。
+
+    Args:
+        ttl (int): 応答を保存しておく秒数（0以下ならキャッシュしない）
+        max_size (int): 保存する応答の最大件数
+        similarity (float): 類似質問とみなす推定Jaccard係数（0〜1）
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, similarity=DEFAULT_SIMILARITY):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        # (scope, バンド番号, バンドの値) -> キーの集合（LSHの索引）
+        self._bands = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'similar_hits': 0, 'misses': 0, 'stores': 0}
+
+    @staticmethod
+    def make_scope(template, model):
+        """プロンプトテンプレートとモデルから類似検索の範囲を表すキーを作ります。"""
+        return _digest(model, template)
+
+    @staticmethod
+    def make_key(scope, prompt_text):
+        """範囲と展開済みのプロンプトから完全一致のキーを作ります。"""
+        return _digest(scope, prompt_text)
+
+    def _band_keys(self, scope, signature):
+        for band in range(MINHASH_BANDS):
+            start = band * MINHASH_ROWS
+            yield (scope, band, signature[start:start + MINHASH_ROWS])
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry.signature is None:
+            return
+        for band_key in self._band_keys(entry.scope, entry.signature):
+            keys = self._bands.get(band_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._bands[band_key]
+
+    def _is_expired(self, entry, now):
+        return now - entry.stored_at >= self.ttl
+
+    def get(self, key, scope=None, query=None):
+        """
+        保存済みの応答を返します。
+
+        Args:
+            key (str): make_key で作った完全一致のキー
+            scope (str): make_scope で作った類似検索の範囲
+            query (str): 類似検索に使う入力テキスト（Noneなら完全一致だけを検索する）
+
+        Returns:
+            str: 保存済みの応答（なければNone）
+        """
+        if self.ttl <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._is_expired(entry, now):
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry.text
+                self._remove_locked(key)
+
+            if query is not None and scope is not None:
+                signature = minhash_signature(query)
+                best_key, best_score = None, self.similarity
+                candidates = set()
+                for band_key in self._band_keys(scope, signature):
+                    candidates.update(self._bands.get(band_key, ()))
+                for candidate in candidates:
+                    entry = self._entries[candidate]
+                    if self._is_expired(entry, now):
+                        continue
+                    score = estimate_similarity(signature, entry.signature)
+                    if score >= best_score:
+                        best_key, best_score = candidate, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self._stats['similar_hits'] += 1
+                    return self._entries[best_key].text
+
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key, text, scope=None, query=None):
+        """
+        応答を保存します。query を指定すると類似検索の索引にも登録します。
+        """
+        if self.ttl <= 0 or not text:
+            return
+        signature = minhash_signature(query) if query is not None and scope is not None else None
+        with self._lock:
+            self._remove_locked(key)
+            self._entries[key] = _Entry(text, scope, signature)
+            if signature is not None:
+                for band_key in self._band_keys(scope, signature):
+                    self._bands.setdefault(band_key, set()).add(key)
+            self._stats['stores'] += 1
+            # 古いものから削除して件数の上限に収める
+            while len(self._entries) > self.max_size:
+                self._remove_locked(next(iter(self._entries)))
+
+    def clear(self):
+        """すべての応答を削除します。"""
+        with self._lock:
+            self._entries.clear()
+            self._bands.clear()
+
+    def stats(self):
+        """ヒット数などの統計を返します。"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
@@ -0,0 +1,192 @@
+"""
+スクレイピング結果のキャッシュモジュール
+正規化したURLをキーに、抽出済みのタイトルと本文を保存します。
+メモリ上のLRUキャッシュとSQLiteのディスクキャッシュの2段構成で、
+期限切れのエントリはETag/Last-Modifiedによる条件付きリクエストで再検証できます。
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# キャッシュの設定（環境変数で変更可能）
+SCRAPE_CACHE_PATH = os.getenv('SCRAPE_CACHE_PATH', 'scrape_cache.sqlite3')
+SCRAPE_CACHE_TTL = int(os.getenv('SCRAPE_CACHE_TTL', '3600'))  # 秒
+SCRAPE_CACHE_MEMORY_SIZE = int(os.getenv('SCRAPE_CACHE_MEMORY_SIZE', '256'))  # 件
+# この期間を過ぎたエントリは再検証の対象にもせず削除する（秒）
+SCRAPE_CACHE_MAX_AGE = int(os.getenv('SCRAPE_CACHE_MAX_AGE', str(7 * 24 * 3600)))
+# スクレイピング結果をキャッシュするか
+SCRAPE_CACHE_ENABLED = os.getenv('SCRAPE_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes', 'on')
+
+# 正規化時に取り除くトラッキング用のクエリパラメータ
+_TRACKING_PARAMS = {'fbclid', 'gclid', 'yclid', 'mc_cid', 'mc_eid', 'ref_src'}
+
+
+def normalize_url(url):
+    """
+    キャッシュキー用にURLを正規化します。
+    スキームとホストの小文字化、デフォルトポートとフラグメントの除去、
+    トラッキング用パラメータの除去とクエリの並べ替えを行います。
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    port = parts.port
+    if port and not ((scheme == 'http' and port == 80) or (scheme == 'https' and port == 443)):
+        host = f"{host}:{port}"
+    path = parts.path or '/'
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in _TRACKING_PARAMS
+    ]
+    query.sort()
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+
+class ScrapeCache:
+    """
+    スクレイピング結果の2段キャッシュ
+
+    エントリは {'url', 'title', 'text', 'etag', 'last_modified', 'fetched_at'} の辞書です。
+    """
+
+    def __init__(self, path=SCRAPE_CACHE_PATH, ttl=SCRAPE_CACHE_TTL, memory_size=SCRAPE_CACHE_MEMORY_SIZE):
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'revalidated': 0,
+            'refreshed': 0,
+            'stores': 0,
+        }
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'url TEXT PRIMARY KEY, title TEXT, text TEXT, '
+            'etag TEXT, last_modified TEXT, fetched_at REAL)'
+        )
+        self._conn.execute('DELETE FROM pages WHERE fetched_at < ?', (time.time() - SCRAPE_CACHE_MAX_AGE,))
+        self._conn.commit()
+
+    def _remember(self, key, entry):
+        """メモリ上のLRUにエントリを追加します（ロック取得済みで呼ぶこと）。"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, url):
+        """
+        URLのエントリを返します。期限切れでも返すので、is_freshで鮮度を確認してください。
+        見つからない場合はNone。
+        """
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+            else:
+                row = self._conn.execute(
+                    'SELECT title, text, etag, last_modified, fetched_at FROM pages WHERE url = ?', (key,)
+                ).fetchone()
+                if row is None:
+                    self._stats['misses'] += 1
+                    return None
+                entry = {
+                    'url': url,
+                    'title': row[0],
+                    'text': row[1],
+                    'etag': row[2],
+                    'last_modified': row[3],
+                    'fetched_at': row[4],
+                }
+                self._remember(key, entry)
+                self._stats['disk_hits'] += 1
+            if not self.is_fresh(entry):
+                self._stats['stale'] += 1
+            return dict(entry)
+
+    def is_fresh(self, entry):
+        """エントリがTTL内かどうかを返します。"""
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry):
+        """再検証用の条件付きリクエストヘッダーを返します。"""
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url, title, text, etag=None, last_modified=None, revalidation=False):
+        """抽出結果を保存します。revalidation=Trueは期限切れエントリを再取得した場合です。"""
+        key = normalize_url(url)
+        entry = {
+            'url': url,
+            'title': title,
+            'text': text,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.time(),
+        }
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages (url, title, text, etag, last_modified, fetched_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, title, text, etag, last_modified, entry['fetched_at'])
+            )
+            self._conn.commit()
+            self._remember(key, entry)
+            self._stats['stores'] += 1
+            if revalidation:
+                self._stats['refreshed'] += 1
+
+    def touch(self, url):
+        """304 Not Modifiedを受け取ったエントリの取得時刻を更新します。"""
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            self._conn.execute('UPDATE pages SET fetched_at = ? WHERE url = ?', (now, key))
+            self._conn.commit()
+            if key in self._memory:
+                self._memory[key]['fetched_at'] = now
+            self._stats['revalidated'] += 1
+
+    def stats(self):
+        """ヒット・ミス・再検証の回数を返します。"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        total = hits + stats['misses']
+        stats['hit_ratio'] = hits / total if total else 0.0
+        return stats
+
+
+_scrape_cache = None
+_scrape_cache_lock = threading.Lock()
+
+
+def get_scrape_cache(create=True):
+    """
+    プロセス全体で共有するキャッシュを返します（初回呼び出し時に作成）。
+    create が False の場合は作成せず、まだ作成していなければ None を返します（メトリクスの収集用）。
+    """
+    global _scrape_cache
+    if _scrape_cache is None and create:
+        with _scrape_cache_lock:
+            if _scrape_cache is None:
+                _scrape_cache = ScrapeCache()
+    return _scrape_cache
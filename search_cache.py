@@ -0,0 +1,257 @@
+"""
+DuckDuckGo検索結果のキャッシュモジュール
+正規化したクエリをキーに検索結果をTTL付きで保存し、
+同じクエリの同時リクエストは1つの検索にまとめます（single-flight）。
+メモリ上のLRUとSQLiteの2段構成で、SQLiteのファイルは複数のプロセス（シャード）で共有できます。
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの設定（環境変数で変更可能）
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', '600'))  # 秒
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '256'))  # 件
+# 空ならSQLiteに保存せず、メモリ上だけにキャッシュする
+SEARCH_CACHE_PATH = os.getenv('SEARCH_CACHE_PATH', 'search_cache.sqlite3')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(query):
+    """
+    キャッシュキー用にクエリを正規化します。
+    全角・半角の統一（NFKC）、小文字化、空白の圧縮を行います。
+    """
+    query = unicodedata.normalize('NFKC', query)
+    return _WHITESPACE_RE.sub(' ', query).strip().lower()
+
+
+def _copy_results(results):
+    """呼び出し側で変更されてもキャッシュに影響しないように結果をコピーします。"""
+    return [dict(result) for result in results]
+
+
+class _InflightCall:
+    """スレッドから実行中の検索を待つための情報"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.results = []
+
+
+class SearchCache:
+    """
+    検索結果のTTL付きLRUキャッシュ
+
+    同じクエリの同時リクエストは、スレッド（get_or_fetch）でも
+    asyncioタスク（aget_or_fetch）でも1回の検索にまとめます。
+    空の結果（エラー時）はキャッシュしません。
+    メモリにない（または期限切れの）クエリは、他のプロセスが保存した結果もSQLiteから探します。
+    """
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, max_size=SEARCH_CACHE_SIZE, path=SEARCH_CACHE_PATH):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # メモリ上のエントリのロック。SQLiteの操作は他のプロセスのロックを待つことがあるため、別のロックで行う
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._inflight = {}
+        self._async_inflight = {}
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0}
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS searches (query TEXT PRIMARY KEY, results TEXT, stored_at REAL)'
+            )
+            self._conn.execute('DELETE FROM searches WHERE stored_at < ?', (time.time() - ttl,))
+            self._conn.commit()
+
+    def _remember(self, key, stored_at, results):
+        """メモリ上のLRUにエントリを追加します（ロック取得済みで呼ぶこと）。"""
+        self._entries[key] = (stored_at, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _get_locked(self, key):
+        """メモリ上の期限内のエントリを返します（ロック取得済みで呼ぶこと）。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, results = entry
+        if time.time() - stored_at >= self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return results
+
+    def _load_disk(self, key):
+        """
+        SQLiteから期限内のエントリを探してメモリに載せます。
+        メモリ上のエントリが期限切れの場合も、他のプロセスが更新した結果をここで読み込みます。
+        """
+        if self._conn is None:
+            return None
+        with self._db_lock:
+            row = self._conn.execute(
+                'SELECT results, stored_at FROM searches WHERE query = ? AND stored_at > ?',
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        if row is None:
+            return None
+        results = json.loads(row[0])
+        with self._lock:
+            self._remember(key, row[1], results)
+            self._stats['hits'] += 1
+            self._stats['disk_hits'] += 1
+        return results
+
+    def _put(self, key, results):
+        """空でない結果をメモリとSQLiteに保存します。"""
+        if not results:
+            return
+        stored_at = time.time()
+        results = _copy_results(results)
+        with self._lock:
+            self._remember(key, stored_at, results)
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO searches (query, results, stored_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(results, ensure_ascii=False), stored_at)
+                )
+                self._conn.commit()
+
+    def get_or_fetch(self, query, fetch):
+        """
+        キャッシュから検索結果を返し、なければfetch(query)で検索します。
+        同じクエリを別スレッドで検索中の場合はその結果を待ちます。
+        """
+        key = normalize_query(query)
+        with self._lock:
+            cached = self._get_locked(key)
+            if cached is not None:
+                self._stats['hits'] += 1
+                return _copy_results(cached)
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _InflightCall()
+                self._inflight[key] = call
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            call.event.wait()
+            return _copy_results(call.results)
+
+        try:
+            cached = self._load_disk(key)
+            if cached is not None:
+                call.results = cached
+                return _copy_results(cached)
+            with self._lock:
+                self._stats['misses'] += 1
+            call.results = fetch(query) or []
+            self._put(key, call.results)
+            return _copy_results(call.results)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+
+    async def aget_or_fetch(self, query, afetch):
+        """
+        get_or_fetchの非同期版です。afetch(query)はコルーチン関数です。
+        SQLiteの読み書きは別スレッドで行い、他のプロセスが書き込み中でもイベントループを止めません。
+        検索は独立したタスクで実行されるため、待っている呼び出しの1つが
+        キャンセルされても他の呼び出しには影響しません。
+        """
+        key = normalize_query(query)
+        with self._lock:
+            cached = self._get_locked(key)
+            if cached is not None:
+                self._stats['hits'] += 1
+                return _copy_results(cached)
+            task = self._async_inflight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._aload_or_fetch(key, query, afetch))
+                self._async_inflight[key] = task
+                task.add_done_callback(lambda t: self._finish_async(key))
+            else:
+                self._stats['coalesced'] += 1
+
+        results = await asyncio.shield(task)
+        return _copy_results(results or [])
+
+    async def _aload_or_fetch(self, key, query, afetch):
+        """SQLiteに保存された結果を探し、なければ検索して保存します（aget_or_fetch の実行中のタスク）。"""
+        try:
+            cached = await asyncio.to_thread(self._load_disk, key)
+        except sqlite3.Error as e:
+            # ファイルのロックの待ちが長すぎるなどで読めない場合は検索する
+            logger.warning("検索結果のキャッシュを読み込めませんでした: %s", e)
+            cached = None
+        if cached is not None:
+            return cached
+        with self._lock:
+            self._stats['misses'] += 1
+        results = await afetch(query)
+        try:
+            await asyncio.to_thread(self._put, key, results)
+        except sqlite3.Error as e:
+            logger.warning("検索結果をキャッシュに保存できませんでした: %s", e)
+        return results
+
+    def _finish_async(self, key):
+        """非同期検索の完了時に実行中の一覧から外します。"""
+        with self._lock:
+            self._async_inflight.pop(key, None)
+
+    def clear(self):
+        """キャッシュを空にします（SQLiteに保存した結果も削除します）。"""
+        with self._lock:
+            self._entries.clear()
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute('DELETE FROM searches')
+                self._conn.commit()
+
+    def stats(self):
+        """ヒット（うちSQLiteからの読み込み）・ミス・まとめられたリクエストの回数を返します。"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        total = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / total if total else 0.0
+        return stats
+
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache(create=True):
+    """
+    プロセス全体で共有するキャッシュを返します（初回呼び出し時に作成し、SQLiteのファイルを開く）。
+    create が False の場合は作成せず、まだ作成していなければ None を返します（メトリクスの収集用）。
+    """
+    global _search_cache
+    if _search_cache is None and create:
+        with _search_cache_lock:
+            if _search_cache is None:
+                _search_cache = SearchCache()
+    return _search_cache
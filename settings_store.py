@@ -0,0 +1,335 @@
+"""
+設定ファイルの管理モジュール
+設定の辞書をそのまま保持し、変更は少し待ってからまとめて別スレッドで保存します。
+保存は一時ファイルに書き込んでから置き換えるため、書き込み中に停止しても設定ファイルは壊れません。
+チャンネルIDのリストの設定は集合の索引で照合し、設定ファイルが外部で書き換えられたら読み込み直します。
+複数のプロセス（シャード）が同じ設定ファイルを使う場合は、ファイルをロックして
+他のプロセスの変更と項目ごとにマージしてから保存します。
+"""
+
+import os
+import json
+import atexit
+import asyncio
+import logging
+import tempfile
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを行わない
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 変更してから保存するまでの待ち時間（秒）
+SETTINGS_SAVE_DELAY = float(os.getenv('SETTINGS_SAVE_DELAY', '1.0'))
+# 設定ファイルの変更を確認する間隔（秒、0なら確認しない）
+SETTINGS_WATCH_INTERVAL = float(os.getenv('SETTINGS_WATCH_INTERVAL', '5'))
+
+
+def write_atomic(path, text):
+    """
+    テキストを一時ファイルに書き込んでから path に置き換えます。
+
+    Returns:
+        tuple: 書き込んだファイルの (更新時刻, サイズ)
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return _signature(path)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """path + '.lock' を排他ロックします（他のプロセスが保存中なら待つ）。"""
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def merge_settings(base, local, disk, set_keys=()):
+    """
+    このプロセスでの変更（base → local）を、他のプロセスが保存した設定（disk）に重ねます。
+
+    - このプロセスで変更していない項目は disk の値を使う
+    - set_keys のリストは追加・削除した要素だけを disk のリストに反映する
+    - 辞書の項目（channel_prompts など）はキーごとに同じ方法でマージする
+
+    Returns:
+        dict: マージした設定
+    """
+    result = dict(disk)
+    for key, value in local.items():
+        if key not in result:
+            result[key] = value
+        elif key in base and value == base[key]:
+            continue
+        elif key in set_keys and isinstance(value, list) and isinstance(result[key], list):
+            previous = set(base.get(key) or ())
+            added = [item for item in value if item not in previous]
+            removed = previous - set(value)
+            merged = [item for item in result[key] if item not in removed]
+            result[key] = merged + [item for item in added if item not in merged]
+        elif isinstance(value, dict) and isinstance(result[key], dict) and isinstance(base.get(key), dict):
+            result[key] = merge_settings(base[key], value, result[key])
+        else:
+            result[key] = value
+    for key in base:
+        if key not in local:
+            result.pop(key, None)
+    return result
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class SettingsStore:
+    """
+    設定ファイルと設定の辞書
+
+    Args:
+        path (str): 設定ファイルのパス
+        settings (dict): 設定の辞書（デフォルト値を入れたもの。読み込んだ値で上書きされる）
+        set_keys (tuple): 集合の索引で照合するリストの設定の名前
+        save_delay (float): 変更してから保存するまでの待ち時間（秒）
+
+    使用例:
+        store = SettingsStore('bot_settings.json', bot_settings, set_keys=('monitored_channels',))
+        store.load()
+        if store.contains('monitored_channels', channel_id): ...
+        store.add('monitored_channels', channel_id)  # 保存は save_delay 秒後にまとめて行う
+    """
+
+    def __init__(self, path, settings, set_keys=(), save_delay=SETTINGS_SAVE_DELAY):
+        self.path = path
+        self.settings = settings
+        self.set_keys = tuple(set_keys)
+        self.save_delay = save_delay
+        self._sets = {}
+        self._timer = None
+        self._dirty = False
+        self._writing = 0
+        self._write_lock = threading.Lock()
+        # 最後に読み書きした時点の設定ファイルの (更新時刻, サイズ)
+        self._signature = None
+        # 最後に読み書きした時点の設定（他のプロセスの変更とのマージに使う）
+        self._base = self._snapshot()
+        self._on_reload = None
+        self._stats = {'saves': 0, 'save_errors': 0, 'reloads': 0, 'merged': 0}
+        self._rebuild_sets()
+        atexit.register(self.flush_sync)
+
+    def _rebuild_sets(self):
+        self._sets = {key: set(self.settings.get(key) or ()) for key in self.set_keys}
+
+    def contains(self, key, value):
+        """リストの設定 key に value が含まれるかを返します。"""
+        return value in self._sets[key]
+
+    def add(self, key, value):
+        """
+        リストの設定 key に value を追加して保存を予約します。
+
+        Returns:
+            bool: 追加した場合はTrue（すでに含まれていた場合はFalse）
+        """
+        if value in self._sets[key]:
+            return False
+        self.settings[key].append(value)
+        self._sets[key].add(value)
+        self.save()
+        return True
+
+    def remove(self, key, value):
+        """
+        リストの設定 key から value を削除して保存を予約します。
+
+        Returns:
+            bool: 削除した場合はTrue（含まれていなかった場合はFalse）
+        """
+        if value not in self._sets[key]:
+            return False
+        self.settings[key].remove(value)
+        self._sets[key].discard(value)
+        self.save()
+        return True
+
+    def load(self):
+        """
+        設定ファイルを読み込んで設定の辞書を更新します（ファイルにない設定項目はそのまま残す）。
+
+        Returns:
+            bool: 読み込んだ場合はTrue（ファイルがない場合はFalse）
+
+        Raises:
+            ValueError: 設定ファイルがJSONとして読めない場合
+        """
+        signature = _signature(self.path)
+        if signature is None:
+            return False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.settings.update(data)
+        self._rebuild_sets()
+        self._signature = signature
+        self._base = self._snapshot()
+        return True
+
+    def _snapshot(self):
+        # イベントループ上でコピーしておき、書き込み中に設定が変わっても影響しないようにする
+        return json.loads(json.dumps(self.settings))
+
+    def _write(self, local):
+        """
+        他のプロセスが保存した変更とマージしてから保存します（別スレッドで実行される）。
+
+        Returns:
+            dict: 保存した設定（保存に失敗した場合は None）
+        """
+        with self._write_lock, file_lock(self.path):
+            try:
+                merged = local
+                if self.changed_on_disk():
+                    try:
+                        with open(self.path, 'r', encoding='utf-8') as f:
+                            merged = merge_settings(self._base, local, json.load(f), self.set_keys)
+                    except ValueError as e:
+                        logger.warning("設定ファイルを読めないため上書きします: %s", e)
+                self._signature = write_atomic(self.path, json.dumps(merged, indent=4, ensure_ascii=False))
+                self._base = merged
+                self._stats['saves'] += 1
+                logger.info("設定ファイルを保存しました")
+                return merged
+            except Exception as e:
+                self._stats['save_errors'] += 1
+                logger.error("設定ファイルの保存に失敗しました: %s", e)
+                return None
+
+    def _apply_merged(self, local, merged):
+        """
+        保存時にマージした他のプロセスの変更を設定の辞書に反映します。
+
+        Returns:
+            bool: 反映した項目があればTrue
+        """
+        if merged is None or merged == local:
+            return False
+        changed = False
+        for key, value in merged.items():
+            # 保存中にこのプロセスで変更した項目は次の保存に任せる
+            if local.get(key) != value and self.settings.get(key) == local.get(key):
+                self.settings[key] = value
+                changed = True
+        if changed:
+            self._rebuild_sets()
+            self._stats['merged'] += 1
+            logger.info("他のプロセスが変更した設定を読み込みました")
+        return changed
+
+    def save(self):
+        """
+        保存を予約します。save_delay 秒以内の変更はまとめて1回で保存します。
+        イベントループの外から呼ばれた場合はその場で保存します。
+        """
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync()
+            return
+        if self._timer is None:
+            self._timer = loop.call_later(self.save_delay, self._flush_later)
+
+    def _flush_later(self):
+        self._timer = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """予約中の保存があれば、イベントループをブロックせずに今すぐ保存します。"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._writing += 1
+        try:
+            local = self._snapshot()
+            merged = await asyncio.to_thread(self._write, local)
+        finally:
+            self._writing -= 1
+        if self._apply_merged(local, merged) and self._on_reload is not None:
+            try:
+                self._on_reload()
+            except Exception as e:
+                logger.error("変更された設定の反映中にエラーが発生しました: %s", e)
+
+    def flush_sync(self):
+        """予約中の保存があれば、その場で保存します（終了時に呼ばれる）。"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._dirty:
+            return
+        self._dirty = False
+        local = self._snapshot()
+        self._apply_merged(local, self._write(local))
+
+    def changed_on_disk(self):
+        """最後に読み書きしてから設定ファイルが外部で書き換えられたかを返します。"""
+        signature = _signature(self.path)
+        return signature is not None and signature != self._signature
+
+    async def watch(self, on_reload, interval=SETTINGS_WATCH_INTERVAL):
+        """
+        設定ファイルの変更を interval 秒ごとに確認し、書き換えられていたら読み込み直して on_reload() を呼びます。
+        保存待ちの変更がある間は読み込まず、次の保存で上書きします。
+        読めない内容に書き換えられた場合は現在の設定を使い続けます。
+        """
+        self._on_reload = on_reload
+        while True:
+            await asyncio.sleep(interval)
+            if self._dirty or self._writing or not self.changed_on_disk():
+                continue
+            try:
+                self.load()
+            except Exception as e:
+                # 壊れた内容を何度も読まないように、今の状態を読み込み済みとして扱う
+                self._signature = _signature(self.path)
+                logger.error("変更された設定ファイルを読み込めませんでした: %s", e)
+                continue
+            self._stats['reloads'] += 1
+            logger.info("設定ファイルの変更を読み込みました")
+            try:
+                on_reload()
+            except Exception as e:
+                logger.error("変更された設定の反映中にエラーが発生しました: %s", e)
+
+    def stats(self):
+        """保存と読み込み直しの回数を返します。"""
+        return dict(self._stats, pending=self._dirty)
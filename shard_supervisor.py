@@ -0,0 +1,241 @@
+"""
+シャードごとのボットプロセスを管理するスーパーバイザー
+Discordのシャードをいくつかのグループに分け、グループごとにボットのプロセスを起動します。
+プロセスが終了した場合は待ち時間を伸ばしながら再起動し、
+ロックファイルで同じディレクトリのスーパーバイザーが2つ起動しないようにします。
+
+設定・会話履歴・検索とスクレイピングのキャッシュは同じディレクトリのファイル（SQLite・JSON）を
+すべてのプロセスで共有します。チャンネルはいずれか1つのシャードが担当するため、
+チャンネルごとの会話履歴が複数のプロセスから同時に更新されることはありません。
+
+使い方:
+    python shard_supervisor.py [--shards auto] [--processes 2]
+
+環境変数:
+    SHARD_COUNT: シャードの総数（auto ならDiscordが推奨する数、デフォルト: auto）
+    SHARD_PROCESSES: 起動するプロセスの数（デフォルト: CPUの数とシャード数の小さい方）
+    METRICS_PORT: 設定されている場合、プロセスごとに METRICS_PORT + プロセスの番号 で公開する
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+
+import requests
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows では多重起動を防止しない
+    fcntl = None
+
+# 多重起動を防止するロックファイル
+LOCK_FILE = 'bot.lock'
+# シャードの接続（IDENTIFY）の間隔（秒）。Discordの制限に合わせてプロセスの起動をずらす
+SHARD_START_INTERVAL = 5.0
+# 再起動までの待ち時間の最大値（秒）
+MAX_RESTART_BACKOFF = 60.0
+# この時間（秒）以上動いていたプロセスは、次の再起動の待ち時間を最初からやり直す
+STABLE_SECONDS = 60.0
+# 停止時に終了を待つ時間（秒）。過ぎたら強制終了する
+STOP_TIMEOUT = 10.0
+
+
+def acquire_lock(path=LOCK_FILE):
+    """
+    ロックファイルを排他ロックし、PIDを書き込みます。
+    ロックはプロセスの終了時に自動的に解放されるため、古いロックファイルを削除する必要はありません。
+
+    Returns:
+        file: ロックしたファイル（開いたままにしておく）。すでに他のプロセスがロックしている場合は None
+    """
+    lock_file = open(path, 'a+')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+
+def recommended_shard_count(token):
+    """Discordが推奨するシャード数を返します。"""
+    response = requests.get(
+        'https://discord.com/api/v10/gateway/bot',
+        headers={'Authorization': f'Bot {token}'},
+        timeout=10
+    )
+    response.raise_for_status()
+    return int(response.json()['shards'])
+
+
+def shard_groups(shard_count, processes):
+    """
+    シャードIDを連続した範囲でプロセスの数に分けます。
+
+    Returns:
+        list: プロセスごとのシャードIDのリスト
+    """
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups, start = [], 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+class ShardProcess:
+    """
+    シャードのグループを担当する1つのボットプロセス
+
+    Args:
+        index (int): プロセスの番号
+        shard_ids (list): 担当するシャードID
+        shard_count (int): シャードの総数
+        start_at (float): 最初に起動する時刻（time.monotonic() の値）
+    """
+
+    def __init__(self, index, shard_ids, shard_count, start_at):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.start_at = start_at
+        self.process = None
+        self.started_at = None
+        self.backoff = 1.0
+        self.restarts = 0
+
+    @property
+    def label(self):
+        return f"プロセス{self.index}（シャード {self.shard_ids[0]}〜{self.shard_ids[-1]}）"
+
+    def start(self):
+        env = dict(os.environ)
+        env['SHARD_COUNT'] = str(self.shard_count)
+        env['SHARD_IDS'] = ','.join(str(shard_id) for shard_id in self.shard_ids)
+        if os.getenv('METRICS_PORT'):
+            env['METRICS_PORT'] = str(int(os.getenv('METRICS_PORT')) + self.index)
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker'], env=env)
+        self.started_at = time.monotonic()
+        print(f"{self.label} を起動しました（PID {self.process.pid}）")
+
+    def check(self, now):
+        """プロセスの状態を確認し、終了していれば再起動の時刻を決め、時刻になったら起動します。"""
+        if self.process is None:
+            if now >= self.start_at:
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            return
+        # 長く動いていた場合は一時的な障害とみなして待ち時間をやり直す
+        if now - self.started_at >= STABLE_SECONDS:
+            self.backoff = 1.0
+        print(f"{self.label} が終了しました（終了コード {code}）。{self.backoff:.0f}秒後に再起動します")
+        self.process = None
+        self.start_at = now + self.backoff
+        self.backoff = min(self.backoff * 2, MAX_RESTART_BACKOFF)
+        self.restarts += 1
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self, deadline):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            print(f"{self.label} を強制終了します")
+            self.process.kill()
+            self.process.wait()
+
+
+def supervise(groups, shard_count):
+    """プロセスを起動し、停止のシグナルを受け取るまで監視します。"""
+    now = time.monotonic()
+    shards = []
+    delay = 0.0
+    for index, shard_ids in enumerate(groups):
+        shards.append(ShardProcess(index, shard_ids, shard_count, now + delay))
+        # 前のプロセスのシャードが接続し終わる頃に次のプロセスを起動する
+        delay += len(shard_ids) * SHARD_START_INTERVAL
+
+    stopping = []
+
+    def request_stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    while not stopping:
+        now = time.monotonic()
+        for shard in shards:
+            shard.check(now)
+        time.sleep(1)
+
+    print("ボットのプロセスを停止します")
+    for shard in shards:
+        shard.stop()
+    deadline = time.monotonic() + STOP_TIMEOUT
+    for shard in shards:
+        shard.wait(deadline)
+
+
+def run_worker():
+    """担当するシャードでボットを実行します（スーパーバイザーが起動するプロセス）。"""
+    # 音声機能を無効化してからボットを読み込む
+    import disable_voice
+    import bot
+    bot.bot.run(bot.DISCORD_TOKEN)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='シャードごとのボットプロセスを管理する')
+    parser.add_argument('--shards', default=os.getenv('SHARD_COUNT', 'auto'), help='シャードの総数（auto ならDiscordの推奨値）')
+    parser.add_argument('--processes', type=int, default=int(os.getenv('SHARD_PROCESSES', '0')),
+                        help='起動するプロセスの数（0ならCPUの数）')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker()
+        return
+
+    # 作業ディレクトリをスクリプトのディレクトリにする（設定ファイルなどを共有するため）
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    load_dotenv()
+    token = os.getenv('DISCORD_TOKEN')
+    if not token:
+        print("エラー: DISCORD_TOKENが設定されていません。.envファイルを確認してください。")
+        sys.exit(1)
+
+    lock_file = acquire_lock()
+    if lock_file is None:
+        print(f"エラー: 他のスーパーバイザーが実行中です（{LOCK_FILE}）")
+        sys.exit(1)
+
+    shard_count = recommended_shard_count(token) if args.shards == 'auto' else int(args.shards)
+    processes = args.processes or os.cpu_count() or 1
+    groups = shard_groups(shard_count, processes)
+    print(f"シャード数 {shard_count} を {len(groups)} プロセスで実行します")
+    try:
+        supervise(groups, shard_count)
+    finally:
+        lock_file.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,7 @@ fi
 
 # 既存のボットプロセスを終了
 echo "既存のボットプロセスを確認しています..."
-PIDS=$(ps aux | grep python | grep -E "bot\.py|debug_bot\.py" | grep -v grep | awk '{print $2}')
+PIDS=$(ps aux | grep python | grep -E "bot\.py|debug_bot\.py|shard_supervisor\.py" | grep -v grep | awk '{print $2}')
 
 if [ -n "$PIDS" ]; then
   echo "既存のボットプロセスを終了します: $PIDS"
@@ -19,7 +19,7 @@ if [ -n "$PIDS" ]; then
   sleep 2
   
   # 強制終了が必要な場合
-  REMAINING=$(ps aux | grep python | grep -E "bot\.py|debug_bot\.py" | grep -v grep | awk '{print $2}')
+  REMAINING=$(ps aux | grep python | grep -E "bot\.py|debug_bot\.py|shard_supervisor\.py" | grep -v grep | awk '{print $2}')
   if [ -n "$REMAINING" ]; then
     echo "強制終了します: $REMAINING"
     kill -9 $REMAINING
@@ -38,7 +38,8 @@ fi
 echo "起動モードを選択してください:"
 echo "1) 通常モード (bot.py)"
 echo "2) デバッグモード - 音声機能無効 (debug_bot.py)"
-read -p "選択 (1-2, Enterで2): " choice
+echo "3) シャーディングモード - シャードごとに複数プロセスで実行 (shard_supervisor.py)"
+read -p "選択 (1-3, Enterで2): " choice
 if [ -z "$choice" ]; then
   choice=2
 fi
@@ -52,6 +53,10 @@ case $choice in
     echo "デバッグモードで起動します..."
     python debug_bot.py
     ;;
+  3|"3"|"３")
+    echo "シャーディングモードで起動します..."
+    python shard_supervisor.py
+    ;;
   *)
     echo "無効な選択です: '$choice'。デバッグモードで起動します..."
     python debug_bot.py
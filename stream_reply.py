@@ -0,0 +1,138 @@
+"""
+LLMの応答を少しずつDiscordに表示するモジュール
+生成途中のテキストでメッセージを編集し、Discordの編集回数の制限に収まるよう編集の間隔を空けます。
+2000文字を超えた分は新しいメッセージに続けて送信します。
+"""
+
+import asyncio
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Discordの1メッセージの最大文字数
+DISCORD_MAX_LENGTH = 2000
+# デフォルトの編集間隔（秒）
+DEFAULT_EDIT_INTERVAL = 1.0
+# プレースホルダーなしの場合、最初に送信するまでにためる文字数
+# （「なし」などの応答しない合図を表示してしまわないようにする）
+HOLD_CHARS = 20
+
+
+def split_for_discord(text, max_length=DISCORD_MAX_LENGTH):
+    """
+    テキストを1メッセージに収まる先頭部分と残りに分けます。
+    できるだけ改行の位置で分割します。
+
+    Returns:
+        tuple: (先頭部分, 残り)
+    """
+    if len(text) <= max_length:
+        return text, ''
+    cut = text.rfind('\n', 0, max_length)
+    if cut < max_length // 2:
+        cut = max_length
+    return text[:cut], text[cut:].lstrip('\n')
+
+
+class StreamingReply:
+    """
+    生成途中のテキストでメッセージを編集しながら応答を送信するクラス
+
+    Args:
+        channel: 送信先のチャンネル（send を持つオブジェクト）
+        placeholder (str): 最初に送信しておく仮のテキスト（Noneなら最初のテキストがたまってから送信する）
+        edit_interval (float): メッセージを編集する最小間隔（秒）
+
+    使用例:
+        reply = StreamingReply(channel, placeholder='考え中...')
+        await reply.start()
+        async for text in stream:
+            await reply.feed(text)
+        await reply.finish()
+    """
+
+    def __init__(self, channel, placeholder=None, edit_interval=DEFAULT_EDIT_INTERVAL):
+        self.channel = channel
+        self.placeholder = placeholder
+        self.edit_interval = edit_interval
+        self.text = ''
+        self.messages = []  # 送信したメッセージ
+        self._current = None  # 編集中のメッセージ
+        self._sent = ''  # 確定済み（前のメッセージに表示済み）のテキスト
+        self._shown = None  # 編集中のメッセージに表示しているテキスト
+        self._last_edit = 0.0
+
+    async def start(self):
+        """プレースホルダーを送信します。"""
+        if self.placeholder:
+            with metrics.timed(metrics.STAGE_SEND):
+                self._current = await self.channel.send(self.placeholder)
+            self.messages.append(self._current)
+            self._shown = self.placeholder
+
+    async def feed(self, chunk):
+        """生成されたテキストを追加し、前回の編集から間隔が空いていれば表示を更新します。"""
+        self.text += chunk
+        if not self.messages and len(self.text.strip()) < HOLD_CHARS:
+            return
+        now = asyncio.get_running_loop().time()
+        if now - self._last_edit >= self.edit_interval:
+            await self._render()
+            self._last_edit = now
+
+    async def finish(self, text=None):
+        """
+        最終的なテキストを表示します。
+
+        Args:
+            text (str): 最終的なテキスト（省略時はこれまでに追加されたテキスト）
+                        2000文字を超えて次のメッセージに続けた後は、表示済みの部分から始まるテキストだけを指定できる
+
+        Returns:
+            str: 最終的なテキスト
+        """
+        if text is not None:
+            if not text.startswith(self._sent):
+                raise ValueError("表示済みのメッセージと異なるテキストは指定できません")
+            self.text = text
+        await self._render()
+        return self.text
+
+    async def discard(self):
+        """送信したメッセージを削除します（応答しないことになった場合）。"""
+        for message in self.messages:
+            try:
+                await message.delete()
+            except Exception as e:
+                logger.warning("メッセージの削除に失敗しました: %s", e)
+        self.messages = []
+        self._current = None
+
+    async def _render(self):
+        # 確定済みの部分を除いたテキストを2000文字ごとのメッセージに分けて表示する
+        pending = self.text[len(self._sent):]
+        while True:
+            head, rest = split_for_discord(pending)
+            if not rest:
+                break
+            await self._show(head)
+            # 2000文字を超えた分は新しいメッセージに続ける
+            self._sent = self.text[:len(self.text) - len(rest)]
+            self._current = None
+            self._shown = None
+            pending = rest
+        await self._show(pending)
+
+    async def _show(self, content):
+        content = content.strip()
+        if not content or content == self._shown:
+            return
+        with metrics.timed(metrics.STAGE_SEND):
+            if self._current is not None:
+                await self._current.edit(content=content)
+            else:
+                self._current = await self.channel.send(content)
+                self.messages.append(self._current)
+        self._shown = content
@@ -0,0 +1,111 @@
+"""
+stream_reply.StreamingReply のテスト
+Discordのチャンネルの代わりに、送信・編集・削除を記録するだけのチャンネルを使います。
+"""
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream_reply import StreamingReply, DISCORD_MAX_LENGTH
+
+
+class FakeMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+        self.deleted = False
+
+    async def edit(self, content):
+        assert len(content) <= DISCORD_MAX_LENGTH
+        self.content = content
+
+    async def delete(self):
+        self.deleted = True
+        self.channel.messages.remove(self)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, content):
+        assert len(content) <= DISCORD_MAX_LENGTH
+        message = FakeMessage(self, content)
+        self.messages.append(message)
+        return message
+
+
+def stream(reply, text, chunk_size):
+    async def run():
+        await reply.start()
+        for i in range(0, len(text), chunk_size):
+            await reply.feed(text[i:i + chunk_size])
+        return await reply.finish()
+    return asyncio.run(run())
+
+
+def without_spaces(text):
+    return ''.join(text.split())
+
+
+def words(count):
+    return ' '.join(f"word{i}" for i in range(count))
+
+
+@pytest.mark.parametrize('prefix', ['', '\n\n', '  \n'])
+@pytest.mark.parametrize('chunk_size', [1, 7, 200])
+def test_long_reply_is_split_without_losing_text(prefix, chunk_size):
+    # 2000文字を超える応答は、先頭の空白があっても文字を落とさず・重複させずに複数のメッセージに分ける
+    text = prefix + words(450)
+    assert len(text) > DISCORD_MAX_LENGTH
+    channel = FakeChannel()
+    reply = StreamingReply(channel, placeholder='考え中...', edit_interval=0)
+
+    stream(reply, text, chunk_size)
+
+    # 単語の途中で分けることがあるため、空白を除いてつなげた内容を比べる
+    assert len(channel.messages) == 2
+    assert without_spaces(''.join(message.content for message in channel.messages)) == without_spaces(text)
+
+
+def test_long_reply_with_newlines_splits_on_line_break():
+    lines = [f"{i}行目の内容です。" * 5 for i in range(60)]
+    text = '\n'.join(lines)
+    channel = FakeChannel()
+    reply = StreamingReply(channel, edit_interval=0)
+
+    stream(reply, text, 50)
+
+    assert len(channel.messages) >= 2
+    assert '\n'.join(message.content for message in channel.messages).split('\n') == lines
+
+
+def test_finish_rejects_text_that_changes_sent_messages():
+    channel = FakeChannel()
+    reply = StreamingReply(channel, edit_interval=0)
+    text = '\n\n' + words(450)
+
+    async def run():
+        await reply.feed(text)
+        await reply.finish(text.strip())
+
+    with pytest.raises(ValueError):
+        asyncio.run(run())
+
+
+def test_discard_deletes_placeholder_and_partial_messages():
+    channel = FakeChannel()
+    reply = StreamingReply(channel, placeholder='考え中...', edit_interval=0)
+
+    async def run():
+        await reply.start()
+        await reply.feed(words(450))
+        await reply.discard()
+
+    asyncio.run(run())
+    assert channel.messages == []
@@ -0,0 +1,44 @@
+"""
+ローカルで動作する簡易トークン数推定モジュール
+tiktokenを使わずに、日本語（CJK文字）は1文字≒1トークン、
+それ以外は4文字≒1トークンとして概算します。
+"""
+
+import re
+
+# ひらがな・カタカナ・漢字・全角記号など、1文字で約1トークンになる文字
+_WIDE_CHARS_RE = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """
+    テキストのトークン数を概算します。
+
+    Args:
+        text (str): 対象のテキスト
+
+    Returns:
+        int: 推定トークン数
+    """
+    if not text:
+        return 0
+    wide = len(_WIDE_CHARS_RE.findall(text))
+    narrow = len(text) - wide
+    return wide + (narrow + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    推定トークン数がmax_tokens以下になるようにテキストの先頭部分を返します。
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分探索で収まる最大の長さを求める
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
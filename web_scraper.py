@@ -1,16 +1,30 @@
 """
 Webスクレイピング機能を提供するモジュール
 検索結果のURLからコンテンツを取得し、テキストを抽出します。
+各URLは1回だけダウンロードし、1つのlxmlツリーにパースして
+trafilatura・タイトル/メタ情報の取得・フォールバック抽出で共有します。
+タイムアウトはドメインごとの応答時間から決め、最近失敗したドメイン・URLは取得を省略します（domain_health）。
 """
 
+import os
+import time
+import asyncio
 import requests
 import logging
-from bs4 import BeautifulSoup
+import weakref
+import httpx
 import trafilatura
+from collections import namedtuple
+from trafilatura.utils import load_html
 from urllib.parse import urlparse
+from scrape_cache import ScrapeCache, get_scrape_cache, SCRAPE_CACHE_ENABLED
+from http_pool import get_async_client, get_session
+from extract_pool import get_extract_pool, ExtractError, PageExtractError
+from domain_health import (domain_health, failure_for_status, FAILURE_TIMEOUT, FAILURE_CONNECT, FAILURE_HTTP,
+                           FAILURE_EMPTY)
+import metrics
 
-# ロギング設定
-logging.basicConfig(level=logging.INFO)
+# ロギングの設定（ハンドラーと出力レベル）は呼び出し側（bot.py の LOG_LEVEL）で行う
 logger = logging.getLogger(__name__)
 
 # ユーザーエージェントの設定
@@ -18,19 +32,316 @@ HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
     'Accept-Language': 'ja,en-US;q=0.7,en;q=0.3',
-    'Connection': 'keep-alive',
     'Upgrade-Insecure-Requests': '1',
     'Cache-Control': 'max-age=0',
 }
 
-def scrape_url(url, max_length=3000):
+# 非同期スクレイピングの同時実行数の上限（全体・ドメインごと）
+MAX_CONCURRENT_SCRAPES = 8
+MAX_CONCURRENT_PER_DOMAIN = 2
+# 1URLあたりのタイムアウトの上限（秒）。実際のタイムアウトはドメインの応答時間から決める
+SCRAPE_TIMEOUT = 10
+# ダウンロードするページサイズの上限（バイト）。超えた時点で取得を中止する
+MAX_DOWNLOAD_BYTES = int(os.getenv('SCRAPE_MAX_DOWNLOAD_BYTES', str(2 * 1024 * 1024)))
+# ダウンロード時の読み込み単位（バイト）
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# キャッシュにはこの文字数まで保存し、返すときに要求された文字数に切り詰める
+CACHE_TEXT_LENGTH = 10000
+
+# trafilaturaが失敗した場合に探す一般的なコンテンツエリア（この順序で探す）
+CONTENT_XPATHS = [
+    '//article',
+    '//main',
+    '//div[@role="main"]',
+    '//*[contains(concat(" ", normalize-space(@class), " "), " content ")]',
+    '//*[@id="content"]',
+    '//*[contains(concat(" ", normalize-space(@class), " "), " main ")]',
+    '//*[@id="main"]',
+]
+# フォールバック抽出で除外する要素
+BOILERPLATE_XPATH = './/script|.//style|.//nav|.//footer|.//header|.//aside'
+
+# プロセス全体で共有するセマフォ（ドメインごとのセマフォは使用中のものだけを保持）
+_global_scrape_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SCRAPES)
+_domain_semaphores = weakref.WeakValueDictionary()
+
+# ダウンロード結果（not_modified=Trueは条件付きリクエストに304が返った場合）
+_Download = namedtuple('_Download', ['body', 'encoding', 'headers', 'not_modified'])
+
+
+class DownloadRejected(Exception):
+    """サイズ超過やHTML以外のコンテンツのためにダウンロードを中止した場合の例外"""
+
+
+class DownloadSkipped(Exception):
+    """最近失敗したドメイン・URLのためにダウンロードを省略した場合の例外"""
+
+
+def _new_result(url):
+    """スクレイピング結果の辞書を初期化します。"""
+    return {
+        'title': '',
+        'text': '',
+        'url': url,
+        'success': False,
+        'error': None
+    }
+
+
+def _charset_from_headers(headers):
+    """Content-Typeヘッダーで明示された文字コードを返します（なければNone）。"""
+    content_type = headers.get('Content-Type', '')
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key.lower() == 'charset' and value:
+            return value.strip('"\' ')
+    return None
+
+
+def _check_response_headers(headers):
+    """
+    本文を読み込む前にレスポンスヘッダーを確認し、
+    HTML以外のコンテンツや明らかにサイズ上限を超えるページは中止します。
+    """
+    content_type = headers.get('Content-Type', '').lower()
+    if content_type and 'html' not in content_type and 'xml' not in content_type:
+        raise DownloadRejected(f"HTMLではないコンテンツです: {content_type}")
+    content_length = headers.get('Content-Length')
+    if content_length and content_length.isdigit() and int(content_length) > MAX_DOWNLOAD_BYTES:
+        raise DownloadRejected(f"ページサイズが上限を超えています: {content_length} bytes")
+
+
+def _append_chunk(chunks, size, chunk):
+    """読み込んだチャンクを追加し、サイズ上限を超えたら中止します。"""
+    size += len(chunk)
+    if size > MAX_DOWNLOAD_BYTES:
+        raise DownloadRejected(f"ページサイズが上限({MAX_DOWNLOAD_BYTES} bytes)を超えたため取得を中止しました")
+    chunks.append(chunk)
+    return size
+
+
+def _download(url, request_headers=None, timeout=SCRAPE_TIMEOUT):
+    """
+    URLをストリーミングでダウンロードします。
+    request_headersに条件付きヘッダーを指定した場合、304ならnot_modified=Trueを返します。
+    """
+    headers = {**HEADERS, **(request_headers or {})}
+    with get_session().get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304 and request_headers:
+            return _Download(b'', None, response.headers, True)
+        response.raise_for_status()
+        _check_response_headers(response.headers)
+        chunks, size = [], 0
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            size = _append_chunk(chunks, size, chunk)
+        return _Download(b''.join(chunks), _charset_from_headers(response.headers), response.headers, False)
+
+
+async def _adownload(client, url, request_headers=None, timeout=SCRAPE_TIMEOUT):
+    """_downloadの非同期版です。"""
+    headers = {**HEADERS, **(request_headers or {})}
+    async with client.stream('GET', url, headers=headers, timeout=timeout) as response:
+        if response.status_code == 304 and request_headers:
+            return _Download(b'', None, response.headers, True)
+        response.raise_for_status()
+        _check_response_headers(response.headers)
+        chunks, size = [], 0
+        async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+            size = _append_chunk(chunks, size, chunk)
+        return _Download(b''.join(chunks), _charset_from_headers(response.headers), response.headers, False)
+
+
+def _extract_with_selectors(tree, description, result, max_length):
+    """
+    一般的なコンテンツエリアからテキストを抽出し、resultに書き込みます。
+    trafilaturaで本文を抽出できなかった場合のフォールバックです。
+    """
+    # 本文コンテンツを取得
+    # 一般的なコンテンツエリアを探す
+    content_tags = []
+    for xpath in CONTENT_XPATHS:
+        content_tags.extend(tree.xpath(xpath))
+    
+    # コンテンツが見つからない場合は、body全体を使用
+    if not content_tags:
+        body = tree.find('.//body')
+        if body is not None:
+            content_tags = [body]
+    
+    # テキストを抽出
+    texts = []
+    for tag in content_tags:
+        # 不要な要素を除外
+        for element in tag.xpath(BOILERPLATE_XPATH):
+            element.drop_tree()
+        
+        # テキストを取得
+        text = '\n'.join(part.strip() for part in tag.xpath('.//text()') if part.strip())
+        if text:
+            texts.append(text)
+    
+    # 結果を結合
+    if description:
+        texts.insert(0, description)
+    
+    combined_text = '\n\n'.join(texts)
+    result['text'] = combined_text[:max_length]
+    result['success'] = True if combined_text else False
+    
+    if not result['success']:
+        result['error'] = "コンテンツを抽出できませんでした"
+    return result
+
+
+def _extract_from_document(download, url, max_length=3000):
+    """
+    ダウンロードしたページを1回だけパースし、タイトルと本文を抽出します。
+    trafilaturaで抽出できない場合は同じツリーからフォールバック抽出します。
+    """
+    result = _new_result(url)
+    
+    html = download.body
+    if download.encoding:
+        try:
+            html = html.decode(download.encoding, errors='replace')
+        except LookupError:
+            pass  # 不明な文字コードはtrafilaturaの自動判定に任せる
+    tree = load_html(html)
+    if tree is None:
+        result['error'] = "HTMLを解析できませんでした"
+        return result
+    
+    # タイトルとメタ説明を取得
+    title = tree.findtext('.//title')
+    result['title'] = title.strip() if title else ''
+    descriptions = tree.xpath('//meta[@name="description"]/@content')
+    description = descriptions[0].strip() if descriptions else ''
+    
+    # メインコンテンツを抽出（trafilaturaは内部でツリーをコピーして処理する）
+    text = trafilatura.extract(tree, include_comments=False, include_tables=True)
+    if text:
+        result['text'] = text[:max_length]
+        result['success'] = True
+        return result
+    
+    logger.debug("Trafilatura failed, falling back to content selectors for %s", url)
+    return _extract_with_selectors(tree, description, result, max_length)
+
+
+async def _aextract_from_document(download, url, max_length):
+    """
+    _extract_from_documentの非同期版です。
+    本文抽出はCPUバウンドでGILを保持するため、プロセスプール（EXTRACT_PROCESSES=0の場合はスレッド）で実行します。
+    """
+    pool = get_extract_pool()
+    if pool is None:
+        return await asyncio.to_thread(_extract_from_document, download, url, max_length)
+    return await pool.extract(download.body, download.encoding, url, max_length)
+
+
+def _result_from_cache(entry, url, max_length):
+    """
+    キャッシュのエントリからスクレイピング結果の辞書を作成します。
+    エントリは正規化したURLで共有されるため、結果のURLには要求されたURLをそのまま使います。
+    """
+    result = _new_result(url)
+    result['title'] = entry['title']
+    result['text'] = entry['text'][:max_length]
+    result['success'] = True
+    return result
+
+
+def _truncate_result(result, max_length):
+    """結果のテキストを最大文字数に切り詰めます。"""
+    result['text'] = result['text'][:max_length]
+    return result
+
+
+def _store_result(cache, result, headers=None, revalidation=False):
+    """成功した抽出結果を検証用ヘッダー（ETag/Last-Modified）と一緒にキャッシュに保存します。"""
+    if not result['success']:
+        return
+    headers = headers or {}
+    cache.put(
+        result['url'],
+        result['title'],
+        result['text'],
+        etag=headers.get('ETag'),
+        last_modified=headers.get('Last-Modified'),
+        revalidation=revalidation
+    )
+
+
+def _fetch_and_extract(url, max_length, request_headers=None):
+    """
+    URLをダウンロードして本文を抽出します。
+    
+    Returns:
+        tuple: (結果の辞書, レスポンスヘッダー)。条件付きリクエストに304が返った場合、結果はNone
+    """
+    result = _new_result(url)
+    
+    try:
+        # 最近失敗したドメイン・URLは取得を省略する
+        skip_reason = domain_health.skip_reason(url)
+        if skip_reason:
+            raise DownloadSkipped(skip_reason)
+        
+        # URLのドメインを確認
+        domain = urlparse(url).netloc
+        logger.debug("Scraping URL: %s (domain: %s)", url, domain)
+        
+        started = time.perf_counter()
+        download = _download(url, request_headers, domain_health.timeout_for(url, SCRAPE_TIMEOUT))
+        elapsed = time.perf_counter() - started
+        if download.not_modified:
+            domain_health.record_success(url, elapsed)
+            return None, download.headers
+        result = _extract_from_document(download, url, max_length)
+        domain_health.record_success(url, elapsed, extracted=result['success'])
+        return result, download.headers
+    except DownloadSkipped as e:
+        logger.debug("Skipped %s: %s", url, str(e))
+        result['error'] = str(e)
+    except DownloadRejected as e:
+        logger.info("Download rejected for %s: %s", url, e)
+        domain_health.record_failure(url, FAILURE_EMPTY, str(e))
+        result['error'] = str(e)
+    except requests.exceptions.RequestException as e:
+        logger.error("Request error for %s: %s", url, e)
+        domain_health.record_failure(url, _request_failure(e), str(e))
+        result['error'] = f"リクエストエラー: {str(e)}"
+    except Exception as e:
+        logger.error("Error scraping %s: %s", url, e)
+        result['error'] = f"スクレイピングエラー: {str(e)}"
+    
+    return result, {}
+
+
+def _request_failure(error):
+    """requests・httpxの例外に対応する失敗の種類（domain_health の FAILURE_*）を返します。"""
+    # asyncio.TimeoutError は Python 3.10 以前では組み込みの TimeoutError と別のクラス
+    if isinstance(error, (requests.exceptions.Timeout, httpx.TimeoutException, asyncio.TimeoutError, TimeoutError)):
+        return FAILURE_TIMEOUT
+    response = getattr(error, 'response', None)
+    if isinstance(error, (requests.exceptions.HTTPError, httpx.HTTPStatusError)) and response is not None:
+        return failure_for_status(response.status_code)
+    if isinstance(error, (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema,
+                          requests.exceptions.InvalidSchema, httpx.UnsupportedProtocol)):
+        return FAILURE_HTTP
+    return FAILURE_CONNECT
+
+
+def scrape_url(url, max_length=3000, use_cache=True):
     """
     URLからテキストコンテンツをスクレイピングします。
     
     Args:
         url (str): スクレイピングするURL
         max_length (int): 返すテキストの最大文字数
-        
+        use_cache (bool): スクレイピング結果のキャッシュを使用するか
+    
     Returns:
         dict: {
             'title': ページタイトル,
@@ -40,126 +351,226 @@ def scrape_url(url, max_length=3000):
             'error': エラーメッセージ(失敗時)
         }
     """
-    result = {
-        'title': '',
-        'text': '',
-        'url': url,
-        'success': False,
-        'error': None
-    }
+    cache = get_scrape_cache() if use_cache and SCRAPE_CACHE_ENABLED else None
+    if cache is None:
+        result, _ = _fetch_and_extract(url, max_length)
+        return result
     
-    try:
-        # URLのドメインを確認
-        domain = urlparse(url).netloc
-        logger.info(f"Scraping URL: {url} (domain: {domain})")
-        
-        # trafilaturaを使用してコンテンツを取得
-        downloaded = trafilatura.fetch_url(url)
-        if downloaded:
-            # メインコンテンツを抽出
-            text = trafilatura.extract(downloaded, include_comments=False, include_tables=True)
-            if text:
-                result['text'] = text[:max_length]
-                result['success'] = True
-                
-                # タイトルを取得するためにBeautifulSoupも使用
-                soup = BeautifulSoup(downloaded, 'lxml')
-                title_tag = soup.find('title')
-                if title_tag:
-                    result['title'] = title_tag.text.strip()
-                return result
-        
-        # trafilaturaが失敗した場合は、通常のRequests + BeautifulSoupを使用
-        logger.info(f"Trafilatura failed, trying with BeautifulSoup for {url}")
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'lxml')
-        
-        # タイトルを取得
-        title_tag = soup.find('title')
-        if title_tag:
-            result['title'] = title_tag.text.strip()
-        
-        # メタ説明を取得
-        meta_desc = soup.find('meta', attrs={'name': 'description'})
-        description = meta_desc['content'] if meta_desc and 'content' in meta_desc.attrs else ''
-        
-        # 本文コンテンツを取得
-        # 一般的なコンテンツエリアを探す
-        content_tags = []
-        for tag in ['article', 'main', 'div[role="main"]', '.content', '#content', '.main', '#main']:
-            if tag.startswith('.'):
-                elements = soup.select(tag)
-            elif tag.startswith('#'):
-                elements = soup.select(tag)
-            else:
-                elements = soup.find_all(tag)
-            content_tags.extend(elements)
-        
-        # コンテンツが見つからない場合は、body全体を使用
-        if not content_tags and soup.body:
-            content_tags = [soup.body]
-        
-        # テキストを抽出
-        texts = []
-        for tag in content_tags:
-            # 不要な要素を除外
-            for s in tag.select('script, style, nav, footer, header, aside'):
-                s.extract()
-            
-            # テキストを取得
-            text = tag.get_text(separator='\n', strip=True)
-            if text:
-                texts.append(text)
-        
-        # 結果を結合
-        if description:
-            texts.insert(0, description)
-        
-        combined_text = '\n\n'.join(texts)
-        result['text'] = combined_text[:max_length]
-        result['success'] = True if combined_text else False
-        
-        if not result['success']:
-            result['error'] = "コンテンツを抽出できませんでした"
-            
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request error for {url}: {str(e)}")
-        result['error'] = f"リクエストエラー: {str(e)}"
-    except Exception as e:
-        logger.error(f"Error scraping {url}: {str(e)}")
-        result['error'] = f"スクレイピングエラー: {str(e)}"
+    entry = cache.get(url)
+    if entry is not None and cache.is_fresh(entry):
+        return _result_from_cache(entry, url, max_length)
     
-    return result
+    # キャッシュ用に長めに抽出し、返すときに切り詰める
+    # 期限切れのエントリがあれば条件付きリクエストで再検証
+    extract_length = max(max_length, CACHE_TEXT_LENGTH)
+    result, headers = _fetch_and_extract(url, extract_length, ScrapeCache.conditional_headers(entry))
+    if result is None:
+        cache.touch(url)
+        return _result_from_cache(entry, url, max_length)
+    
+    _store_result(cache, result, headers, revalidation=entry is not None)
+    if not result['success'] and entry is not None:
+        # 再取得に失敗した場合は期限切れのキャッシュを返す
+        return _result_from_cache(entry, url, max_length)
+    return _truncate_result(result, max_length)
+
+
+def select_scrape_urls(urls, max_urls):
+    """
+    スクレイピングするURLを選びます。
+    最近失敗したドメイン・URLは後回しにして先頭からmax_urls件を選び、
+    残りの（失敗していない）URLは取得に失敗したときの代わりにします。
+    
+    Returns:
+        tuple: (取得するURLのリスト, 代わりに取得するURLのリスト)
+    """
+    urls = list(dict.fromkeys(urls))
+    healthy = [url for url in urls if domain_health.is_healthy(url)]
+    healthy_set = set(healthy)
+    known_bad = [url for url in urls if url not in healthy_set]
+    return (healthy + known_bad)[:max_urls], healthy[max_urls:]
 
 
 def scrape_multiple_urls(urls, max_urls=3, max_length_per_url=2000):
     """
     複数のURLをスクレイピングし、結果を結合します。
+    max_urls件を超えるURLは、取得に失敗したURLの代わりに使います。
     
     Args:
-        urls (list): スクレイピングするURLのリスト
+        urls (list): スクレイピングするURLのリスト（検索結果の順）
         max_urls (int): 処理するURLの最大数
         max_length_per_url (int): URLごとの最大文字数
-        
+    
     Returns:
-        list: スクレイピング結果のリスト
+        list: スクレイピング結果のリスト（代わりに取得したURLの結果は失敗したURLの位置に入る）
     """
     results = []
     
-    # 最大URL数を制限
-    urls = urls[:max_urls]
+    # 最大URL数を制限（最近失敗したURLは後回しにする）
+    urls, backups = select_scrape_urls(urls, max_urls)
     
     for url in urls:
         result = scrape_url(url, max_length=max_length_per_url)
+        # 取得できなかった場合は代わりのURLを取得する
+        while not result['success'] and backups:
+            result = scrape_url(backups.pop(0), max_length=max_length_per_url)
         results.append(result)
     
     return results
 
 
+def _domain_semaphore(domain):
+    """ドメインごとの同時接続数を制限するセマフォを返します。"""
+    semaphore = _domain_semaphores.get(domain)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_PER_DOMAIN)
+        _domain_semaphores[domain] = semaphore
+    return semaphore
+
+
+async def async_scrape_url(url, max_length=3000, client=None, use_cache=True):
+    """
+    scrape_urlの非同期版です。
+    httpxでページを取得し、CPU負荷の高い本文抽出は別プロセス（extract_pool）で実行するため、
+    イベントループをブロックしません。
+    
+    Args:
+        url (str): スクレイピングするURL
+        max_length (int): 返すテキストの最大文字数
+        client (httpx.AsyncClient): 使用するHTTPクライアント（省略時は共有の接続プール）
+        use_cache (bool): スクレイピング結果のキャッシュを使用するか
+    
+    Returns:
+        dict: scrape_urlと同じ形式の結果
+    """
+    result = _new_result(url)
+    domain = urlparse(url).netloc
+    cache = get_scrape_cache() if use_cache and SCRAPE_CACHE_ENABLED else None
+    entry = None
+    extract_length = max_length
+    
+    try:
+        if cache is not None:
+            entry = await asyncio.to_thread(cache.get, url)
+            if entry is not None and cache.is_fresh(entry):
+                return _result_from_cache(entry, url, max_length)
+            extract_length = max(max_length, CACHE_TEXT_LENGTH)
+        # 最近失敗したドメイン・URLは取得を省略する（期限切れのキャッシュがあればそれを返す）
+        skip_reason = domain_health.skip_reason(url)
+        if skip_reason:
+            raise DownloadSkipped(skip_reason)
+        # 期限切れのエントリがあれば条件付きリクエストで再検証
+        request_headers = ScrapeCache.conditional_headers(entry)
+        
+        # キャッシュにない（または再検証が必要な）ページの取得と本文抽出の処理時間を記録する
+        with metrics.timed(metrics.STAGE_SCRAPE):
+            async with _global_scrape_semaphore, _domain_semaphore(domain):
+                logger.debug("Scraping URL (async): %s (domain: %s)", url, domain)
+                # タイムアウトはドメインの応答時間から決め、ダウンロード全体の制限時間にする
+                timeout = domain_health.timeout_for(url, SCRAPE_TIMEOUT)
+                started = time.perf_counter()
+                download = await asyncio.wait_for(
+                    _adownload(client or get_async_client(), url, request_headers, timeout), timeout
+                )
+                elapsed = time.perf_counter() - started
+            if download.not_modified:
+                domain_health.record_success(url, elapsed)
+                await asyncio.to_thread(cache.touch, url)
+                return _result_from_cache(entry, url, max_length)
+            
+            # 本文抽出はCPUバウンドなので別プロセスで実行（制限時間を超えた場合は ExtractError）
+            result = await _aextract_from_document(download, url, extract_length)
+            domain_health.record_success(url, elapsed, extracted=result['success'])
+        if cache is not None:
+            await asyncio.to_thread(_store_result, cache, result, download.headers, entry is not None)
+        if result['success'] or entry is None:
+            return _truncate_result(result, max_length)
+    except DownloadSkipped as e:
+        logger.debug("Skipped %s: %s", url, str(e))
+        result['error'] = str(e)
+    except DownloadRejected as e:
+        logger.info("Download rejected for %s: %s", url, e)
+        domain_health.record_failure(url, FAILURE_EMPTY, str(e))
+        result['error'] = str(e)
+    except PageExtractError as e:
+        domain_health.record_failure(url, FAILURE_EMPTY, str(e))
+        result['error'] = f"スクレイピングエラー: {str(e)}"
+    except ExtractError as e:
+        # 抽出プロセスの起動の失敗・異常終了などはページの問題ではないため、ドメインの状態には記録しない
+        logger.warning("Extraction failed for %s: %s", url, e)
+        result['error'] = f"スクレイピングエラー: {str(e)}"
+    except (httpx.HTTPError, asyncio.TimeoutError, TimeoutError) as e:
+        logger.error("Request error for %s: %s", url, str(e) or type(e).__name__)
+        domain_health.record_failure(url, _request_failure(e), str(e) or 'タイムアウト')
+        result['error'] = f"リクエストエラー: {str(e) or 'タイムアウト'}"
+    except Exception as e:
+        logger.error("Error scraping %s: %s", url, e)
+        result['error'] = f"スクレイピングエラー: {str(e)}"
+    
+    if entry is not None:
+        # 再取得に失敗した場合は期限切れのキャッシュを返す
+        return _result_from_cache(entry, url, max_length)
+    return result
+
+
+async def async_scrape_multiple_urls(urls, max_urls=3, max_length_per_url=2000, timeout=None):
+    """
+    複数のURLを並行してスクレイピングします。
+    max_urls件を超えるURLは、取得に失敗したURLの代わりに（制限時間内であれば）取得します。
+    timeoutを指定した場合、その時間内に完了したページの結果だけを返し、
+    間に合わなかったURLは success=False の結果になります。
+    
+    Args:
+        urls (list): スクレイピングするURLのリスト（検索結果の順）
+        max_urls (int): 処理するURLの最大数
+        max_length_per_url (int): URLごとの最大文字数
+        timeout (float): 全体の制限時間（秒）。Noneの場合は無制限
+    
+    Returns:
+        list: スクレイピング結果のリスト（代わりに取得したURLの結果は失敗したURLの位置に入る）
+    """
+    urls, backups = select_scrape_urls(urls, max_urls)
+    if not urls:
+        return []
+    
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    results = [None] * len(urls)
+    # 実行中のタスク → 結果を入れる位置
+    slots = {asyncio.create_task(async_scrape_url(url, max_length=max_length_per_url)): index
+             for index, url in enumerate(urls)}
+    while slots:
+        remaining = None if deadline is None else deadline - loop.time()
+        if remaining is not None and remaining <= 0:
+            break
+        done, _ = await asyncio.wait(slots, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            index = slots.pop(task)
+            if task.exception() is None:
+                results[index] = task.result()
+            if (results[index] is None or not results[index]['success']) and backups:
+                # 取得できなかった場合は代わりのURLを取得する
+                backup = backups.pop(0)
+                logger.debug("Scraping backup URL %s instead of %s", backup, urls[index])
+                slots[asyncio.create_task(async_scrape_url(backup, max_length=max_length_per_url))] = index
+    
+    # 制限時間に間に合わなかったタスクはキャンセル
+    for task in slots:
+        task.cancel()
+    if slots:
+        await asyncio.gather(*slots, return_exceptions=True)
+    
+    for index, url in enumerate(urls):
+        if results[index] is None:
+            result = _new_result(url)
+            result['error'] = "制限時間内に取得できませんでした"
+            results[index] = result
+    return results
+
+
 # テスト用コード
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     test_url = "https://news.yahoo.co.jp/"
     result = scrape_url(test_url)
     if result['success']:
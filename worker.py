@@ -0,0 +1,227 @@
+"""
+検索・スクレイピング・LLM呼び出しを実行するワーカープロセス
+BOT_ROLE=gateway で起動したボット（ゲートウェイ）がジョブキューに追加したジョブを取り出し、
+bot.py と同じ処理（handle_search / respond_to_messages / answer_question）で実行します。
+Discordへの送信・編集・削除はジョブキューのイベントとして書き込み、ゲートウェイが反映します。
+
+ワーカーはゲートウェイとは別に、必要な数だけ起動できます（同じディレクトリのジョブキュー・設定・会話履歴を共有します）。
+実行中のジョブはリースを更新し続け、ワーカーが停止した場合は他のワーカーがやり直します。
+
+使い方:
+    python worker.py [--concurrency 4] [--name worker-1]
+"""
+
+import os
+import sys
+import socket
+import asyncio
+import argparse
+import datetime
+import logging
+import itertools
+
+# .env に BOT_ROLE=gateway があってもワーカーとして読み込む
+os.environ['BOT_ROLE'] = 'worker'
+
+# 音声機能を無効化してからボットのモジュールを読み込む
+import disable_voice
+import bot
+from job_queue import (JobQueue, JOB_POLL_INTERVAL, JOB_SEARCH, JOB_RESPOND, JOB_ASK, EVENT_SEND, EVENT_EDIT,
+                       EVENT_DELETE, EVENT_TYPING, EVENT_RESET)
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteAuthor:
+    """ジョブの入力から復元したメッセージの送信者"""
+
+    def __init__(self, display_name):
+        self.display_name = display_name
+        self.name = display_name
+
+
+class RemoteTyping:
+    """入力中の表示（開始時にイベントを1回書き込む）"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def __aenter__(self):
+        await self.channel.emit(EVENT_TYPING)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class RemoteMessage:
+    """
+    ワーカーが送信したメッセージ、またはジョブの入力から復元したメッセージ
+    送信したメッセージの編集・削除はイベントとして書き込みます。
+    """
+
+    def __init__(self, channel, content, author=None, created_at=None, ref=None, id=None):
+        self.id = id
+        self.channel = channel
+        self.content = content
+        self.author = author
+        self.created_at = created_at
+        self.ref = ref
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+        await self.channel.emit(EVENT_EDIT, self.ref, content)
+
+    async def delete(self):
+        await self.channel.emit(EVENT_DELETE, self.ref)
+
+
+class RemoteChannel:
+    """
+    ジョブのチャンネル
+    send などの操作をジョブキューのイベントとして書き込みます（ゲートウェイが順に反映する）。
+    """
+
+    def __init__(self, queue, job, worker):
+        self.id = job.channel_id
+        self.queue = queue
+        self.job = job
+        self.worker = worker
+        self._refs = itertools.count(1)
+
+    async def emit(self, op, ref=None, content=None):
+        # 他のプロセスがデータベースをロックしている間もイベントループを止めないよう、別スレッドで書き込む
+        await asyncio.to_thread(self.queue.emit, self.job, self.worker, op, ref, content)
+
+    async def send(self, content=None, **kwargs):
+        # 参照名に実行回数を含め、やり直した場合に前回のメッセージと区別する
+        ref = f"{self.job.attempts}:{next(self._refs)}"
+        await self.emit(EVENT_SEND, ref, content)
+        return RemoteMessage(self, content, ref=ref)
+
+    def typing(self):
+        return RemoteTyping(self)
+
+
+class RemoteContext:
+    """!ask のコマンドのコンテキスト（answer_question が使う部分だけ）"""
+
+    def __init__(self, channel, message):
+        self.channel = channel
+        self.message = message
+        self.author = message.author
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    def typing(self):
+        return self.channel.typing()
+
+
+def restore_message(channel, payload):
+    """ジョブの入力（bot.message_payload）からメッセージを復元します。"""
+    created_at = datetime.datetime.fromtimestamp(payload['created_at'], datetime.timezone.utc)
+    # id はやり直したジョブで会話履歴が重複しないようにするキーに使う（id のない古いジョブではキーを付けない）
+    return RemoteMessage(channel, payload['content'], RemoteAuthor(payload['author']), created_at, id=payload.get('id'))
+
+
+class Worker:
+    """
+    ジョブキューからジョブを取り出して実行するワーカー
+
+    Args:
+        queue (JobQueue): ジョブキュー
+        name (str): ワーカーの名前（リースの所有者として記録される）
+        concurrency (int): 同時に実行するジョブの数
+    """
+
+    def __init__(self, queue, name, concurrency):
+        self.queue = queue
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self._running = set()
+
+    async def run(self):
+        """ジョブを取り出し続けます。"""
+        while True:
+            if len(self._running) >= self.concurrency:
+                await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            try:
+                job = await asyncio.to_thread(self.queue.claim, self.name)
+            except Exception as e:
+                logger.exception("ジョブの取り出しに失敗しました: %s", e)
+                job = None
+            if job is None:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            task = asyncio.create_task(self.execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def execute(self, job):
+        """ジョブを実行し、実行中はリースを更新します。"""
+        renewer = asyncio.create_task(self._renew(job))
+        channel = RemoteChannel(self.queue, job, self.name)
+        try:
+            if job.attempts > 1:
+                # 前回の実行が途中で止まった場合は、送信済みのメッセージを消してからやり直す
+                await channel.emit(EVENT_RESET)
+            # 他のワーカーが同じチャンネルの履歴を更新している可能性があるため、ストアから読み込み直す
+            # （読み込みは応答時の aget_or_create が別スレッドで行う）
+            bot.channel_memories.forget(job.channel_id)
+            await self._dispatch(job, channel)
+        except Exception as e:
+            logger.exception("ジョブ%s（%s）の実行中にエラーが発生しました: %s", job.id, job.kind, e)
+            await channel.send(f"エラーが発生しました: {str(e)}")
+        finally:
+            renewer.cancel()
+            await asyncio.to_thread(self.queue.complete, job, self.name)
+
+    async def _dispatch(self, job, channel):
+        payload = job.payload
+        if job.kind == JOB_SEARCH:
+            await bot.handle_search(restore_message(channel, payload['message']), payload['query'])
+        elif job.kind == JOB_RESPOND:
+            messages = [restore_message(channel, message) for message in payload['messages']]
+            await bot.respond_to_messages(job.channel_id, messages, payload['direct'])
+        elif job.kind == JOB_ASK:
+            ctx = RemoteContext(channel, restore_message(channel, payload['message']))
+            await bot.answer_question(ctx, payload['question'])
+        else:
+            raise ValueError(f"不明なジョブの種類です: {job.kind}")
+
+    async def _renew(self, job):
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            if not await asyncio.to_thread(self.queue.renew, job.id, self.name):
+                logger.warning("ジョブ%sのリースが他のワーカーに移りました", job.id)
+                return
+
+
+async def main(concurrency, name):
+    bot.load_settings()
+    # 設定ファイルの変更（ゲートウェイの !config など）を読み込む
+    if bot.SETTINGS_WATCH_INTERVAL > 0:
+        asyncio.create_task(bot.settings_store.watch(bot.apply_settings))
+    asyncio.create_task(bot.evict_idle_memories())
+    if bot.LAZY_STARTUP:
+        asyncio.create_task(bot.warm_up())
+    worker = Worker(JobQueue(), name, concurrency)
+    print(f"ワーカー {name} を起動しました（同時実行数 {worker.concurrency}）")
+    try:
+        await worker.run()
+    finally:
+        await bot.close_resources()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='検索・LLM呼び出しのワーカー')
+    parser.add_argument('--concurrency', type=int, default=bot.bot_settings['llm_max_concurrency'],
+                        help='同時に実行するジョブの数')
+    parser.add_argument('--name', default=f"{socket.gethostname()}-{os.getpid()}", help='ワーカーの名前')
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.concurrency, args.name))
+    except KeyboardInterrupt:
+        sys.exit(0)